@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# Онлайн бэкап базы бота через SQLite backup API - бот продолжает работать и писать.
+# Запуск: python backup.py [--dir backups] [--incremental] [--keep-days 45]
+#         python backup.py --restore restored.db [--dir backups]
+#
+# Полный бэкап - сжатая копия БД (starlink_bot_backup_<дата>.db.gz).
+# Инкрементальный - только страницы, изменившиеся с прошлого бэкапа
+# (starlink_bot_backup_<дата>.delta.gz). Восстановление: полный бэкап и
+# затем все инкрементальные после него по порядку (цепочка в backup_state.json).
+# Код выхода 1 при ошибке.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from config import (
+    DATABASE_NAME, BACKUP_DIR, BACKUP_STEP_PAGES, BACKUP_STEP_PAUSE,
+    BACKUP_FULL_EVERY, BACKUP_RETENTION_DAYS,
+)
+
+
+PREFIX = 'starlink_bot_backup_'
+STATE_FILE = 'backup_state.json'
+PAGES_FILE = 'backup_pages.idx'  # Хэши страниц последнего бэкапа (для инкрементального)
+DELTA_MAGIC = b'SLDELTA1'
+PAGE_HASH_SIZE = 8
+
+
+class BackupError(Exception):
+    pass
+
+
+def snapshot(source_path, target_path, pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    """Согласованная копия БД через backup API шагами по pages страниц.
+    В режиме WAL копия читается из одного снимка открытой транзакции чтения:
+    запись бота не блокируется и не заставляет бэкап начинаться заново.
+    Без WAL между шагами делается пауза, чтобы бот успевал записывать.
+    Проверяет копию PRAGMA integrity_check. Возвращает (размер страницы, число страниц).
+    """
+    source = sqlite3.connect(source_path, isolation_level=None, timeout=30)
+    target = sqlite3.connect(target_path)
+    try:
+        wal = source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+        if wal:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+        def progress(status, remaining, total):
+            if remaining and not wal:
+                time.sleep(pause)
+
+        source.backup(target, pages=pages, progress=progress)
+        if wal:
+            source.execute('COMMIT')
+
+        # Копия должна быть одним самодостаточным файлом, без -wal
+        target.execute('PRAGMA journal_mode = DELETE')
+        result = target.execute('PRAGMA integrity_check').fetchall()
+        if result != [('ok',)]:
+            raise BackupError(f"integrity_check копии: {'; '.join(row[0] for row in result[:5])}")
+        page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        source.close()
+        target.close()
+    return page_size, page_count
+
+
+def read_pages(path, page_size):
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            yield page
+
+
+def page_hash(page):
+    return hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+
+
+def write_page_index(path, page_size, hashes):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('>I', page_size))
+        f.write(b''.join(hashes))
+    os.replace(tmp_path, path)
+
+
+def read_page_index(path):
+    """(размер страницы, список хэшей страниц) или None"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    page_size = struct.unpack('>I', data[:4])[0]
+    return page_size, [data[i:i + PAGE_HASH_SIZE] for i in range(4, len(data), PAGE_HASH_SIZE)]
+
+
+def compress_file(source_path, target_path):
+    tmp_path = target_path + '.tmp'
+    with open(source_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, target_path)
+
+
+def write_delta(snapshot_path, target_path, page_size, page_count, changed):
+    """Файл изменений: заголовок (размер страницы, число страниц) и измененные страницы с номерами"""
+    tmp_path = target_path + '.tmp'
+    with open(snapshot_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+        dst.write(DELTA_MAGIC + struct.pack('>II', page_size, page_count))
+        for page_no in changed:
+            src.seek(page_no * page_size)
+            dst.write(struct.pack('>I', page_no) + src.read(page_size))
+    os.replace(tmp_path, target_path)
+
+
+def apply_delta(delta_path, db_path):
+    with gzip.open(delta_path, 'rb') as src, open(db_path, 'r+b') as dst:
+        header = src.read(len(DELTA_MAGIC) + 8)
+        if header[:len(DELTA_MAGIC)] != DELTA_MAGIC:
+            raise BackupError(f"{delta_path}: не файл инкрементального бэкапа")
+        page_size, page_count = struct.unpack('>II', header[len(DELTA_MAGIC):])
+        while True:
+            record = src.read(4 + page_size)
+            if not record:
+                break
+            page_no = struct.unpack('>I', record[:4])[0]
+            dst.seek(page_no * page_size)
+            dst.write(record[4:])
+        dst.truncate(page_count * page_size)
+
+
+def load_state(backup_dir):
+    try:
+        with open(os.path.join(backup_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(backup_dir, state):
+    path = os.path.join(backup_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def run_backup(backup_dir, incremental=False, source_path=DATABASE_NAME):
+    """Делает бэкап, возвращает путь к созданному файлу"""
+    if not os.path.exists(source_path):
+        raise BackupError(f"База данных не найдена: {source_path}")
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    started = time.perf_counter()
+    # Снимок кладется рядом с бэкапами: os.replace и большие файлы в пределах одного диска
+    fd, snapshot_path = tempfile.mkstemp(prefix='snapshot_', suffix='.db', dir=backup_dir)
+    os.close(fd)
+    try:
+        page_size, page_count = snapshot(source_path, snapshot_path)
+        print(f"Снимок БД: {page_count} страниц по {page_size} байт за {time.perf_counter() - started:.1f} с, integrity_check: ok")
+
+        state = load_state(backup_dir)
+        previous = read_page_index(os.path.join(backup_dir, PAGES_FILE)) if state else None
+        if incremental and previous and previous[0] == page_size and len(state['chain']) < BACKUP_FULL_EVERY:
+            old_hashes = previous[1]
+            hashes, changed = [], []
+            for page_no, page in enumerate(read_pages(snapshot_path, page_size)):
+                digest = page_hash(page)
+                hashes.append(digest)
+                if page_no >= len(old_hashes) or old_hashes[page_no] != digest:
+                    changed.append(page_no)
+            backup_path = os.path.join(backup_dir, f'{PREFIX}{stamp}.delta.gz')
+            worker = threading.Thread(
+                target=write_delta, args=(snapshot_path, backup_path, page_size, page_count, changed)
+            )
+            worker.start()
+            state['chain'].append(os.path.basename(backup_path))
+            print(f"Инкрементальный бэкап: изменено {len(changed)} из {page_count} страниц")
+        else:
+            # Сжатие в фоне, пока считаются хэши страниц для следующего инкрементального
+            backup_path = os.path.join(backup_dir, f'{PREFIX}{stamp}.db.gz')
+            worker = threading.Thread(target=compress_file, args=(snapshot_path, backup_path))
+            worker.start()
+            hashes = [page_hash(page) for page in read_pages(snapshot_path, page_size)]
+            state = {'base': os.path.basename(backup_path), 'chain': []}
+            print("Полный бэкап")
+
+        worker.join()
+        if not os.path.exists(backup_path):
+            raise BackupError(f"Файл бэкапа не создан: {backup_path}")
+        # Индекс страниц и цепочка обновляются только после успешной записи бэкапа
+        write_page_index(os.path.join(backup_dir, PAGES_FILE), page_size, hashes)
+        save_state(backup_dir, state)
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+    return backup_path
+
+
+def restore(backup_dir, target_path):
+    """Восстанавливает БД из последнего полного бэкапа и инкрементальных после него"""
+    state = load_state(backup_dir)
+    if not state:
+        raise BackupError(f"Нет {STATE_FILE} в {backup_dir}")
+    tmp_path = target_path + '.tmp'
+    with gzip.open(os.path.join(backup_dir, state['base']), 'rb') as src, open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    for name in state['chain']:
+        apply_delta(os.path.join(backup_dir, name), tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    if result != [('ok',)]:
+        raise BackupError(f"integrity_check восстановленной БД: {'; '.join(row[0] for row in result[:5])}")
+    os.replace(tmp_path, target_path)
+    # WAL старой БД относится к другому содержимому и не должен примениться к восстановленной
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    return 1 + len(state['chain'])
+
+
+def prune(backup_dir, keep_days):
+    """Удаляет файлы бэкапов старше keep_days, кроме файлов текущей цепочки"""
+    state = load_state(backup_dir) or {'base': None, 'chain': []}
+    keep = {state['base'], *state['chain']}
+    cutoff = time.time() - keep_days * 86400
+    removed = 0
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        if name.startswith(PREFIX) and name not in keep and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Онлайн бэкап базы бота")
+    parser.add_argument('--dir', default=BACKUP_DIR, help="каталог бэкапов")
+    parser.add_argument('--db', default=DATABASE_NAME, help="файл БД")
+    parser.add_argument('--incremental', action='store_true',
+                        help=f"только измененные страницы (полный - каждые {BACKUP_FULL_EVERY + 1} запусков)")
+    parser.add_argument('--keep-days', type=int, default=BACKUP_RETENTION_DAYS)
+    parser.add_argument('--restore', metavar='TARGET_DB', help="восстановить БД в указанный файл")
+    args = parser.parse_args()
+
+    try:
+        if args.restore:
+            files = restore(args.dir, args.restore)
+            print(f"✅ БД восстановлена в {args.restore} (файлов бэкапа: {files})")
+            return 0
+        backup_path = run_backup(args.dir, args.incremental, args.db)
+    except (BackupError, sqlite3.Error, OSError) as e:
+        print(f"❌ Ошибка бэкапа: {e}")
+        return 1
+
+    size_mb = os.path.getsize(backup_path) / (1024 * 1024)
+    print(f"✅ Бэкап создан: {backup_path} ({size_mb:.1f} МБ)")
+    removed = prune(args.dir, args.keep_days)
+    if removed:
+        print(f"Удалено старых файлов бэкапа: {removed}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
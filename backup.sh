@@ -4,9 +4,14 @@
 BOT_DIR="/opt/bots/starlink_bot"
 BACKUP_DIR="/opt/bots/starlink_bot/backups"
 DB_FILE="$BOT_DIR/bot_data.db"
+PYTHON="$BOT_DIR/venv/bin/python"
 RETENTION_DAYS=45
-DATE=$(date +%Y%m%d_%H%M%S)
-BACKUP_FILE="$BACKUP_DIR/starlink_bot_backup_$DATE.db"
+# Полный бэкап по воскресеньям, в остальные дни - только измененные страницы
+if [ "$(date +%u)" = "7" ]; then
+    MODE=""
+else
+    MODE="--incremental"
+fi
 
 # Создаем директорию для бэкапов если не существует
 mkdir -p "$BACKUP_DIR"
@@ -17,32 +22,21 @@ if [ ! -f "$DB_FILE" ]; then
     exit 1
 fi
 
-# Создаем бэкап
+# Создаем бэкап через SQLite backup API (бот может продолжать работу),
+# копия проверяется integrity_check, сжимается и удаляются бэкапы старше RETENTION_DAYS дней
 echo "Создание бэкапа базы данных..."
-cp "$DB_FILE" "$BACKUP_FILE"
-
-# Сжимаем бэкап для экономии места
-if command -v gzip &> /dev/null; then
-    echo "Сжатие бэкапа..."
-    gzip "$BACKUP_FILE"
-    BACKUP_FILE="${BACKUP_FILE}.gz"
-fi
-
-# Проверяем успешность создания бэкапа
-if [ -f "$BACKUP_FILE" ]; then
-    BACKUP_SIZE=$(du -h "$BACKUP_FILE" | cut -f1)
-    echo "✅ Бэкап успешно создан: $BACKUP_FILE (размер: $BACKUP_SIZE)"
-else
+cd "$BOT_DIR"
+if ! "$PYTHON" backup.py --db "$DB_FILE" --dir "$BACKUP_DIR" --keep-days $RETENTION_DAYS $MODE; then
     echo "❌ Ошибка: Бэкап не был создан"
     exit 1
 fi
 
-# Удаляем старые бэкапы (старше RETENTION_DAYS дней)
-echo "Удаление бэкапов старше $RETENTION_DAYS дней..."
-find "$BACKUP_DIR" -name "starlink_bot_backup_*.db*" -type f -mtime +$RETENTION_DAYS -delete
+BACKUP_FILE=$(ls -t "$BACKUP_DIR"/starlink_bot_backup_*.gz | head -n 1)
+BACKUP_SIZE=$(du -h "$BACKUP_FILE" | cut -f1)
+echo "✅ Бэкап успешно создан: $BACKUP_FILE (размер: $BACKUP_SIZE)"
 
 # Показываем информацию о текущих бэкапах
-BACKUP_COUNT=$(find "$BACKUP_DIR" -name "starlink_bot_backup_*.db*" -type f | wc -l)
+BACKUP_COUNT=$(find "$BACKUP_DIR" -name "starlink_bot_backup_*.gz" -type f | wc -l)
 TOTAL_SIZE=$(du -sh "$BACKUP_DIR" | cut -f1)
 echo "Всего бэкапов: $BACKUP_COUNT"
 echo "Общий размер бэкапов: $TOTAL_SIZE"
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# Микробенчмарки функций database.py на БД с реалистичным объемом данных.
+# Запуск: python bench_db.py [--rows 10000,100000,1000000] [--threads 1] [--json bench.json]
+#         python bench_db.py --rows 100000 --keep bench_dbs --compare bench.json
+#
+# Для каждого размера генерируется БД (--keep - сохранить и переиспользовать между
+# запусками), затем каждая функция вызывается, пока не наберется --min-time секунд.
+# Результат - таблица p50 по размерам и JSON со всеми замерами; --compare печатает
+# отношение к предыдущему JSON, чтобы изменения индексов, пагинации и пула
+# измерялись, а не угадывались.
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import database
+import db_pool
+
+
+SEED_VERSION = 1  # Меняется при изменении генератора - сохраненные БД пересоздаются
+SEED_BATCH = 10000
+PURCHASES_SHARE = 0.3
+
+FIRST_NAMES = ('Иван', 'Алексей', 'Сергей', 'Дмитрий', 'Андрей', 'Михаил', 'Николай', 'Павел',
+               'Владимир', 'Евгений', 'Олег', 'Артем', 'Юрий', 'Роман', 'Виктор', 'Елена',
+               'Ольга', 'Наталья', 'Татьяна', 'Анна', 'Мария', 'Светлана', 'Ирина', 'Юлия')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев',
+              'Семенов', 'Егоров', 'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов')
+SERIAL_CHARS = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+
+
+# --- Генерация данных ---------------------------------------------------------
+
+def _serial(rng, prefix, length=12):
+    return prefix + ''.join(rng.choice(SERIAL_CHARS) for _ in range(length))
+
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" if rng.random() < 0.6 else rng.choice(FIRST_NAMES)
+
+
+def _activation_rows(rng, count, start, span, now):
+    """Строки активаций по возрастанию created_at: старые почти все обработаны,
+    свежие частично не заполнены (клиент еще проходит шаги)"""
+    step = span / max(count, 1)
+    created = start
+    for index in range(count):
+        created += timedelta(seconds=rng.uniform(0, 2 * step.total_seconds()))
+        created = min(created, now)
+        age_days = (now - created).days
+        user_id = rng.randrange(10 ** 8, 8 * 10 ** 9)
+        filled = rng.random() < (0.97 if age_days > 2 else 0.6)
+        processed = filled and rng.random() < (0.95 if age_days > 7 else 0.4)
+        paid = processed or (filled and rng.random() < 0.5)
+        provided_at = created + timedelta(hours=rng.uniform(1, 72)) if processed else None
+        if provided_at and provided_at > now:
+            provided_at = now
+        yield (
+            user_id,
+            f"+79{rng.randrange(10 ** 9):09d}",
+            _name(rng),
+            f"user{user_id}" if rng.random() < 0.7 else None,
+            created.isoformat(),
+            int(paid),
+            f"receipt-{index}" if paid else None,
+            _serial(rng, '') if filled else None,
+            f"photo-sn-{index}" if filled and rng.random() < 0.8 else None,
+            _serial(rng, '') if filled else None,
+            f"photo-box-{index}" if filled and rng.random() < 0.8 else None,
+            f"KIT{rng.randrange(10 ** 9):09d}" if filled and rng.random() < 0.5 else None,
+            'completed' if processed else ('payment_confirmed' if paid else 'pending'),
+            int(processed),
+            provided_at.isoformat() if provided_at else None,
+            f"starlink{index}@example.com" if processed else None,
+            f"pw{rng.randrange(10 ** 8):08d}" if processed else None,
+        )
+
+
+def _purchase_rows(rng, count, start, span):
+    for _ in range(count):
+        created = start + timedelta(seconds=rng.uniform(0, span.total_seconds()))
+        user_id = rng.randrange(10 ** 8, 8 * 10 ** 9)
+        yield (user_id, f"+79{rng.randrange(10 ** 9):09d}", _name(rng),
+               f"user{user_id}" if rng.random() < 0.7 else None, created.isoformat())
+
+
+def _batches(rows, size=SEED_BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(db_path, activations, years=3, seed_value=1):
+    """Заполняет новую БД: activations активаций за years лет и 30% от них покупок.
+    Строки вставляются пачками через обычные триггеры (статистика, FTS, напоминания);
+    затем, как после работы планировщика, удаляются истекшие напоминания.
+    """
+    rng = random.Random(seed_value)
+    now = datetime.now()
+    span = timedelta(days=365 * years)
+    start = now - span
+    db_pool.configure_pool(db_path)
+    database.init_database()
+
+    started = time.perf_counter()
+    inserted = 0
+    for batch in _batches(_activation_rows(rng, activations, start, span, now)):
+        with db_pool.write_connection() as conn:
+            conn.executemany('''
+                INSERT INTO activations (user_id, phone, name, username, created_at, payment_received,
+                    receipt_file_id, serial_number, serial_photo_file_id, box_serial_number,
+                    box_serial_photo_file_id, kit_number, status, service_provided,
+                    service_provided_at, email, password)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+        inserted += len(batch)
+        if inserted % (SEED_BATCH * 10) == 0:
+            print(f"  активаций: {inserted}/{activations} ({time.perf_counter() - started:.0f} с)")
+
+    for batch in _batches(_purchase_rows(rng, int(activations * PURCHASES_SHARE), start, span)):
+        with db_pool.write_connection() as conn:
+            conn.executemany(
+                'INSERT INTO purchases (user_id, phone, name, username, created_at) VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+
+    with db_pool.write_connection() as conn:
+        expired = (now - timedelta(days=30)).isoformat()
+        conn.execute('DELETE FROM reminder_schedule WHERE expires_at <= ?', (now.isoformat(),))
+    with db_pool.write_connection() as conn:
+        conn.execute('ANALYZE')
+    print(f"  БД заполнена за {time.perf_counter() - started:.0f} с")
+
+
+def prepare_database(directory, activations, years, seed_value):
+    """Путь к заполненной БД; сохраненная БД переиспользуется, если параметры совпадают"""
+    path = os.path.join(directory, f'bench_{activations}_{years}y_s{seed_value}_v{SEED_VERSION}.db')
+    if os.path.exists(path):
+        print(f"БД {path} уже заполнена")
+        db_pool.configure_pool(path)
+        return path
+    print(f"Заполнение БД: {activations} активаций...")
+    tmp_path = path + '.seeding'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(tmp_path + suffix):
+            os.remove(tmp_path + suffix)
+    seed(tmp_path, activations, years, seed_value)
+    db_pool.close_pool()
+    os.replace(tmp_path, path)
+    db_pool.configure_pool(path)
+    return path
+
+
+# --- Бенчмарки ----------------------------------------------------------------
+
+def sample_ids(rng, count=1000):
+    """Существующие id и user_id активаций для случайных обращений"""
+    with db_pool.read_connection() as conn:
+        max_id = conn.execute('SELECT MAX(id) FROM activations').fetchone()[0] or 1
+        ids = [rng.randint(1, max_id) for _ in range(count)]
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(
+            f'SELECT id, user_id, created_at FROM activations WHERE id IN ({placeholders})', ids
+        ).fetchall()
+    return rows
+
+
+def benchmarks(rows, rng):
+    """[(имя, группа, функция без аргументов)]; аргументы берутся из существующих строк.
+    Запись - в конце: добавленные строки (несколько тысяч) почти не меняют объем БД,
+    сохраненной через --keep.
+    """
+    ids = [row[0] for row in rows]
+    user_ids = [row[1] for row in rows]
+    middle = sorted(rows, key=lambda row: row[2])[len(rows) // 2]
+    middle_cursor = database.encode_page_cursor(middle[2], middle[0])
+    now = datetime.now()
+    month_ago = (now - timedelta(days=30)).strftime('%Y-%m-%d')
+    year_ago = (now - timedelta(days=365)).strftime('%Y-%m-%d')
+
+    def export_all():
+        return sum(1 for _ in database.iter_activations_for_export())
+
+    return [
+        ('find_activation_by_request_number', 'заявка', lambda: database.find_activation_by_request_number(
+            f"ST-{rng.choice(ids):06d}")),
+        ('get_activation_by_id', 'заявка', lambda: database.get_activation_by_id(rng.choice(ids))),
+        ('search_requests(name)', 'поиск', lambda: database.search_requests(rng.choice(LAST_NAMES))),
+        ('search_requests(phone)', 'поиск', lambda: database.search_requests(f"+79{rng.randrange(10 ** 4):04d}")),
+        ('get_pending_activations_page', 'списки', lambda: database.get_pending_activations_page(None, None, 10)),
+        ('get_processed_activations_page(mid)', 'списки', lambda: database.get_processed_activations_page(
+            middle_cursor, None, 10)),
+        ('get_activation_list(mid)', 'списки', lambda: database.get_activation_list(middle_cursor, None, 20)),
+        ('get_pending_activation_list(mid)', 'списки', lambda: database.get_pending_activation_list(
+            middle_cursor, None, 20)),
+        ('get_purchases_page', 'списки', lambda: database.get_purchases_page(None, 20)),
+        ('get_statistics', 'статистика', database.get_statistics),
+        ('get_daily_statistics(30d)', 'статистика', lambda: database.get_daily_statistics(month_ago)),
+        ('get_weekly_statistics(1y)', 'статистика', lambda: database.get_weekly_statistics(year_ago)),
+        ('get_due_reminders', 'напоминания', lambda: database.get_due_reminders(now.isoformat(), 100)),
+        ('get_upcoming_reminders', 'напоминания', lambda: database.get_upcoming_reminders(100)),
+        ('get_activation_reminders', 'напоминания', lambda: database.get_activation_reminders(rng.choice(ids))),
+        ('get_activation_for_export', 'экспорт', lambda: database.get_activation_for_export(rng.choice(ids))),
+        ('get_export_column_stats', 'экспорт', database.get_export_column_stats),
+        ('iter_activations_for_export', 'экспорт', export_all),
+        ('update_activation_receipt', 'запись', lambda: database.update_activation_receipt(
+            rng.choice(user_ids), 'bench-receipt')),
+        ('add_activation', 'запись', lambda: bool(database.add_activation(
+            rng.randrange(10 ** 8, 8 * 10 ** 9), f"+79{rng.randrange(10 ** 9):09d}", _name(rng), None))),
+    ]
+
+
+def _result_size(result):
+    """Число строк результата: список, (список, есть ли следующая страница), словарь,
+    счетчик строк (int) или одна строка"""
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, (list, dict)):
+        return len(result)
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result
+    return 1 if result else 0
+
+
+def measure(func, threads, min_time, max_calls):
+    """Вызывает func из threads потоков, пока не пройдет min_time секунд (не меньше 3 и не
+    больше max_calls вызовов на поток). Возвращает статистику задержек одного вызова."""
+    result_size = _result_size(func())  # Прогрев кэша страниц и подготовленных запросов
+
+    def worker():
+        timings = []
+        deadline = time.perf_counter() + min_time
+        while len(timings) < 3 or (time.perf_counter() < deadline and len(timings) < max_calls):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    started = time.perf_counter()
+    if threads == 1:
+        timings = worker()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            timings = [t for part in executor.map(lambda _: worker(), range(threads)) for t in part]
+    wall = time.perf_counter() - started
+
+    timings.sort()
+    pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))] * 1000  # noqa: E731
+    return {
+        'calls': len(timings),
+        'rows': result_size,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': pick(0.5),
+        'p95_ms': pick(0.95),
+        'min_ms': timings[0] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'calls_per_s': len(timings) / wall if wall else 0.0,
+    }
+
+
+def run_size(activations, args, directory):
+    prepare_database(directory, activations, args.years, args.seed)
+    rng = random.Random(args.seed)
+    rows = sample_ids(rng)
+    results = {}
+    for name, group, func in benchmarks(rows, rng):
+        if args.only and not any(part in name for part in args.only):
+            continue
+        stats = measure(func, args.threads, args.min_time, args.max_calls)
+        stats['group'] = group
+        results[name] = stats
+        print(f"  {name:<45} p50 {stats['p50_ms']:>9.3f} мс  p95 {stats['p95_ms']:>9.3f} мс  "
+              f"строк {stats['rows']:>8}  ({stats['calls']} выз.)")
+    db_pool.close_pool()
+    return results
+
+
+def print_table(report, baseline=None):
+    sizes = list(report['results'])
+    names = []
+    for results in report['results'].values():
+        names += [name for name in results if name not in names]
+
+    header = f"{'Функция (p50, мс)':<45}" + ''.join(f"{size:>14}" for size in sizes)
+    print('\n' + header)
+    print('-' * len(header))
+    for name in names:
+        line = f"{name:<45}"
+        for size in sizes:
+            stats = report['results'][size].get(name)
+            cell = f"{stats['p50_ms']:.3f}" if stats else '-'
+            old = (baseline or {}).get('results', {}).get(size, {}).get(name)
+            if stats and old and old['p50_ms']:
+                cell += f" x{stats['p50_ms'] / old['p50_ms']:.2f}"
+            line += f"{cell:>14}"
+        print(line)
+    if baseline:
+        print("\nxN - отношение к p50 из --compare (меньше 1 - быстрее)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки функций database.py")
+    parser.add_argument('--rows', default='10000,100000',
+                        help="число активаций через запятую (например 10000,100000,1000000)")
+    parser.add_argument('--years', type=int, default=3, help="период, за который распределены заявки")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=1, help="потоков, одновременно вызывающих функцию")
+    parser.add_argument('--min-time', type=float, default=0.5, help="секунд на одну функцию")
+    parser.add_argument('--max-calls', type=int, default=2000, help="максимум вызовов на поток")
+    parser.add_argument('--only', action='append', help="только функции, содержащие подстроку")
+    parser.add_argument('--keep', metavar='DIR', help="каталог для сохранения и переиспользования БД")
+    parser.add_argument('--json', metavar='PATH', help="записать результат в JSON")
+    parser.add_argument('--compare', metavar='PATH', help="JSON предыдущего запуска для сравнения")
+    args = parser.parse_args()
+
+    sizes = [int(value.replace('_', '')) for value in args.rows.split(',') if value.strip()]
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'threads': args.threads,
+            'seed': args.seed,
+            'seed_version': SEED_VERSION,
+        },
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='bench_db_') as tmp_dir:
+        directory = args.keep or tmp_dir
+        os.makedirs(directory, exist_ok=True)
+        for activations in sizes:
+            print(f"\n=== {activations} активаций ===")
+            report['results'][str(activations)] = run_size(activations, args, directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат записан в {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import re
+
+
+SEPARATOR = ":"
+MAX_CALLBACK_DATA = 64  # Ограничение Telegram на callback_data (в байтах)
+
+
+class CallbackRouter:
+    """Таблица маршрутов для callback_data вида "<префикс>:<арг1>:<арг2>...".
+
+    Префикс - короткий код с номером версии в конце ("vw1"): при смене
+    формата аргументов регистрируется новый префикс, а старые кнопки в уже
+    отправленных сообщениях обрабатываются через legacy().
+    Обработчик находится одним поиском в словаре по префиксу, аргументы
+    приводятся к типам, указанным при регистрации. Недостающие последние
+    аргументы передаются как None.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._legacy = []
+
+    def route(self, prefix, *arg_types):
+        """Декоратор: handler(update, context, *args) для callback_data с префиксом prefix"""
+        if SEPARATOR in prefix or prefix in self._routes:
+            raise ValueError(f"Некорректный или повторный префикс callback: {prefix}")
+
+        def decorator(handler):
+            self._routes[prefix] = (handler, arg_types)
+            return handler
+        return decorator
+
+    def wrap_handlers(self, wrapper):
+        """Заменяет каждый обработчик на wrapper(prefix, handler), например для метрик"""
+        for prefix, (handler, arg_types) in self._routes.items():
+            self._routes[prefix] = (wrapper(prefix, handler), arg_types)
+
+    def legacy(self, pattern, prefix, *fixed_args):
+        """Старый формат callback_data: pattern - регулярное выражение на всю строку,
+        аргументы маршрута prefix - fixed_args и затем группы совпадения.
+        """
+        self._legacy.append((re.compile(pattern), prefix, fixed_args))
+
+    def data(self, prefix, *args):
+        """callback_data для кнопки"""
+        if prefix not in self._routes:
+            raise KeyError(f"Неизвестный префикс callback: {prefix}")
+        data = SEPARATOR.join((prefix, *(str(arg) for arg in args)))
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+        return data
+
+    def pattern(self):
+        """Регулярное выражение для CallbackQueryHandler: все префиксы и старые форматы"""
+        prefixes = "|".join(re.escape(prefix) for prefix in self._routes)
+        alternatives = [f"(?:{prefixes})(?:{re.escape(SEPARATOR)}|$)"]
+        alternatives += [f"(?:{regex.pattern})$" for regex, _, _ in self._legacy]
+        return "^(?:" + "|".join(alternatives) + ")"
+
+    def resolve(self, data):
+        """(handler, args) для callback_data или None"""
+        prefix, _, raw = data.partition(SEPARATOR)
+        entry = self._routes.get(prefix)
+        if entry is not None:
+            handler, arg_types = entry
+            values = raw.split(SEPARATOR, len(arg_types) - 1) if raw and arg_types else []
+        else:
+            for regex, prefix, fixed_args in self._legacy:
+                match = regex.fullmatch(data)
+                if match:
+                    handler, arg_types = self._routes[prefix]
+                    values = [*fixed_args, *match.groups()]
+                    break
+            else:
+                return None
+
+        args = []
+        for index, arg_type in enumerate(arg_types):
+            value = values[index] if index < len(values) else None
+            args.append(None if value is None else arg_type(value))
+        return handler, args
+
+    async def dispatch(self, update, context):
+        """Вызывает обработчик для update.callback_query.data. False - маршрут не найден."""
+        resolved = self.resolve(update.callback_query.data)
+        if resolved is None:
+            return False
+        handler, args = resolved
+        await handler(update, context, *args)
+        return True
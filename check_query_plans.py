@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Проверка планов запросов database.py: ни один запрос не должен превращаться
+# в полный проход по таблице (SCAN без индекса).
+# Запуск: python check_query_plans.py  (код выхода 1 при ошибке)
+
+import inspect
+import os
+import sqlite3
+import sys
+import tempfile
+
+import database
+import db_pool
+
+
+# Аргументы для вызова каждой функции database.py.
+# Новая функция в database.py должна быть добавлена сюда, иначе проверка упадет.
+CALLS = {
+    'add_purchase': (1001, '+79990000001', 'Иван', 'ivan'),
+    'add_activation': (1001, '+79990000001', 'Иван', 'ivan'),
+    'update_activation_receipt': (1001, 'receipt'),
+    'update_activation_serial_number': (1001, 'SN123'),
+    'update_activation_serial_photo': (1001, 'photo'),
+    'update_activation_box_serial_number': (1001, 'BOX123'),
+    'update_activation_box_serial_photo': (1001, 'photo'),
+    'update_activation_kit': (1001, 'KIT123'),
+    'get_purchases_page': ('20240101100000000001_1', 20),
+    'mark_service_provided': (1,),
+    'update_activation_email_password': (1, 'mail@example.com', 'secret'),
+    'get_activation_by_id': (1,),
+    'find_activation_by_request_number': ('ST-000001',),
+    'find_purchase_by_request_number': ('BUY-000001',),
+    # Строка из цифр проходит все ветки: телефон, серийные номера и FTS
+    'search_requests': ('79990000001',),
+    'toggle_service_provided': (1,),
+    'get_upcoming_reminders': (100,),
+    'get_activation_reminders': (1,),
+    'get_due_reminders': ('2024-02-01T00:00:00', 100),
+    'queue_reminders': ([(1, 5, 1001, '2024-01-01T10:00:00', 'text')],),
+    'complete_reminders': ([(1, 5), (2, 4), (3, 4)],),
+    'get_statistics': (),
+    'get_daily_statistics': ('2024-01-01',),
+    'get_weekly_statistics': ('2024-01-01',),
+    'encode_page_cursor': ('2024-01-01T10:00:00.000001', 1),
+    'decode_page_cursor': ('20240101100000000001_1',),
+    'get_pending_activations_page': (None, None, 10),
+    'get_processed_activations_page': ('20240101100000000001_1', None, 10),
+    'get_activation_list': ('20240101100000000001_1', None, 20),
+    'get_pending_activation_list': (None, '20240101100000000001_1', 20),
+    'count_purchases': (),
+    'count_activations_by_service': (0,),
+    'iter_activations_for_export': (),
+    'get_activation_for_export': (1,),
+    'get_export_column_stats': (),
+    'save_cached_file_id': ('activation_xlsx:1', 'v1', 'file-id'),
+    'get_cached_file_id': ('activation_xlsx:1', 'v1'),
+    'enqueue_notification': ('test:1', 1001, 'text'),
+    'get_pending_outbox': ('2100-01-01T00:00:00', 100),
+    'get_outbox_message': ('test:1',),
+    'filter_pending_outbox': ([1, 2],),
+    'mark_outbox_sent': ([1, 2],),
+    'mark_outbox_failed': ([(1, '2100-01-01T00:00:00', 'error'), (2, None, 'error')],),
+    'purge_outbox': ('2000-01-01T00:00:00',),
+    'save_persisted_state': ([(1001, '{}')], [1002], [('activation', '[1001,1001]', '3')], [('purchase', '[1,1]')]),
+    'load_persisted_user_data': (),
+    'load_persisted_conversations': ('activation',),
+    'delete_activation': (2,),
+    'delete_purchase': (2,),
+}
+
+# Запросы, которым полный проход по таблице разрешен намеренно (с причиной)
+ALLOWED_SCANS = {
+    # stats_counters - несколько строк-счетчиков, читаются целиком
+    'get_statistics': 'stats_counters',
+    # Агрегаты для ширины столбцов экспорта - экспорт и так читает всю таблицу
+    'get_export_column_stats': 'activations',
+    # Загрузка сохраненных user_data при старте бота - читается вся таблица
+    'load_persisted_user_data': 'persistence_user_data',
+}
+
+CHECKED_PREFIXES = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def collect_statements(db_path):
+    """Вызывает все функции database.py на временной БД и собирает выполненные запросы"""
+    statements = []
+    current = [None]
+
+    def on_connect(conn):
+        conn.set_trace_callback(
+            lambda sql: statements.append((current[0], sql)) if current[0] else None
+        )
+
+    db_pool.configure_pool(db_path, on_connect=on_connect)
+    database.init_database()
+
+    # Немного данных, чтобы все ветки функций выполнили свои запросы
+    for i in range(3):
+        database.add_activation(1001 + i, '+7999000000%d' % i, 'Тест', None)
+        database.add_purchase(1001 + i, '+7999000000%d' % i, 'Тест', None)
+
+    functions = [
+        name for name, func in inspect.getmembers(database, inspect.isfunction)
+        if func.__module__ == database.__name__ and not name.startswith('_') and name != 'init_database'
+    ]
+    missing = [name for name in functions if name not in CALLS]
+
+    ordered = [name for name in CALLS if name in functions]
+    for name in ordered:
+        current[0] = name
+        result = getattr(database, name)(*CALLS[name])
+        if inspect.isgenerator(result):
+            list(result)
+    current[0] = None
+    db_pool.close_pool()
+    return statements, missing
+
+
+# Служебные таблицы FTS5: их читает сам модуль FTS5 (конфигурация, блоки индекса)
+FTS_SHADOW_SUFFIXES = ('_fts_config', '_fts_data', '_fts_idx', '_fts_docsize', '_fts_content')
+
+
+def find_full_scans(conn, sql):
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        # "SCAN activations" - полный проход; "SCAN activations USING INDEX ..." - проход по индексу
+        if not detail.startswith('SCAN ') or ' USING ' in detail:
+            continue
+        # "SCAN activations_fts VIRTUAL TABLE INDEX 32:M7" - поиск MATCH по индексу FTS5,
+        # пустая строка после двоеточия означала бы полный проход виртуальной таблицы
+        if ' VIRTUAL TABLE INDEX ' in detail and detail.rsplit(':', 1)[-1]:
+            continue
+        if detail.split()[1].endswith(FTS_SHADOW_SUFFIXES):
+            continue
+        scans.append(detail)
+    return plan, scans
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return check(os.path.join(tmp_dir, 'plans.db'))
+
+
+def check(db_path):
+    statements, missing = collect_statements(db_path)
+
+    failed = False
+    if missing:
+        failed = True
+        for name in missing:
+            print(f"✗ {name}: нет аргументов в CALLS, запрос не проверен")
+
+    conn = sqlite3.connect(db_path)
+    seen = set()
+    for func_name, sql in statements:
+        normalized = ' '.join(sql.split())
+        if not normalized.upper().startswith(CHECKED_PREFIXES) or (func_name, normalized) in seen:
+            continue
+        seen.add((func_name, normalized))
+
+        plan, scans = find_full_scans(conn, sql)
+        allowed = ALLOWED_SCANS.get(func_name)
+        if allowed:
+            scans = [scan for scan in scans if scan != f'SCAN {allowed}']
+        if scans:
+            failed = True
+            print(f"✗ {func_name}: полный проход по таблице")
+            print(f"    {normalized}")
+            for row in plan:
+                print(f"    -> {row[-1]}")
+        else:
+            print(f"✓ {func_name}: {'; '.join(row[-1] for row in plan)}")
+    conn.close()
+
+    if failed:
+        print("\n=== Обнаружены запросы без индекса ===")
+        return 1
+    print("\n=== Все запросы используют индексы ===")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
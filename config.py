@@ -10,3 +10,44 @@ SERIAL_NUMBER_EXAMPLE = "images/serial_number_example.jpg"  # Путь к фот
 ADMIN_IDS = [7942920768, 6925295207]  # Иван, Rich
 ADMIN_PASSWORD = "1664"  # Пароль для доступа к админ-панели
 
+DB_READ_POOL_SIZE = 4  # Количество соединений для чтения в пуле SQLite
+DB_EXECUTOR_THREADS = 2  # Потоки для выполнения запросов к БД из асинхронных обработчиков
+DB_EXECUTOR_QUEUE_SIZE = 100  # Максимум одновременно ожидающих запросов к БД
+STATS_CACHE_TTL = 30  # Сколько секунд админ-статистика отдается из кэша
+EXPORT_WORKERS = 1  # Процессы для формирования Excel файлов
+EXPORT_PROGRESS_INTERVAL = 3  # Как часто (в секундах) обновлять сообщение о прогрессе экспорта
+REMINDER_PREFETCH = 100  # Сколько ближайших напоминаний держать в памяти планировщика
+REMINDER_MAX_SLEEP = 3600  # Максимальный интервал (в секундах) между проверками расписания напоминаний
+TELEGRAM_GLOBAL_RATE = 25  # Сообщений в секунду на весь бот (лимит Telegram - около 30)
+TELEGRAM_CHAT_INTERVAL = 1.0  # Минимальный интервал (в секундах) между сообщениями в один чат
+DELIVERY_CONCURRENCY = 8  # Одновременных запросов к Telegram при рассылках
+DELIVERY_MAX_RETRIES = 3  # Повторов отправки при RetryAfter и сетевых ошибках
+OUTBOX_BATCH_SIZE = 100  # Сообщений outbox, отправляемых за один проход
+OUTBOX_POLL_INTERVAL = 5  # Как часто (в секундах) проверять outbox, если нет новых сообщений
+OUTBOX_MAX_ATTEMPTS = 8  # Попыток отправки сообщения до отказа
+OUTBOX_RETRY_BASE_DELAY = 30  # Задержка перед первым повтором (в секундах), дальше удваивается
+OUTBOX_RETENTION_DAYS = 7  # Сколько дней хранить отправленные сообщения (для защиты от дублей)
+PERSISTENCE_UPDATE_INTERVAL = 5  # Как часто (в секундах) сохранять состояния диалогов в БД
+WEBHOOK_URL = ""  # Внешний адрес бота (https://example.com); пусто - режим polling
+WEBHOOK_LISTEN = "127.0.0.1"  # Адрес встроенного HTTP сервера (за reverse proxy с TLS)
+WEBHOOK_PORT = 8080  # Порт встроенного HTTP сервера
+WEBHOOK_PATH = "/telegram"  # Путь, на который Telegram присылает обновления
+WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+UPDATE_CONCURRENCY = 16  # Сколько обновлений разных пользователей обрабатывается одновременно
+UPDATE_QUEUE_LIMIT = 256  # Максимум обновлений в работе и в очереди на обработку
+BACKUP_DIR = "backups"  # Каталог бэкапов БД (backup.py)
+BACKUP_STEP_PAGES = 1024  # Страниц БД, копируемых за один шаг backup API
+BACKUP_STEP_PAUSE = 0.01  # Пауза (в секундах) между шагами, если БД не в режиме WAL
+BACKUP_FULL_EVERY = 7  # Полный бэкап после стольких инкрементальных подряд
+BACKUP_RETENTION_DAYS = 45  # Сколько дней хранить файлы бэкапов
+METRICS_ENABLED = True  # Замер времени обработчиков и запросов к БД (False - без накладных расходов)
+METRICS_LISTEN = "127.0.0.1"  # Адрес HTTP сервера метрик Prometheus в режиме polling
+METRICS_PORT = 9100  # Порт сервера метрик в режиме polling (0 - не запускать); в режиме webhook метрики на сервере webhook
+METRICS_PATH = "/metrics"  # Путь метрик в формате Prometheus
+LOG_LEVEL = "INFO"  # Уровень логов бота (DEBUG, INFO, WARNING, ERROR)
+LOG_FORMAT = "json"  # Формат записей: json - одна JSON строка на запись, text - для чтения глазами
+LOG_DEBUG_SAMPLE_RATE = 0.1  # Доля записываемых DEBUG записей (1.0 - все)
+LOG_QUEUE_SIZE = 10000  # Записей в очереди к потоку логов; при переполнении новые отбрасываются
+LOG_FILE = "logs/starlink_bot.log"  # Файл логов с ротацией; если stdout подключен к journald - логи пишутся в stdout
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Размер файла логов, после которого он ротируется
+LOG_BACKUP_COUNT = 5  # Сколько старых файлов логов хранить
@@ -1,492 +1,744 @@
-import sqlite3
+import re
 from datetime import datetime
-from config import DATABASE_NAME
+from db_pool import read_connection, write_connection
+from migrations import migrate
+from metrics import instrument_module, DB_METRIC
+from models import (
+    Activation, ActivationListItem, ActivationPageItem, Purchase, SearchResult, row_factory,
+    ACTIVATION_COLUMNS, ACTIVATION_LIST_COLUMNS, PURCHASE_COLUMNS,
+)
+import notifications
 
 
 def init_database():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS purchases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            phone TEXT NOT NULL,
-            name TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS activations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            phone TEXT NOT NULL,
-            name TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            payment_received INTEGER DEFAULT 0,
-            receipt_file_id TEXT,
-            serial_number TEXT,
-            serial_photo_file_id TEXT,
-            box_serial_number TEXT,
-            box_serial_photo_file_id TEXT,
-            kit_number TEXT,
-            status TEXT DEFAULT 'pending',
-            service_provided INTEGER DEFAULT 0,
-            service_provided_at TEXT,
-            last_reminder_day INTEGER
-        )
-    ''')
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN serial_number TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN serial_photo_file_id TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN box_serial_number TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN box_serial_photo_file_id TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN last_reminder_day INTEGER
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN service_provided INTEGER DEFAULT 0
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN service_provided_at TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN email TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN password TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE purchases ADD COLUMN username TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('''
-            ALTER TABLE activations ADD COLUMN username TEXT
-        ''')
-    except sqlite3.OperationalError:
-        pass
-    
-    conn.commit()
-    conn.close()
+    """Приводит схему БД к актуальной версии (см. migrations.py)"""
+    with write_connection() as conn:
+        migrate(conn)
 
 
-def add_purchase(user_id, phone, name, username=None):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO purchases (user_id, phone, name, username, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, phone, name, username, datetime.now().isoformat()))
-    conn.commit()
-    purchase_id = cursor.lastrowid
-    conn.close()
-    return purchase_id
-
-
-def add_activation(user_id, phone, name, username=None):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO activations (user_id, phone, name, username, created_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, phone, name, username, datetime.now().isoformat()))
-    conn.commit()
-    activation_id = cursor.lastrowid
-    conn.close()
-    return activation_id
-
-
-def update_activation_receipt(user_id, receipt_file_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET payment_received = 1, receipt_file_id = ?, status = 'payment_confirmed'
-        WHERE user_id = ? AND status = 'pending'
-    ''', (receipt_file_id, user_id))
-    conn.commit()
-    conn.close()
+_ACTIVATION_ROW = row_factory(Activation)
+_ACTIVATION_LIST_ROW = row_factory(ActivationListItem)
+_ACTIVATION_PAGE_ROW = row_factory(ActivationPageItem)
+_PURCHASE_ROW = row_factory(Purchase)
 
 
-def update_activation_serial_number(user_id, serial_number):
-    conn = sqlite3.connect(DATABASE_NAME)
+def _query(conn, factory, sql, params=()):
+    """Курсор, строки которого создаются row_factory модели"""
     cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET serial_number = ?
-        WHERE user_id = ? AND serial_number IS NULL
-    ''', (serial_number, user_id))
-    conn.commit()
-    conn.close()
+    cursor.row_factory = factory
+    return cursor.execute(sql, params)
 
 
-def update_activation_serial_photo(user_id, photo_file_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET serial_photo_file_id = ?
-        WHERE user_id = ? AND serial_photo_file_id IS NULL
-    ''', (photo_file_id, user_id))
-    conn.commit()
-    conn.close()
+def add_purchase(user_id, phone, name, username=None):
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO purchases (user_id, phone, name, username, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, phone, name, username, datetime.now().isoformat()))
+        return cursor.lastrowid
 
 
-def update_activation_box_serial_number(user_id, box_serial_number):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET box_serial_number = ?
-        WHERE user_id = ? AND box_serial_number IS NULL
-    ''', (box_serial_number, user_id))
-    conn.commit()
-    conn.close()
+def add_activation(user_id, phone, name, username=None, notify=False):
+    """notify=True - в той же транзакции ставит в outbox сообщение с номером заявки"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO activations (user_id, phone, name, username, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, phone, name, username, datetime.now().isoformat()))
+        activation_id = cursor.lastrowid
+        if notify:
+            _enqueue(conn, *notifications.activation_created(activation_id, user_id))
+        return activation_id
+
+
+def update_activation_receipt(user_id, receipt_file_id, notify=False):
+    """Возвращает число обновленных заявок.
+    notify=True - в той же транзакции ставит в outbox подтверждение платежа,
+    если нашлась ожидающая оплаты заявка.
+    """
+    with write_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE activations 
+            SET payment_received = 1, receipt_file_id = ?, status = 'payment_confirmed'
+            WHERE user_id = ? AND status = 'pending'
+        ''', (receipt_file_id, user_id))
+        if notify and cursor.rowcount > 0:
+            _enqueue(conn, *notifications.payment_received(user_id, receipt_file_id))
+        return cursor.rowcount
 
 
-def update_activation_box_serial_photo(user_id, photo_file_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET box_serial_photo_file_id = ?
-        WHERE user_id = ? AND box_serial_photo_file_id IS NULL
-    ''', (photo_file_id, user_id))
-    conn.commit()
-    conn.close()
+def update_activation_serial_number(user_id, serial_number):
+    with write_connection() as conn:
+        conn.execute('''
+            UPDATE activations 
+            SET serial_number = ?
+            WHERE user_id = ? AND serial_number IS NULL
+        ''', (serial_number, user_id))
 
 
-def update_activation_kit(user_id, kit_number):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET kit_number = ?, status = 'completed'
-        WHERE user_id = ? AND status = 'payment_confirmed'
-    ''', (kit_number, user_id))
-    conn.commit()
-    conn.close()
+def update_activation_serial_photo(user_id, photo_file_id):
+    with write_connection() as conn:
+        conn.execute('''
+            UPDATE activations 
+            SET serial_photo_file_id = ?
+            WHERE user_id = ? AND serial_photo_file_id IS NULL
+        ''', (photo_file_id, user_id))
 
 
-def get_all_purchases():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, username, created_at
-        FROM purchases
-        ORDER BY created_at DESC
-    ''')
-    purchases = cursor.fetchall()
-    conn.close()
-    return purchases
-
-
-def get_all_activations():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, username, created_at, payment_received, 
-               receipt_file_id, serial_number, serial_photo_file_id, 
-               box_serial_number, box_serial_photo_file_id, kit_number, 
-               status, service_provided, service_provided_at, email, password
-        FROM activations
-        ORDER BY created_at DESC
-    ''')
-    activations = cursor.fetchall()
-    conn.close()
-    return activations
+def update_activation_box_serial_number(user_id, box_serial_number):
+    with write_connection() as conn:
+        conn.execute('''
+            UPDATE activations 
+            SET box_serial_number = ?
+            WHERE user_id = ? AND box_serial_number IS NULL
+        ''', (box_serial_number, user_id))
 
 
-def get_pending_activations():
-    """Получает ожидающие (необработанные) активации, отсортированные по дате и номеру заявки"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, username, created_at, payment_received, 
-               receipt_file_id, serial_number, serial_photo_file_id, 
-               box_serial_number, box_serial_photo_file_id, kit_number, 
-               status, service_provided, service_provided_at, email, password
-        FROM activations
-        WHERE service_provided = 0
-        ORDER BY created_at DESC, id DESC
-    ''')
-    activations = cursor.fetchall()
-    conn.close()
-    return activations
+def update_activation_box_serial_photo(user_id, photo_file_id):
+    with write_connection() as conn:
+        conn.execute('''
+            UPDATE activations 
+            SET box_serial_photo_file_id = ?
+            WHERE user_id = ? AND box_serial_photo_file_id IS NULL
+        ''', (photo_file_id, user_id))
 
 
-def get_processed_activations():
-    """Получает обработанные активации, отсортированные по дате обработки и номеру заявки"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, username, created_at, payment_received, 
-               receipt_file_id, serial_number, serial_photo_file_id, 
-               box_serial_number, box_serial_photo_file_id, kit_number, 
-               status, service_provided, service_provided_at, email, password
-        FROM activations
-        WHERE service_provided = 1
-        ORDER BY service_provided_at DESC, id DESC
-    ''')
-    activations = cursor.fetchall()
-    conn.close()
-    return activations
+def update_activation_kit(user_id, kit_number):
+    with write_connection() as conn:
+        conn.execute('''
+            UPDATE activations 
+            SET kit_number = ?, status = 'completed'
+            WHERE user_id = ? AND status = 'payment_confirmed'
+        ''', (kit_number, user_id))
+
+
+def get_purchases_page(after=None, limit=20):
+    """Страница покупок, новые первыми: ([Purchase], есть ли еще строки).
+    after - курсор (encode_page_cursor) последней строки предыдущей страницы.
+    """
+    query = f'SELECT {PURCHASE_COLUMNS} FROM purchases'
+    params = []
+    if after is not None:
+        value, row_id = decode_page_cursor(after)
+        query += ' WHERE created_at <= ? AND (created_at < ? OR id < ?)'
+        params += [value, value, row_id]
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    
+    with read_connection() as conn:
+        rows = _query(conn, _PURCHASE_ROW, query, params).fetchall()
+    return rows[:limit], len(rows) > limit
 
 
 def mark_service_provided(activation_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET service_provided = 1, service_provided_at = ?
-        WHERE id = ?
-    ''', (datetime.now().isoformat(), activation_id))
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
-
-
-def get_activations_for_subscription_reminders():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, service_provided_at, last_reminder_day
-        FROM activations
-        WHERE service_provided = 1 AND service_provided_at IS NOT NULL
-    ''')
-    activations = cursor.fetchall()
-    conn.close()
-    return activations
-
-
-def update_last_reminder_day(activation_id, days_left):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET last_reminder_day = ?
-        WHERE id = ?
-    ''', (days_left, activation_id))
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE activations 
+            SET service_provided = 1, service_provided_at = ?
+            WHERE id = ?
+        ''', (datetime.now().isoformat(), activation_id))
+        return cursor.rowcount > 0
 
 
 def update_activation_email_password(activation_id, email, password):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE activations 
-        SET email = ?, password = ?
-        WHERE id = ?
-    ''', (email, password, activation_id))
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+    with write_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE activations 
+            SET email = ?, password = ?
+            WHERE id = ?
+        ''', (email, password, activation_id))
+        return cursor.rowcount > 0
 
 
 def get_activation_by_id(activation_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user_id, phone, name, username, created_at, payment_received, 
-               receipt_file_id, serial_number, serial_photo_file_id, 
-               box_serial_number, box_serial_photo_file_id, kit_number, 
-               status, service_provided, service_provided_at, email, password
-        FROM activations
-        WHERE id = ?
-    ''', (activation_id,))
-    activation = cursor.fetchone()
-    conn.close()
-    return activation
+    with read_connection() as conn:
+        return _query(conn, _ACTIVATION_ROW, f'''
+            SELECT {ACTIVATION_COLUMNS}
+            FROM activations
+            WHERE id = ?
+        ''', (activation_id,)).fetchone()
 
 
 def find_activation_by_request_number(request_number):
     """Ищет активацию по номеру заявки (ST-000001)"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
     # Парсим номер заявки ST-000001 -> 1
     try:
         if request_number.upper().startswith('ST-'):
             activation_id = int(request_number.upper().replace('ST-', ''))
         else:
             activation_id = int(request_number)
-        
-        cursor.execute('''
-            SELECT id, user_id, phone, name, username, created_at, payment_received, 
-                   receipt_file_id, serial_number, serial_photo_file_id, 
-                   box_serial_number, box_serial_photo_file_id, kit_number, 
-                   status, service_provided, service_provided_at, email, password
-            FROM activations
-            WHERE id = ?
-        ''', (activation_id,))
-        activation = cursor.fetchone()
-        conn.close()
-        return activation
     except (ValueError, AttributeError):
-        conn.close()
         return None
+    
+    return get_activation_by_id(activation_id)
 
 
 def find_purchase_by_request_number(request_number):
     """Ищет покупку по номеру заявки (BUY-000001)"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
     # Парсим номер заявки BUY-000001 -> 1
     try:
         if request_number.upper().startswith('BUY-'):
             purchase_id = int(request_number.upper().replace('BUY-', ''))
         else:
             purchase_id = int(request_number)
-        
-        cursor.execute('''
-            SELECT id, user_id, phone, name, username, created_at
+    except (ValueError, AttributeError):
+        return None
+    
+    with read_connection() as conn:
+        return _query(conn, _PURCHASE_ROW, f'''
+            SELECT {PURCHASE_COLUMNS}
             FROM purchases
             WHERE id = ?
-        ''', (purchase_id,))
-        purchase = cursor.fetchone()
-        conn.close()
-        return purchase
-    except (ValueError, AttributeError):
-        conn.close()
+        ''', (purchase_id,)).fetchone()
+
+
+def _prefix_range(prefix):
+    """Границы [low, high) строк, начинающихся с prefix (для поиска по индексу)"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _phone_prefix(text):
+    """Начало нормализованного телефона (+7...) для запроса из цифр, иначе None"""
+    if not re.fullmatch(r'[\d\s()+-]+', text):
         return None
+    digits = re.sub(r'\D', '', text)
+    if digits[:1] in ('7', '8'):
+        digits = digits[1:]
+    return '+7' + digits if len(digits) >= 2 else None
+
+
+def _fts_query(text):
+    """Запрос FTS5: все слова, каждое как префикс ("иван"* "petr"*)"""
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', text))
+
+
+def search_requests(text, offset=0, limit=10):
+    """Поиск активаций и покупок по телефону, имени, username, серийным номерам, KIT и email.
+    Сначала совпадения по началу телефона и серийных номеров (по алфавиту), затем
+    полнотекстовые по релевантности (bm25). Каждый источник читает не больше
+    offset + limit + 1 строк по индексу, результаты сливаются здесь.
+    Возвращает (список SearchResult, есть_ли_еще_результаты).
+    """
+    text = text.strip()
+    fetch = offset + limit + 1
+    best = {}
+
+    def collect(kind, rows, tier):
+        for row_id, name, phone, score in rows:
+            key = (tier, score, row_id)
+            previous = best.get((kind, row_id))
+            if previous is None or key < previous[0]:
+                best[(kind, row_id)] = (key, SearchResult(kind, row_id, name, phone))
+
+    phone = _phone_prefix(text)
+    serial = text.upper() if len(text) >= 2 and not text.isspace() else None
+    fts = _fts_query(text)
+    with read_connection() as conn:
+        if phone:
+            low, high = _prefix_range(phone)
+            for kind, table in (('ST', 'activations'), ('BUY', 'purchases')):
+                collect(kind, conn.execute(f'''
+                    SELECT id, name, phone, phone
+                    FROM {table}
+                    WHERE phone >= ? AND phone < ?
+                    ORDER BY phone
+                    LIMIT ?
+                ''', (low, high, fetch)).fetchall(), 0)
+        if serial:
+            low, high = _prefix_range(serial)
+            for column in ('serial_number', 'box_serial_number', 'kit_number'):
+                collect('ST', conn.execute(f'''
+                    SELECT id, name, phone, upper({column})
+                    FROM activations
+                    WHERE upper({column}) >= ? AND upper({column}) < ?
+                    ORDER BY upper({column})
+                    LIMIT ?
+                ''', (low, high, fetch)).fetchall(), 0)
+        if fts:
+            for kind, table in (('ST', 'activations'), ('BUY', 'purchases')):
+                collect(kind, conn.execute(f'''
+                    SELECT t.id, t.name, t.phone, {table}_fts.rank
+                    FROM {table}_fts
+                    JOIN {table} t ON t.id = {table}_fts.rowid
+                    WHERE {table}_fts MATCH ?
+                    ORDER BY {table}_fts.rank
+                    LIMIT ?
+                ''', (fts, fetch)).fetchall(), 1)
+
+    ranked = [result for _, result in sorted(best.values())]
+    page = ranked[offset:offset + limit + 1]
+    return page[:limit], len(page) > limit
 
 
 def delete_activation(activation_id):
     """Удаляет активацию по ID"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM activations WHERE id = ?', (activation_id,))
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+    with write_connection() as conn:
+        cursor = conn.execute('DELETE FROM activations WHERE id = ?', (activation_id,))
+        return cursor.rowcount > 0
 
 
 def delete_purchase(purchase_id):
     """Удаляет покупку по ID"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM purchases WHERE id = ?', (purchase_id,))
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+    with write_connection() as conn:
+        cursor = conn.execute('DELETE FROM purchases WHERE id = ?', (purchase_id,))
+        return cursor.rowcount > 0
 
 
 def toggle_service_provided(activation_id):
     """Переключает статус service_provided (0->1 или 1->0)"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    # Получаем текущий статус
-    cursor.execute('SELECT service_provided FROM activations WHERE id = ?', (activation_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return False
-    
-    current_status = result[0]
-    new_status = 1 if current_status == 0 else 0
-    
-    if new_status == 1:
-        # Устанавливаем дату обработки
-        cursor.execute('''
-            UPDATE activations 
-            SET service_provided = 1, service_provided_at = ?
-            WHERE id = ?
-        ''', (datetime.now().isoformat(), activation_id))
-    else:
-        # Снимаем отметку
-        cursor.execute('''
-            UPDATE activations 
-            SET service_provided = 0, service_provided_at = NULL
-            WHERE id = ?
-        ''', (activation_id,))
-    
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Получаем текущий статус
+        cursor.execute('SELECT service_provided FROM activations WHERE id = ?', (activation_id,))
+        result = cursor.fetchone()
+        if not result:
+            return False
+        
+        current_status = result[0]
+        new_status = 1 if current_status == 0 else 0
+        
+        if new_status == 1:
+            # Устанавливаем дату обработки
+            cursor.execute('''
+                UPDATE activations 
+                SET service_provided = 1, service_provided_at = ?
+                WHERE id = ?
+            ''', (datetime.now().isoformat(), activation_id))
+        else:
+            # Снимаем отметку
+            cursor.execute('''
+                UPDATE activations 
+                SET service_provided = 0, service_provided_at = NULL
+                WHERE id = ?
+            ''', (activation_id,))
+        
+        return cursor.rowcount > 0
+
+
+def get_upcoming_reminders(limit=100):
+    """Ближайшие по сроку напоминания: (due_at, activation_id, days_left)"""
+    with read_connection() as conn:
+        return conn.execute('''
+            SELECT due_at, activation_id, days_left
+            FROM reminder_schedule
+            ORDER BY due_at
+            LIMIT ?
+        ''', (limit,)).fetchall()
+
+
+def get_activation_reminders(activation_id):
+    """Запланированные напоминания одной заявки: (due_at, activation_id, days_left)"""
+    with read_connection() as conn:
+        return conn.execute('''
+            SELECT due_at, activation_id, days_left
+            FROM reminder_schedule
+            WHERE activation_id = ?
+        ''', (activation_id,)).fetchall()
+
+
+def get_due_reminders(now, limit=100):
+    """Напоминания со сроком не позже now (ISO строка):
+    (activation_id, days_left, expires_at, user_id, service_provided_at)
+    """
+    with read_connection() as conn:
+        return conn.execute('''
+            SELECT r.activation_id, r.days_left, r.expires_at, a.user_id, a.service_provided_at
+            FROM reminder_schedule r
+            JOIN activations a ON a.id = r.activation_id
+            WHERE r.due_at <= ?
+            ORDER BY r.due_at
+            LIMIT ?
+        ''', (now, limit)).fetchall()
+
+
+IN_BATCH_SIZE = 500  # Значений в одном IN (...) (лимит параметров SQLite)
+
+
+def _reminders_by_day(reminders):
+    """[(activation_id, days_left)] -> [(days_left, [id, ...])] пачками по IN_BATCH_SIZE"""
+    by_day = {}
+    for activation_id, days_left in reminders:
+        by_day.setdefault(days_left, []).append(activation_id)
+    for days_left, ids in by_day.items():
+        for start in range(0, len(ids), IN_BATCH_SIZE):
+            yield days_left, ids[start:start + IN_BATCH_SIZE]
+
+
+def _complete_reminders(conn, reminders):
+    for days_left, ids in _reminders_by_day(reminders):
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(
+            f'DELETE FROM reminder_schedule WHERE days_left = ? AND activation_id IN ({placeholders})',
+            (days_left, *ids)
+        )
+
+
+def complete_reminders(reminders):
+    """Убирает напоминания [(activation_id, days_left)] из расписания одной транзакцией
+    (один DELETE на каждое значение days_left)"""
+    with write_connection() as conn:
+        _complete_reminders(conn, reminders)
+
+
+def queue_reminders(reminders):
+    """Переносит наступившие напоминания в outbox одной транзакцией.
+    reminders - [(activation_id, days_left, user_id, service_provided_at, text)].
+    """
+    with write_connection() as conn:
+        for activation_id, days_left, user_id, service_provided_at, text in reminders:
+            _enqueue(conn, *notifications.subscription_reminder(
+                activation_id, days_left, user_id, service_provided_at, text
+            ))
+        _complete_reminders(conn, [(r[0], r[1]) for r in reminders])
 
 
 def get_statistics():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM purchases')
-    total_purchases = cursor.fetchone()[0]
+    """Сводные счетчики одним запросом к таблице stats_counters"""
+    with read_connection() as conn:
+        counters = dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
     
-    cursor.execute('SELECT COUNT(*) FROM activations')
-    total_activations = cursor.fetchone()[0]
+    return {
+        'total_purchases': counters.get('purchases', 0),
+        'total_activations': counters.get('activations', 0),
+        'pending_activations': counters.get('status:pending', 0),
+        'payment_confirmed': counters.get('status:payment_confirmed', 0),
+        'completed_activations': counters.get('status:completed', 0),
+        'pending_service': counters.get('service_provided:0', 0),
+        'processed_service': counters.get('service_provided:1', 0),
+    }
+
+
+def get_daily_statistics(since_day):
+    """Счетчики по дням начиная с since_day (YYYY-MM-DD): {день: {имя: значение}}"""
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT day, name, value
+            FROM stats_daily
+            WHERE day >= ?
+            ORDER BY day
+        ''', (since_day,)).fetchall()
     
-    cursor.execute('SELECT COUNT(*) FROM activations WHERE status = "pending"')
-    pending_activations = cursor.fetchone()[0]
+    result = {}
+    for day, name, value in rows:
+        result.setdefault(day, {})[name] = value
+    return result
+
+
+def get_weekly_statistics(since_day):
+    """Счетчики по неделям (ключ - понедельник недели) начиная с since_day"""
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT date(day, '-6 days', 'weekday 1') AS week, name, SUM(value)
+            FROM stats_daily
+            WHERE day >= ?
+            GROUP BY week, name
+            ORDER BY week
+        ''', (since_day,)).fetchall()
     
-    cursor.execute('SELECT COUNT(*) FROM activations WHERE status = "payment_confirmed"')
-    payment_confirmed = cursor.fetchone()[0]
+    result = {}
+    for week, name, value in rows:
+        result.setdefault(week, {})[name] = value
+    return result
+
+
+def encode_page_cursor(sort_value, row_id):
+    """Кодирует позицию в списке (дата ISO + id) в короткую строку для callback_data"""
+    digits = ''.join(ch for ch in sort_value if ch.isdigit())
+    return f"{digits}_{row_id}"
+
+
+def decode_page_cursor(token):
+    """Обратное преобразование encode_page_cursor -> (дата ISO, id)"""
+    digits, row_id = token.split('_')
+    value = f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]}T{digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    if len(digits) > 14:
+        value += f".{digits[14:]}"
+    return value, int(row_id)
+
+
+# Порядок списка обработанных заявок (индекс idx_activations_processed_sort)
+PROCESSED_SORT = 'COALESCE(service_provided_at, created_at)'
+
+
+def _get_activations_page(service_provided, sort_column, after=None, before=None, limit=10,
+                          columns=None, factory=_ACTIVATION_PAGE_ROW):
+    """Keyset-пагинация по (sort_column, id) в порядке убывания.
+    sort_column - колонка или выражение, не принимающее NULL (курсор строится по его значению).
+    service_provided=None - без фильтра по статусу.
+    after - курсор последней строки предыдущей страницы (листаем вперед),
+    before - курсор первой строки следующей страницы (листаем назад).
+    columns/factory - выбираемые колонки и row_factory (по умолчанию ActivationPageItem).
+    Возвращает (строки, есть_ли_еще_строки_в_направлении_листания).
+    """
+    conditions = []
+    params = []
+    if service_provided is not None:
+        conditions.append('service_provided = ?')
+        params.append(service_provided)
+    # Вместо (sort_column, id) < (?, ?): по сравнению row value SQLite не ищет
+    # диапазоном в индексе по выражению
+    if before is not None:
+        value, row_id = decode_page_cursor(before)
+        conditions.append(f'{sort_column} >= ? AND ({sort_column} > ? OR id > ?)')
+        params += [value, value, row_id]
+        order = 'ASC'
+    else:
+        if after is not None:
+            value, row_id = decode_page_cursor(after)
+            conditions.append(f'{sort_column} <= ? AND ({sort_column} < ? OR id < ?)')
+            params += [value, value, row_id]
+        order = 'DESC'
+    query = f'''
+        SELECT {columns or f'id, phone, name, {sort_column} AS sort_key'}
+        FROM activations
+    '''
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {sort_column} {order}, id {order} LIMIT ?'
+    params.append(limit + 1)
     
-    cursor.execute('SELECT COUNT(*) FROM activations WHERE status = "completed"')
-    completed_activations = cursor.fetchone()[0]
+    with read_connection() as conn:
+        rows = _query(conn, factory, query, params).fetchall()
     
-    conn.close()
-    return {
-        'total_purchases': total_purchases,
-        'total_activations': total_activations,
-        'pending_activations': pending_activations,
-        'payment_confirmed': payment_confirmed,
-        'completed_activations': completed_activations
-    }
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
 
+def get_pending_activations_page(after=None, before=None, limit=10):
+    """Страница ожидающих активаций: ActivationPageItem, sort_key - дата заявки"""
+    return _get_activations_page(0, 'created_at', after, before, limit)
+
+
+def get_processed_activations_page(after=None, before=None, limit=10):
+    """Страница обработанных активаций: ActivationPageItem, sort_key - дата обработки.
+    У старых заявок дата обработки не записана - вместо нее дата заявки."""
+    return _get_activations_page(1, PROCESSED_SORT, after, before, limit)
+
+
+def get_activation_list(after=None, before=None, limit=20):
+    """Страница всех активаций для меню админа: ActivationListItem, новые первыми"""
+    return _get_activations_page(None, 'created_at', after, before, limit,
+                                 ACTIVATION_LIST_COLUMNS, _ACTIVATION_LIST_ROW)
+
+
+def get_pending_activation_list(after=None, before=None, limit=20):
+    """Страница ожидающих активаций для меню админа: ActivationListItem, новые первыми"""
+    return _get_activations_page(0, 'created_at', after, before, limit,
+                                 ACTIVATION_LIST_COLUMNS, _ACTIVATION_LIST_ROW)
+
+
+def count_purchases():
+    """Количество покупок (из счетчиков статистики)"""
+    with read_connection() as conn:
+        row = conn.execute("SELECT value FROM stats_counters WHERE name = 'purchases'").fetchone()
+    return row[0] if row else 0
+
+
+def count_activations_by_service(service_provided):
+    """Количество ожидающих (0) или обработанных (1) активаций (из счетчиков статистики)"""
+    with read_connection() as conn:
+        row = conn.execute(
+            'SELECT value FROM stats_counters WHERE name = ?', (f'service_provided:{service_provided}',)
+        ).fetchone()
+    return row[0] if row else 0
+
+
+EXPORT_COLUMNS = '''
+    id, user_id, username, phone, name, created_at, serial_number, 
+    box_serial_number, kit_number, service_provided_at, email, password
+'''
+
+
+def iter_activations_for_export(batch_size=1000):
+    """Построчно отдает активации для экспорта, не загружая всю таблицу в память"""
+    with read_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT {EXPORT_COLUMNS}
+            FROM activations
+            ORDER BY created_at DESC
+        ''')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+
+def get_activation_for_export(activation_id):
+    with read_connection() as conn:
+        return conn.execute(f'''
+            SELECT {EXPORT_COLUMNS}
+            FROM activations
+            WHERE id = ?
+        ''', (activation_id,)).fetchone()
+
+
+def get_export_column_stats():
+    """Максимальные длины значений по колонкам экспорта (для ширины столбцов) и число строк"""
+    with read_connection() as conn:
+        return conn.execute('''
+            SELECT COUNT(*), MAX(id), MAX(LENGTH(user_id)), MAX(LENGTH(username)), 
+                   MAX(LENGTH(phone)), MAX(LENGTH(name)), MAX(LENGTH(created_at)), 
+                   MAX(LENGTH(serial_number)), MAX(LENGTH(box_serial_number)), 
+                   MAX(LENGTH(kit_number)), MAX(service_provided_at IS NOT NULL), 
+                   MAX(LENGTH(email)), MAX(LENGTH(password))
+            FROM activations
+        ''').fetchone()
+
+
+def get_cached_file_id(key, version):
+    """file_id ранее отправленного файла, если он загружался для этой же версии данных"""
+    with read_connection() as conn:
+        row = conn.execute(
+            'SELECT file_id FROM telegram_file_cache WHERE key = ? AND version = ?',
+            (key, version)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def save_cached_file_id(key, version, file_id):
+    with write_connection() as conn:
+        conn.execute('''
+            INSERT INTO telegram_file_cache (key, version, file_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                version = excluded.version, file_id = excluded.file_id, updated_at = excluded.updated_at
+        ''', (key, version, file_id, datetime.now().isoformat()))
+
+
+OUTBOX_COLUMNS = 'id, chat_id, text, parse_mode, attempts'
+
+
+def _enqueue(conn, dedupe_key, chat_id, text, parse_mode=None):
+    now = datetime.now().isoformat(timespec='seconds')
+    conn.execute('''
+        INSERT INTO outbox (dedupe_key, chat_id, text, parse_mode, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dedupe_key) DO NOTHING
+    ''', (dedupe_key, chat_id, text, parse_mode, now, now))
+
+
+def enqueue_notification(dedupe_key, chat_id, text, parse_mode=None):
+    """Ставит сообщение в outbox. Сообщение с уже известным dedupe_key не дублируется."""
+    with write_connection() as conn:
+        _enqueue(conn, dedupe_key, chat_id, text, parse_mode)
+
+
+def get_pending_outbox(now, limit=100):
+    """Сообщения, которые пора отправить: (id, chat_id, text, parse_mode, attempts)"""
+    with read_connection() as conn:
+        return conn.execute(f'''
+            SELECT {OUTBOX_COLUMNS}
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (now, limit)).fetchall()
+
+
+def get_outbox_message(dedupe_key):
+    """Неотправленное сообщение по ключу или None"""
+    with read_connection() as conn:
+        return conn.execute(f'''
+            SELECT {OUTBOX_COLUMNS}
+            FROM outbox
+            WHERE dedupe_key = ? AND status = 'pending'
+        ''', (dedupe_key,)).fetchone()
+
+
+def filter_pending_outbox(ids):
+    """Из ids - сообщения, которые все еще ожидают отправки"""
+    ids = list(ids)
+    pending = []
+    with read_connection() as conn:
+        for start in range(0, len(ids), IN_BATCH_SIZE):
+            batch = ids[start:start + IN_BATCH_SIZE]
+            pending += [row[0] for row in conn.execute(
+                f"SELECT id FROM outbox WHERE status = 'pending' AND id IN ({','.join('?' * len(batch))})",
+                batch
+            )]
+    return pending
+
+
+def mark_outbox_sent(ids):
+    ids = list(ids)
+    with write_connection() as conn:
+        for start in range(0, len(ids), IN_BATCH_SIZE):
+            batch = ids[start:start + IN_BATCH_SIZE]
+            conn.execute(
+                f'''UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1
+                WHERE id IN ({",".join("?" * len(batch))})''',
+                (datetime.now().isoformat(timespec='seconds'), *batch)
+            )
+
+
+def mark_outbox_failed(failures):
+    """failures - [(id, next_attempt_at, ошибка)]; next_attempt_at=None - больше не пытаться"""
+    with write_connection() as conn:
+        conn.executemany('''
+            UPDATE outbox
+            SET attempts = attempts + 1, last_error = ?,
+                status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+                next_attempt_at = COALESCE(?, next_attempt_at)
+            WHERE id = ?
+        ''', [(error, next_at, next_at, message_id) for message_id, next_at, error in failures])
+
+
+def purge_outbox(before):
+    """Удаляет отправленные и окончательно неотправленные сообщения старше before"""
+    with write_connection() as conn:
+        return conn.execute(
+            "DELETE FROM outbox WHERE created_at < ? AND status != 'pending'", (before,)
+        ).rowcount
+
+
+def load_persisted_user_data():
+    """Сохраненные user_data: [(user_id, data)]"""
+    with read_connection() as conn:
+        return conn.execute('SELECT user_id, data FROM persistence_user_data').fetchall()
+
+
+def load_persisted_conversations(name):
+    """Сохраненные состояния диалога name: [(key, state)]"""
+    with read_connection() as conn:
+        return conn.execute(
+            'SELECT key, state FROM persistence_conversations WHERE name = ?', (name,)
+        ).fetchall()
+
+
+def save_persisted_state(user_data, dropped_users, conversations, ended_conversations):
+    """Записывает накопленные изменения одной транзакцией.
+    user_data - [(user_id, data)], dropped_users - [user_id],
+    conversations - [(name, key, state)], ended_conversations - [(name, key)].
+    """
+    with write_connection() as conn:
+        if user_data:
+            conn.executemany('''
+                INSERT INTO persistence_user_data (user_id, data) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET data = excluded.data
+            ''', user_data)
+        if dropped_users:
+            conn.executemany(
+                'DELETE FROM persistence_user_data WHERE user_id = ?',
+                [(user_id,) for user_id in dropped_users]
+            )
+        if conversations:
+            conn.executemany('''
+                INSERT INTO persistence_conversations (name, key, state) VALUES (?, ?, ?)
+                ON CONFLICT (name, key) DO UPDATE SET state = excluded.state
+            ''', conversations)
+        if ended_conversations:
+            conn.executemany(
+                'DELETE FROM persistence_conversations WHERE name = ? AND key = ?',
+                ended_conversations
+            )
+
+
+# Время и ошибки каждой функции модуля (metrics.py)
+instrument_module(globals(), DB_METRIC, 'query')
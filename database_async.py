@@ -0,0 +1,145 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from config import DB_EXECUTOR_THREADS, DB_EXECUTOR_QUEUE_SIZE
+
+
+class DatabaseExecutor:
+    """Выполняет синхронные функции database.py в отдельных потоках.
+
+    Количество одновременно ожидающих запросов ограничено: при заполнении очереди
+    обработчики ждут свободного места (не блокируя event loop), а не копят задачи.
+    """
+
+    def __init__(self, threads=DB_EXECUTOR_THREADS, queue_size=DB_EXECUTOR_QUEUE_SIZE):
+        self.threads = threads
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db")
+        self._slots = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.backpressure_waits = 0
+        self.backpressure_wait_time = 0.0
+        self.total_time = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+
+        if self._slots.locked():
+            # Очередь заполнена - ждем освобождения места
+            self.backpressure_waits += 1
+            wait_started = time.perf_counter()
+            await self._slots.acquire()
+            self.backpressure_wait_time += time.perf_counter() - wait_started
+        else:
+            await self._slots.acquire()
+
+        self.submitted += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.total_time += time.perf_counter() - started
+            self.in_flight -= 1
+            self._slots.release()
+
+    def metrics(self):
+        """Метрики очереди запросов к БД"""
+        finished = self.completed + self.failed
+        return {
+            'threads': self.threads,
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'queue_depth': max(0, self.in_flight - self.threads),
+            'max_in_flight': self.max_in_flight,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'backpressure_waits': self.backpressure_waits,
+            'backpressure_wait_time': self.backpressure_wait_time,
+            'avg_time': self.total_time / finished if finished else 0.0,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+executor = DatabaseExecutor()
+
+
+def get_metrics():
+    return executor.metrics()
+
+
+def run(func, *args, **kwargs):
+    """Выполняет произвольную синхронную функцию в потоке БД"""
+    return executor.run(func, *args, **kwargs)
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await executor.run(func, *args, **kwargs)
+    return wrapper
+
+
+add_purchase = _wrap(database.add_purchase)
+add_activation = _wrap(database.add_activation)
+update_activation_receipt = _wrap(database.update_activation_receipt)
+update_activation_serial_number = _wrap(database.update_activation_serial_number)
+update_activation_serial_photo = _wrap(database.update_activation_serial_photo)
+update_activation_box_serial_number = _wrap(database.update_activation_box_serial_number)
+update_activation_box_serial_photo = _wrap(database.update_activation_box_serial_photo)
+update_activation_kit = _wrap(database.update_activation_kit)
+get_purchases_page = _wrap(database.get_purchases_page)
+get_activation_list = _wrap(database.get_activation_list)
+get_pending_activation_list = _wrap(database.get_pending_activation_list)
+mark_service_provided = _wrap(database.mark_service_provided)
+update_activation_email_password = _wrap(database.update_activation_email_password)
+get_activation_by_id = _wrap(database.get_activation_by_id)
+find_activation_by_request_number = _wrap(database.find_activation_by_request_number)
+find_purchase_by_request_number = _wrap(database.find_purchase_by_request_number)
+search_requests = _wrap(database.search_requests)
+delete_activation = _wrap(database.delete_activation)
+delete_purchase = _wrap(database.delete_purchase)
+toggle_service_provided = _wrap(database.toggle_service_provided)
+get_statistics = _wrap(database.get_statistics)
+get_pending_activations_page = _wrap(database.get_pending_activations_page)
+get_processed_activations_page = _wrap(database.get_processed_activations_page)
+count_purchases = _wrap(database.count_purchases)
+count_activations_by_service = _wrap(database.count_activations_by_service)
+get_daily_statistics = _wrap(database.get_daily_statistics)
+get_weekly_statistics = _wrap(database.get_weekly_statistics)
+get_activation_for_export = _wrap(database.get_activation_for_export)
+get_cached_file_id = _wrap(database.get_cached_file_id)
+save_cached_file_id = _wrap(database.save_cached_file_id)
+get_upcoming_reminders = _wrap(database.get_upcoming_reminders)
+get_activation_reminders = _wrap(database.get_activation_reminders)
+get_due_reminders = _wrap(database.get_due_reminders)
+complete_reminders = _wrap(database.complete_reminders)
+queue_reminders = _wrap(database.queue_reminders)
+enqueue_notification = _wrap(database.enqueue_notification)
+get_pending_outbox = _wrap(database.get_pending_outbox)
+get_outbox_message = _wrap(database.get_outbox_message)
+filter_pending_outbox = _wrap(database.filter_pending_outbox)
+mark_outbox_sent = _wrap(database.mark_outbox_sent)
+mark_outbox_failed = _wrap(database.mark_outbox_failed)
+purge_outbox = _wrap(database.purge_outbox)
+load_persisted_user_data = _wrap(database.load_persisted_user_data)
+load_persisted_conversations = _wrap(database.load_persisted_conversations)
+save_persisted_state = _wrap(database.save_persisted_state)
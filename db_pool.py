@@ -0,0 +1,113 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DATABASE_NAME, DB_READ_POOL_SIZE
+
+
+# Настройки соединений: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL не делает fsync на каждый коммит
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",  # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size = 268435456",  # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite: один писатель и несколько читателей."""
+
+    def __init__(self, database, readers=DB_READ_POOL_SIZE, on_connect=None):
+        self.database = database
+        self.on_connect = on_connect
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._readers = queue.LifoQueue()
+        self._all = [self._writer]
+        for _ in range(max(1, readers)):
+            conn = self._connect()
+            self._all.append(conn)
+            self._readers.put(conn)
+
+    def _connect(self):
+        # Соединения переиспользуются из разных потоков, но каждое в один момент
+        # времени принадлежит только одному потоку (через блокировку или очередь)
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Соединение для записи. Коммитит при успешном выходе, иначе откатывает."""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Соединение для чтения из пула."""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        with self._write_lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Возвращает общий пул, создавая его при первом обращении."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_NAME)
+    return _pool
+
+
+def configure_pool(database=DATABASE_NAME, readers=DB_READ_POOL_SIZE, on_connect=None):
+    """Пересоздает общий пул (другая БД, размер пула или хук на новое соединение)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(database, readers=readers, on_connect=on_connect)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def write_connection():
+    return get_pool().writer()
+
+
+def read_connection():
+    return get_pool().reader()
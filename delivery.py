@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Forbidden, BadRequest
+
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+    DELIVERY_CONCURRENCY,
+    DELIVERY_MAX_RETRIES,
+)
+
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DeliveryReport:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.sent = []
+        self.failed = []
+        self.retries = 0
+        self.flood_waits = 0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+        return self
+
+    @property
+    def throughput(self):
+        return len(self.sent) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.name}: отправлено {len(self.sent)}, ошибок {len(self.failed)}, "
+            f"повторов {self.retries} (RetryAfter: {self.flood_waits}), "
+            f"{self.elapsed:.1f} с, {self.throughput:.1f} сообщ/с"
+        )
+
+
+class DeliveryPipeline:
+    """Параллельная отправка сообщений с учетом лимитов Telegram.
+
+    Общий лимит бота - TokenBucket на TELEGRAM_GLOBAL_RATE сообщений в секунду,
+    в один чат - не чаще раза в TELEGRAM_CHAT_INTERVAL секунд, одновременно
+    выполняется не больше DELIVERY_CONCURRENCY запросов. RetryAfter приостанавливает
+    всю отправку на указанное Telegram время, сетевые ошибки повторяются с паузой.
+    """
+
+    def __init__(self, rate=TELEGRAM_GLOBAL_RATE, chat_interval=TELEGRAM_CHAT_INTERVAL,
+                 concurrency=DELIVERY_CONCURRENCY, max_retries=DELIVERY_MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._chat_next = {}
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        # Забываем чаты, в которые давно не писали, чтобы словарь не рос
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        next_allowed = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, next_allowed) + self.chat_interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+    async def _send_one(self, bot, key, chat_id, text, report, send_kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **send_kwargs)
+                report.sent.append(key)
+                return
+            except RetryAfter as e:
+                report.flood_waits += 1
+                retry_after = e.retry_after
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                self.bucket.pause(retry_after)
+                error = e
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат не существует - повтор не поможет
+                report.failed.append((key, e))
+                return
+            except (TimedOut, NetworkError) as e:
+                await asyncio.sleep(2 ** attempt)
+                error = e
+            except Exception as e:
+                report.failed.append((key, e))
+                return
+            if attempt < self.max_retries:
+                report.retries += 1
+        report.failed.append((key, error))
+
+    async def deliver(self, bot, messages, name="Рассылка", **send_kwargs):
+        """Отправляет messages - список (key, chat_id, text).
+        Возвращает DeliveryReport: report.sent - ключи отправленных,
+        report.failed - [(ключ, ошибка)].
+        """
+        report = DeliveryReport(name)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def worker(key, chat_id, text):
+            async with slots:
+                await self._send_one(bot, key, chat_id, text, report, send_kwargs)
+
+        await asyncio.gather(*(worker(key, chat_id, text) for key, chat_id, text in messages))
+        return report.finish()
+
+
+pipeline = DeliveryPipeline()
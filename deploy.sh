@@ -57,8 +57,8 @@ Environment="PATH=$BOT_DIR/venv/bin"
 ExecStart=$BOT_DIR/venv/bin/python $BOT_DIR/main.py
 Restart=always
 RestartSec=10
-StandardOutput=append:$BOT_DIR/logs/bot.log
-StandardError=append:$BOT_DIR/logs/bot_error.log
+StandardOutput=journal
+StandardError=journal
 
 [Install]
 WantedBy=multi-user.target
@@ -93,7 +93,5 @@ echo "Просмотр статуса:"
 echo "  systemctl status $BOT_NAME"
 echo ""
 echo "Просмотр логов:"
-echo "  journalctl -u $BOT_NAME -f"
-echo "  или"
-echo "  tail -f $BOT_DIR/logs/bot.log"
+echo "  journalctl -u $BOT_NAME -f -o cat"
 
@@ -0,0 +1,145 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
+
+from database import iter_activations_for_export, get_activation_for_export, get_export_column_stats
+
+
+ACTIVATION_HEADERS = ["Номер заявки", "User ID", "Username", "Номер телефона", "Имя", "Дата заявки", "Услуга",
+                      "SN устройство", "SN коробка", "KIT номер",
+                      "Дата начала активации", "Дата окончания подписки", "Email", "Пароль"]
+
+SERVICE_NAME = "Активация"
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_COLUMN_WIDTH = 50
+
+
+def activation_export_row(row):
+    """Строка Excel из строки iter_activations_for_export / get_activation_for_export"""
+    act_id, uid, username, phone, name, created_at, serial_num, box_serial, kit, service_provided_at, email, password = row
+
+    start_date_str = None
+    end_date_str = None
+    if service_provided_at:
+        start_date = datetime.fromisoformat(service_provided_at)
+        end_date = start_date + timedelta(days=30)
+        start_date_str = start_date.strftime(DATE_FORMAT)
+        end_date_str = end_date.strftime(DATE_FORMAT)
+
+    return [
+        f"ST-{act_id:06d}",
+        uid,
+        f"@{username}" if username else None,
+        phone,
+        name,
+        created_at[:19],
+        SERVICE_NAME,
+        serial_num or None,
+        box_serial or None,
+        kit or None,
+        start_date_str,
+        end_date_str,
+        email or None,
+        password or None
+    ]
+
+
+def export_row_version(row):
+    """Версия содержимого файла заявки: меняется при любом изменении выгружаемых данных"""
+    return hashlib.sha1(repr((ACTIVATION_HEADERS, tuple(row))).encode()).hexdigest()[:16]
+
+
+def widths_from_rows(rows):
+    """Ширина столбцов по уже подготовленным строкам (для небольших выгрузок)"""
+    widths = [len(header) for header in ACTIVATION_HEADERS]
+    for row in rows:
+        for idx, value in enumerate(row):
+            if value:
+                widths[idx] = max(widths[idx], len(str(value)))
+    return widths
+
+
+def widths_from_stats(stats):
+    """Ширина столбцов по агрегатам get_export_column_stats() - без прохода по строкам в Python"""
+    (count, max_id, uid_len, username_len, phone_len, name_len, created_len,
+     serial_len, box_serial_len, kit_len, has_service_date, email_len, password_len) = stats
+    date_len = len(datetime.now().strftime(DATE_FORMAT)) if has_service_date else 0
+    data = [
+        len(f"ST-{max_id or 0:06d}"),
+        uid_len or 0,
+        username_len + 1 if username_len else 0,
+        phone_len or 0,
+        name_len or 0,
+        min(created_len or 0, 19),
+        len(SERVICE_NAME) if count else 0,
+        serial_len or 0,
+        box_serial_len or 0,
+        kit_len or 0,
+        date_len,
+        date_len,
+        email_len or 0,
+        password_len or 0,
+    ]
+    return [max(len(header), value) for header, value in zip(ACTIVATION_HEADERS, data)]
+
+
+def write_activations_xlsx(rows, output, widths, title="Активации"):
+    """Пишет строки в xlsx в режиме write-only (строки не хранятся в памяти).
+    Ширина столбцов должна быть известна заранее: в write-only режиме она
+    записывается в файл до первой строки.
+    Возвращает количество записанных строк.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+
+    for col_idx, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    header_cells = []
+    for header in ACTIVATION_HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+
+    wb.save(output)
+    return count
+
+
+def export_all_activations(output, on_progress=None, progress_every=5000):
+    """Выгружает все активации в output (файл или буфер), читая их курсором из БД.
+    on_progress(готово, всего) вызывается каждые progress_every строк.
+    """
+    stats = get_export_column_stats()
+    total = stats[0]
+    widths = widths_from_stats(stats)
+
+    def rows():
+        for done, row in enumerate(iter_activations_for_export(), start=1):
+            if on_progress and done % progress_every == 0:
+                on_progress(done, total)
+            yield activation_export_row(row)
+
+    return write_activations_xlsx(rows(), output, widths)
+
+
+def export_activation(activation_id, output):
+    """Выгружает одну заявку. Возвращает версию выгруженных данных
+    (export_row_version) или None, если заявка не найдена.
+    """
+    row = get_activation_for_export(activation_id)
+    if not row:
+        return None
+    rows = [activation_export_row(row)]
+    write_activations_xlsx(rows, output, widths_from_rows(rows), title="Активация")
+    return export_row_version(row)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from telegram.error import TelegramError
+
+import db_pool
+from config import EXPORT_WORKERS, EXPORT_PROGRESS_INTERVAL
+from database_async import get_activation_for_export, get_cached_file_id, save_cached_file_id
+from excel_export import export_all_activations, export_activation, export_row_version
+
+
+logger = logging.getLogger(__name__)
+
+
+def _run_export_job(database, key, activation_id, path, progress):
+    """Выполняется в отдельном процессе: формирует xlsx в файл path.
+    Возвращает (количество строк, версия данных заявки); (0, None) - заявка не найдена.
+    """
+    db_pool.configure_pool(database, readers=1)
+
+    def on_progress(done, total):
+        progress[key] = (done, total)
+
+    with open(path, 'wb') as output:
+        if activation_id is None:
+            return export_all_activations(output, on_progress=on_progress), None
+        version = export_activation(activation_id, output)
+        return (1 if version else 0), version
+
+
+class ExportJob:
+    def __init__(self, key, activation_id, cache_key=None):
+        self.key = key
+        self.activation_id = activation_id
+        # Ключ в telegram_file_cache: file_id первой загрузки переиспользуется, пока данные не изменятся
+        self.cache_key = cache_key
+        # chat_id -> сообщение со статусом, которое обновляется по мере прогресса
+        self.subscribers = {}
+        # chat_id -> клавиатура, которая прикрепляется к итоговому файлу
+        self.reply_markups = {}
+        self.progress_failed = False
+        self.task = None
+
+
+class ExportService:
+    """Фоновый экспорт в Excel на пуле процессов.
+    Одинаковые запросы, пришедшие во время выполнения, объединяются в одну задачу,
+    а файл отправляется всем, кто его запросил.
+    """
+
+    def __init__(self, workers=EXPORT_WORKERS, progress_interval=EXPORT_PROGRESS_INTERVAL):
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._jobs = {}
+        self._tasks = set()
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        """Запустить Manager и пул процессов. Запуск процессов блокирующий,
+        поэтому выполняется в отдельном потоке, а не в цикле событий."""
+        async with self._start_lock:
+            if self._executor is None:
+                await asyncio.to_thread(self._start)
+
+    def _start(self):
+        # spawn: дочерние процессы не наследуют открытые соединения SQLite родителя
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._progress = self._manager.dict()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    @property
+    def active_jobs(self):
+        return len(self._jobs)
+
+    async def export_all(self, bot, chat_id, reply_markup=None):
+        """Поставить в очередь выгрузку всех активаций для чата"""
+        await self._request(bot, chat_id, 'all', None, reply_markup)
+
+    async def export_activation(self, bot, chat_id, activation_id, reply_markup=None):
+        """Отправить файл одной заявки: по сохраненному file_id, если данные заявки
+        не менялись с прошлой загрузки, иначе поставить выгрузку в очередь"""
+        key = f'activation:{activation_id}'
+        cache_key = f'activation_xlsx:{activation_id}'
+        if key not in self._jobs:
+            row = await get_activation_for_export(activation_id)
+            if not row:
+                await bot.send_message(chat_id, "❌ Заявка не найдена.", reply_markup=reply_markup)
+                return
+            file_id = await get_cached_file_id(cache_key, export_row_version(row))
+            if file_id:
+                try:
+                    await bot.send_document(chat_id, document=file_id, reply_markup=reply_markup)
+                    return
+                except TelegramError as e:
+                    logger.warning("Сохраненный файл %s недоступен, формирую заново: %s", cache_key, e)
+        await self._request(bot, chat_id, key, activation_id, reply_markup, cache_key)
+
+    async def _request(self, bot, chat_id, key, activation_id, reply_markup, cache_key=None):
+        job = self._jobs.get(key)
+        if job is not None:
+            if chat_id not in job.subscribers:
+                job.reply_markups[chat_id] = reply_markup
+                job.subscribers[chat_id] = await bot.send_message(
+                    chat_id, "⏳ Этот Excel файл уже формируется, отправлю его сюда, когда будет готов."
+                )
+            return
+
+        job = ExportJob(key, activation_id, cache_key)
+        self._jobs[key] = job
+        job.reply_markups[chat_id] = reply_markup
+        # Статус отправляется без клавиатуры: сообщение с ReplyKeyboardMarkup нельзя редактировать,
+        # клавиатура прикрепляется к самому файлу
+        job.subscribers[chat_id] = await bot.send_message(chat_id, "📄 Генерирую Excel файл...")
+        job.task = asyncio.create_task(self._run(bot, job))
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, bot, job):
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            # Обычно пул уже запущен в post_init; здесь - для использования без Application
+            await self.start()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, _run_export_job,
+                db_pool.get_pool().database, job.key, job.activation_id, path, self._progress
+            )
+            last_reported = None
+            while True:
+                done, _ = await asyncio.wait({future}, timeout=self.progress_interval)
+                if done:
+                    break
+                progress = await asyncio.to_thread(self._progress.get, job.key)
+                if progress and progress != last_reported:
+                    last_reported = progress
+                    await self._report_progress(job, *progress)
+
+            count, version = future.result()
+            # Новые запросы после этой точки запустят свежую выгрузку
+            self._jobs.pop(job.key, None)
+
+            if not count and job.activation_id is not None:
+                await self._notify(bot, job, "❌ Заявка не найдена.")
+                return
+
+            filename = self._filename(job)
+            with open(path, 'rb') as f:
+                document = f
+                for chat_id in job.subscribers:
+                    try:
+                        message = await bot.send_document(
+                            chat_id, document=document, filename=filename,
+                            reply_markup=job.reply_markups.get(chat_id)
+                        )
+                    except Exception as e:
+                        logger.warning("Ошибка отправки Excel файла в чат %s: %s", chat_id, e)
+                        if document is f:
+                            f.seek(0)
+                        continue
+                    if document is f and message.document:
+                        # Файл загружен один раз, остальным подписчикам уходит file_id
+                        document = message.document.file_id
+                        if job.cache_key and version:
+                            await save_cached_file_id(job.cache_key, version, document)
+        except Exception:
+            logger.exception("Ошибка экспорта %s", job.key)
+            await self._notify(bot, job, "❌ Ошибка при формировании Excel файла.")
+        finally:
+            self._jobs.pop(job.key, None)
+            if self._progress is not None:
+                self._progress.pop(job.key, None)
+            os.remove(path)
+
+    async def _report_progress(self, job, done, total):
+        percent = int(done * 100 / total) if total else 0
+        text = f"📄 Генерирую Excel файл... {percent}% ({done} из {total})"
+        for message in job.subscribers.values():
+            try:
+                await message.edit_text(text)
+            except Exception as e:
+                # Сообщение удалено или не изменилось - прогресс не критичен, пишем в лог один раз
+                if not job.progress_failed:
+                    job.progress_failed = True
+                    logger.warning("Ошибка обновления прогресса экспорта %s: %s", job.key, e)
+
+    async def _notify(self, bot, job, text):
+        for chat_id in job.subscribers:
+            try:
+                await bot.send_message(chat_id, text, reply_markup=job.reply_markups.get(chat_id))
+            except Exception as e:
+                logger.warning("Ошибка отправки сообщения в чат %s: %s", chat_id, e)
+
+    def _filename(self, job):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if job.activation_id is None:
+            return f"activations_{timestamp}.xlsx"
+        return f"activation_ST-{job.activation_id:06d}_{timestamp}.xlsx"
+
+    async def stop(self):
+        """Остановить пул процессов и Manager, не блокируя цикл событий"""
+        async with self._start_lock:
+            if self._executor is not None:
+                await asyncio.to_thread(self.shutdown)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
+
+
+export_service = ExportService()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from http import HTTPStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_LINES = 100
+KEEP_ALIVE_TIMEOUT = 75
+
+
+class Request:
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    def __init__(self, status=200, body=b'', content_type='text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+
+
+class HTTPServer:
+    """Минимальный HTTP/1.1 сервер на asyncio.start_server без внешних зависимостей.
+
+    Маршруты задаются парой (метод, путь), обработчик - корутина,
+    принимающая Request и возвращающая Response. Поддерживается keep-alive:
+    Telegram держит соединения с webhook открытыми.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def port_bound(self):
+        """Фактический порт (если сервер запущен с port=0)"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    await self._write_response(writer, request, keep_alive=False)
+                    break
+
+                handler = self._routes.get((request.method, request.path))
+                if handler is None:
+                    methods = [method for method, path in self._routes if path == request.path]
+                    response = Response(HTTPStatus.METHOD_NOT_ALLOWED if methods else HTTPStatus.NOT_FOUND)
+                else:
+                    try:
+                        response = await handler(request)
+                    except Exception:
+                        logger.exception("Ошибка обработки HTTP запроса %s %s", request.method, request.path)
+                        response = Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        # readline выбрасывает ValueError, если строка длиннее лимита буфера StreamReader
+        try:
+            request_line = await reader.readline()
+        except ValueError:
+            return Response(HTTPStatus.REQUEST_URI_TOO_LONG)
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return Response(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            try:
+                line = await reader.readline()
+            except ValueError:
+                return Response(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return Response(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        # Тело читается только по Content-Length; chunked и другие кодировки не поддерживаются
+        if 'transfer-encoding' in headers:
+            return Response(HTTPStatus.NOT_IMPLEMENTED)
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return Response(HTTPStatus.BAD_REQUEST)
+        if length > MAX_BODY_SIZE:
+            return Response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        return Request(method.upper(), path, query, headers, body)
+
+    async def _write_response(self, writer, response, keep_alive):
+        status = HTTPStatus(response.status)
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + response.body)
+        await writer.drain()
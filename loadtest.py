@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# Нагрузочный тест бота без сети: Application из main.build_application() с
+# транспортом Bot API в памяти процесса и временной БД.
+# Запуск: python loadtest.py [--users 200] [--buyers 0.3] [--admins 2] [--api-latency-ms 20]
+#         python loadtest.py --max-p95-ms 250 --json result.json   (проверка на регрессию)
+#
+# Каждый пользователь проходит весь сценарий: покупка (/start -> купить -> телефон -> имя)
+# или активация (/start -> активировать -> телефон -> имя -> SN -> фото -> SN коробки -> фото),
+# админы листают админ-панель (статистика, активации, карточка заявки, поиск).
+# Обновления проходят тот же путь, что в боте: update_processor -> ConversationHandler ->
+# обработчики -> database_async. Код выхода 1 - ошибки обработчиков, незавершенные
+# сценарии, расхождение данных в БД или превышение порогов.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import db_pool
+import metrics
+from config import ADMIN_IDS, ADMIN_PASSWORD
+
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+FIRST_USER_ID = 100000
+
+# Методы Bot API, которые возвращают отправленное сообщение
+MESSAGE_METHODS = ('sendmessage', 'sendphoto', 'senddocument', 'sendinvoice', 'editmessagetext',
+                   'editmessagereplymarkup', 'editmessagecaption')
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт Bot API в памяти: отвечает как Telegram, с задержкой latency секунд.
+    Запоминает последний текст и inline клавиатуру каждого чата - по ним
+    симулированные пользователи проверяют ответы и нажимают кнопки.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.last_text = {}
+        self.last_markup = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method.lower() == 'getme':
+            result = BOT_USER
+        elif api_method.lower() in MESSAGE_METHODS:
+            result = self._message(api_method.lower(), params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _message(self, api_method, params):
+        chat_id = params.get('chat_id', 0)
+        text = params.get('text') or params.get('caption') or ''
+        self.last_text[chat_id] = text
+        markup = params.get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if markup and 'inline_keyboard' in markup:
+            self.last_markup[chat_id] = markup
+        message = {
+            'message_id': params.get('message_id') or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': text,
+        }
+        file_id = f'loadtest-file-{next(self._file_ids)}'
+        if api_method == 'sendphoto':
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600}]
+        elif api_method == 'senddocument':
+            message['document'] = {'file_id': file_id, 'file_unique_id': file_id}
+        return message
+
+    def button(self, chat_id, prefix):
+        """callback_data первой inline кнопки последнего сообщения, начинающейся с prefix"""
+        markup = self.last_markup.get(chat_id) or {}
+        for row in markup.get('inline_keyboard', []):
+            for button in row:
+                data = button.get('callback_data') or ''
+                if data.startswith(prefix):
+                    return data
+        return None
+
+
+class SimulatedUser:
+    def __init__(self, harness, user_id, username):
+        self.harness = harness
+        self.user_id = user_id
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': username, 'username': username}
+        self.chat = {'id': user_id, 'type': 'private'}
+
+    def _message(self, **fields):
+        return {
+            'message_id': self.harness.next_update_id(),
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': self.user,
+            **fields,
+        }
+
+    async def text(self, step, text):
+        fields = {'text': text}
+        if text.startswith('/'):
+            fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self.harness.send(step, {'message': self._message(**fields)})
+
+    async def photo(self, step):
+        file_id = f'user-photo-{self.user_id}-{self.harness.next_update_id()}'
+        photo = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}]
+        await self.harness.send(step, {'message': self._message(photo=photo)})
+
+    async def press(self, step, data):
+        await self.harness.send(step, {'callback_query': {
+            'id': str(self.harness.next_update_id()),
+            'from': self.user,
+            'chat_instance': str(self.user_id),
+            'data': data,
+            'message': {
+                'message_id': 1, 'date': int(time.time()), 'chat': self.chat, 'from': BOT_USER, 'text': '',
+            },
+        }})
+
+    async def press_button(self, step, prefix):
+        """Нажимает кнопку из последнего ответа бота; False - такой кнопки нет"""
+        data = self.harness.transport.button(self.user_id, prefix)
+        if data is None:
+            self.harness.skipped[step] = self.harness.skipped.get(step, 0) + 1
+            return False
+        await self.press(step, data)
+        return True
+
+    def last_reply(self):
+        return self.harness.transport.last_text.get(self.user_id, '')
+
+
+class Harness:
+    def __init__(self, application, transport, think_time):
+        self.application = application
+        self.transport = transport
+        self.think_time = think_time
+        self.timings = {}
+        self.skipped = {}
+        self.errors = []
+        self.failed_flows = []
+        self.completed = {'purchase': 0, 'activation': 0, 'admin': 0}
+        self._update_ids = itertools.count(1)
+
+    def next_update_id(self):
+        return next(self._update_ids)
+
+    async def send(self, step, payload):
+        """Обновление проходит тот же путь, что при polling/webhook; время - до конца обработки"""
+        update = Update.de_json({'update_id': self.next_update_id(), **payload}, self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(
+            update, self.application.process_update(update)
+        )
+        self.timings.setdefault(step, []).append(time.perf_counter() - started)
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+
+    async def on_error(self, update, context):
+        self.errors.append(f"{type(context.error).__name__}: {context.error}")
+
+    def expect(self, user, flow, fragment):
+        if fragment in user.last_reply():
+            self.completed[flow] += 1
+        else:
+            self.failed_flows.append(f"{flow} user {user.user_id}: последний ответ {user.last_reply()[:60]!r}")
+
+    async def purchase_flow(self, user, index):
+        await user.text('purchase:start', '/start')
+        await user.press('purchase:buy', 'buy')
+        await user.text('purchase:phone', f'8999{index:07d}')
+        await user.text('purchase:name', 'Покупатель')
+        self.expect(user, 'purchase', 'Заявка создана')
+
+    async def activation_flow(self, user, index):
+        await user.text('activation:start', '/start')
+        await user.press('activation:activate', 'activate')
+        await user.text('activation:phone', f'+7912{index:07d}')
+        await user.text('activation:name', 'Клиент')
+        await user.text('activation:serial', f'SN{index:08d}')
+        await user.photo('activation:serial_photo')
+        await user.text('activation:box_serial', f'BOX{index:08d}')
+        await user.photo('activation:box_photo')
+        self.expect(user, 'activation', 'Все данные получены')
+
+    async def admin_flow(self, user, rounds):
+        for _ in range(rounds):
+            await user.text('admin:command', '/admin')
+            await user.text('admin:password', ADMIN_PASSWORD)
+            await user.text('admin:stats', '📊 Статистика')
+            await user.text('admin:activations', '⚙️ Активации')
+            if await user.press_button('admin:pending_page', 'pg1:'):
+                await user.press_button('admin:view_activation', 'vw1:')
+            await user.text('admin:mark_menu', '✅ Отметить как обработанную')
+            await user.text('admin:search_menu', '🔍 Поиск заявки')
+            await user.text('admin:search', 'Клиент')
+            await user.press_button('admin:search_next', 'sr1:')
+        self.completed['admin'] += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def step_stats(timings):
+    stats = {}
+    for step, values in timings.items():
+        values = sorted(values)
+        stats[step] = {
+            'count': len(values),
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    return stats
+
+
+def db_contention():
+    """Задержки функций БД (включают ожидание единственного писателя) и очередь потоков БД"""
+    from database_async import get_metrics
+    queries = {}
+    for _, labels, histogram in metrics.registry.histograms(metrics.DB_METRIC):
+        if histogram.count:
+            queries[dict(labels)['query']] = {
+                'count': histogram.count,
+                'errors': histogram.errors,
+                'p50_ms': histogram.quantile(0.5) * 1000,
+                'p95_ms': histogram.quantile(0.95) * 1000,
+                'total_ms': histogram.sum * 1000,
+            }
+    return {'queries': queries, 'executor': get_metrics()}
+
+
+async def run(args, db_path):
+    # Импорт после настройки пула: main и его модули работают с временной БД
+    db_pool.configure_pool(db_path)
+    import database
+    database.init_database()
+    import main
+    from outbox import outbox
+
+    transport = FakeTelegramRequest(latency=args.api_latency_ms / 1000)
+    application = main.build_application(token='1:LOADTEST', request=transport)
+    harness = Harness(application, transport, args.think_ms / 1000)
+    application.add_error_handler(harness.on_error)
+
+    await application.initialize()
+    await application.start()
+    outbox.start(application.bot)
+
+    buyers = int(args.users * args.buyers)
+    flows = []
+    for index in range(args.users):
+        user = SimulatedUser(harness, FIRST_USER_ID + index, f'user{index}')
+        flow = harness.purchase_flow if index < buyers else harness.activation_flow
+        flows.append((flow, user, index))
+    admins = [SimulatedUser(harness, admin_id, f'admin{n}') for n, admin_id in enumerate(ADMIN_IDS[:args.admins])]
+
+    async def delayed(coroutine):
+        if args.ramp:
+            await asyncio.sleep(random.uniform(0, args.ramp))
+        await coroutine
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(delayed(flow(user, index)) for flow, user, index in flows),
+        *(delayed(harness.admin_flow(admin, args.admin_rounds)) for admin in admins),
+    )
+    elapsed = time.perf_counter() - started
+
+    await outbox.stop()
+    await application.stop()
+    await application.shutdown()
+    contention = db_contention()
+
+    purchases = database.count_purchases()
+    activations = database.count_activations_by_service(0)
+    data_errors = []
+    if purchases != buyers:
+        data_errors.append(f"покупок в БД {purchases}, ожидалось {buyers}")
+    if activations != args.users - buyers:
+        data_errors.append(f"активаций в БД {activations}, ожидалось {args.users - buyers}")
+
+    updates = sum(len(values) for values in harness.timings.values())
+    return {
+        'users': args.users,
+        'buyers': buyers,
+        'admins': len(admins),
+        'api_latency_ms': args.api_latency_ms,
+        'elapsed_s': elapsed,
+        'updates': updates,
+        'updates_per_s': updates / elapsed if elapsed else 0.0,
+        'flows_per_s': (args.users + len(admins)) / elapsed if elapsed else 0.0,
+        'completed': harness.completed,
+        'failed_flows': harness.failed_flows,
+        'handler_errors': harness.errors,
+        'data_errors': data_errors,
+        'skipped_steps': harness.skipped,
+        'steps': step_stats(harness.timings),
+        'bot_api_calls': transport.calls,
+        'update_processor': application.update_processor.metrics(),
+        'db': contention,
+    }
+
+
+def print_report(result):
+    print(f"\nПользователей: {result['users']} (покупка {result['buyers']}, "
+          f"активация {result['users'] - result['buyers']}), админов: {result['admins']}, "
+          f"задержка Bot API {result['api_latency_ms']} мс")
+    print(f"Обновлений: {result['updates']} за {result['elapsed_s']:.2f} с - "
+          f"{result['updates_per_s']:.0f} обновлений/с, {result['flows_per_s']:.1f} сценариев/с")
+    print(f"Завершено сценариев: {result['completed']}")
+
+    print(f"\n{'Шаг':<28}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for step, stats in result['steps'].items():
+        print(f"{step:<28}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+
+    queries = sorted(result['db']['queries'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+    print(f"\n{'Функция БД':<40}{'вызовов':>8}{'p50 мс':>10}{'p95 мс':>10}{'всего мс':>11}")
+    for name, stats in queries[:12]:
+        print(f"{name:<40}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['total_ms']:>11.0f}")
+
+    executor = result['db']['executor']
+    print(f"\nПотоки БД: максимум в работе {executor['max_in_flight']} при {executor['threads']} потоках, "
+          f"ожиданий очереди {executor['backpressure_waits']} ({executor['backpressure_wait_time'] * 1000:.0f} мс), "
+          f"ошибок {executor['failed']}")
+    processor = result['update_processor']
+    print(f"Обработка обновлений: максимум одновременно {processor['max_active']}, "
+          f"очередь до {processor['max_queue_depth']}, среднее ожидание {processor['avg_wait_time'] * 1000:.1f} мс")
+    if result['skipped_steps']:
+        print(f"Пропущено шагов (нет кнопки в ответе): {result['skipped_steps']}")
+
+
+def check(result, args):
+    """Список нарушений для режима проверки на регрессию"""
+    problems = []
+    problems += [f"ошибка обработчика: {error}" for error in result['handler_errors'][:10]]
+    problems += [f"сценарий не завершен: {flow}" for flow in result['failed_flows'][:10]]
+    problems += result['data_errors']
+    if result['db']['executor']['failed']:
+        problems.append(f"ошибок запросов к БД: {result['db']['executor']['failed']}")
+    if args.max_p95_ms is not None:
+        for step, stats in result['steps'].items():
+            if stats['p95_ms'] > args.max_p95_ms:
+                problems.append(f"{step}: p95 {stats['p95_ms']:.1f} мс > {args.max_p95_ms} мс")
+    if args.min_updates_per_s is not None and result['updates_per_s'] < args.min_updates_per_s:
+        problems.append(f"пропускная способность {result['updates_per_s']:.0f} < {args.min_updates_per_s} обновлений/с")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без сети")
+    parser.add_argument('--users', type=int, default=200, help="число клиентов")
+    parser.add_argument('--buyers', type=float, default=0.3, help="доля клиентов со сценарием покупки")
+    parser.add_argument('--admins', type=int, default=len(ADMIN_IDS), help=f"число админов (до {len(ADMIN_IDS)})")
+    parser.add_argument('--admin-rounds', type=int, default=5, help="проходов по админ-панели на админа")
+    parser.add_argument('--api-latency-ms', type=float, default=20, help="задержка ответа Bot API")
+    parser.add_argument('--think-ms', type=float, default=0, help="средняя пауза пользователя между шагами")
+    parser.add_argument('--ramp', type=float, default=0, help="пользователи стартуют в течение RAMP секунд")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-p95-ms', type=float, help="порог p95 любого шага")
+    parser.add_argument('--min-updates-per-s', type=float, help="порог пропускной способности")
+    parser.add_argument('--json', metavar='PATH', help="записать результат в JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as tmp_dir:
+        try:
+            result = asyncio.run(run(args, os.path.join(tmp_dir, 'loadtest.db')))
+        finally:
+            db_pool.close_pool()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    problems = check(result, args)
+    if problems:
+        print("\n❌ Проверка не пройдена:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("\n✅ Все сценарии завершены без ошибок")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
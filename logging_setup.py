@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime
+
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_SAMPLE_RATE, LOG_QUEUE_SIZE,
+    LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+)
+
+
+# Поля контекста обновления (user_id, request, handler) - свои у каждой задачи asyncio,
+# поэтому параллельно обрабатываемые обновления не смешиваются
+_context = contextvars.ContextVar('log_context', default={})
+
+# Атрибуты стандартной LogRecord - все остальные (extra=...) попадают в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Шумные библиотеки: httpx пишет INFO на каждый запрос к Bot API
+QUIET_LOGGERS = {'httpx': logging.WARNING, 'httpcore': logging.WARNING, 'apscheduler': logging.WARNING}
+
+
+def bind(**fields):
+    """Добавляет поля в контекст логов текущего обновления (например request="ST-000001")"""
+    _context.set({**_context.get(), **fields})
+
+
+def with_log_context(handler_name, state=None):
+    """Обертка обработчика: в контекст логов кладутся handler, state (состояние диалога),
+    user_id и номер заявки из user_data (если диалог его уже создал)"""
+    def decorator(callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context, *args, **kwargs):
+            fields = {'handler': handler_name}
+            if state:
+                fields['state'] = state
+            user = getattr(update, 'effective_user', None)
+            if user is not None:
+                fields['user_id'] = user.id
+            user_data = getattr(context, 'user_data', None)
+            if user_data and user_data.get('request_number'):
+                fields['request'] = user_data['request_number']
+            token = _context.set({**_context.get(), **fields})
+            try:
+                return await callback(update, context, *args, **kwargs)
+            finally:
+                _context.reset(token)
+        return wrapper
+    return decorator
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, логгер, сообщение, поля контекста и extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        extra = {key: value for key, value in record.__dict__.items()
+                 if key not in _RECORD_ATTRS and not key.startswith('_')}
+        if extra:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in extra.items())
+        return text
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в ограниченную очередь без ожидания. Форматирование и запись в
+    файл/stdout - в потоке QueueListener. При переполнении запись отбрасывается и
+    считается в dropped: логи никогда не блокируют event loop.
+    """
+
+    def __init__(self, log_queue, sample_rate=1.0):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # Контекст читается здесь - в задаче, которая пишет запись, а не в потоке логов
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler = None
+_listener = None
+
+
+def under_journald():
+    """stdout процесса подключен к journald (systemd с StandardOutput=journal) - ротацией занимается он"""
+    return bool(os.environ.get('JOURNAL_STREAM'))
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, log_file=LOG_FILE):
+    """Настраивает корневой логгер: очередь + поток записи. Повторный вызов ничего не делает."""
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+
+    formatter = JSONFormatter() if log_format == 'json' else TextFormatter()
+    if under_journald() or not log_file:
+        output = logging.StreamHandler(sys.stdout)
+    else:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        output = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    output.setFormatter(formatter)
+    outputs = [output]
+    if isinstance(output, logging.FileHandler) and sys.stderr.isatty():
+        # При запуске из терминала - еще и читаемый вывод в консоль
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(TextFormatter())
+        outputs.append(console)
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), LOG_DEBUG_SAMPLE_RATE)
+    root = logging.getLogger()
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(level)
+    for name, quiet_level in QUIET_LOGGERS.items():
+        logging.getLogger(name).setLevel(quiet_level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *outputs, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток логов"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    """Метрики очереди логов (для /metrics)"""
+    if _queue_handler is None:
+        return {}
+    return {
+        'queue_depth': _queue_handler.queue.qsize(),
+        'dropped': _queue_handler.dropped,
+        'debug_sampled_out': _queue_handler.sampled_out,
+    }
@@ -1,10 +1,9 @@
+import asyncio
+import logging
 import re
 import uuid
-import os
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,8 +16,8 @@ from telegram.ext import (
     JobQueue,
     ApplicationHandlerStop,
 )
-from database import (
-    init_database,
+from database import init_database, encode_page_cursor
+from database_async import (
     add_purchase,
     add_activation,
     update_activation_receipt,
@@ -27,24 +26,40 @@ from database import (
     update_activation_serial_photo,
     update_activation_box_serial_number,
     update_activation_box_serial_photo,
-    get_all_purchases,
-    get_all_activations,
-    get_statistics,
+    get_purchases_page,
+    count_purchases,
+    get_activation_list,
+    get_pending_activation_list,
     mark_service_provided,
-    get_activations_for_subscription_reminders,
-    update_last_reminder_day,
     update_activation_email_password,
     get_activation_by_id,
-    get_pending_activations,
-    get_processed_activations,
     find_activation_by_request_number,
     find_purchase_by_request_number,
+    search_requests,
     delete_activation,
     delete_purchase,
     toggle_service_provided,
+    get_pending_activations_page,
+    get_processed_activations_page,
+    count_activations_by_service,
 )
-from config import BOT_TOKEN, ACTIVATION_PRICE, ACTIVATION_PRICE_TON, PAYMENT_PHONE, PROVIDER_TOKEN, ADMIN_IDS, ADMIN_PASSWORD, SERIAL_NUMBER_EXAMPLE
-
+from export_service import export_service
+from media_cache import media_cache
+from reminders import reminder_scheduler
+from outbox import outbox
+from persistence import SQLitePersistence
+from webhook import serve_webhook
+from update_processor import update_processor
+from callback_router import CallbackRouter
+import metrics
+import logging_setup
+from database_async import get_metrics as get_db_executor_metrics
+import notifications
+from stats import get_dashboard, format_dashboard, invalidate_dashboard
+from config import BOT_TOKEN, ACTIVATION_PRICE, ACTIVATION_PRICE_TON, PAYMENT_PHONE, PROVIDER_TOKEN, ADMIN_IDS, ADMIN_PASSWORD, SERIAL_NUMBER_EXAMPLE, WEBHOOK_URL, METRICS_PATH
+
+
+logger = logging.getLogger(__name__)
 
 WAITING_PHONE_PURCHASE, WAITING_NAME_PURCHASE = range(2)
 WAITING_PHONE_ACTIVATE, WAITING_NAME_ACTIVATE, WAITING_SERIAL, WAITING_SERIAL_PHOTO, WAITING_BOX_SERIAL, WAITING_BOX_SERIAL_PHOTO = range(5, 11)
@@ -54,6 +69,38 @@ WAITING_ADMIN_SEARCH = 19
 WAITING_ADMIN_DELETE_CONFIRM = 20
 ADMIN_PANEL_ACTIVE = 21
 
+# Типы обновлений, на которые есть обработчики; остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.PRE_CHECKOUT_QUERY]
+
+# Маршруты inline кнопок админ-панели: "<префикс>:<аргументы>", цифра в префиксе - версия формата
+admin_router = CallbackRouter()
+CB_STATS = "st1"
+CB_PURCHASES = "pu1"
+CB_ACTIVATIONS = "ac1"
+CB_EXPORT_EXCEL = "ex1"
+CB_MARK_LIST = "mp1"
+CB_MARK = "mk1"
+CB_CREDENTIALS_LIST = "cl1"
+CB_ADD_CREDENTIALS = "ce1"
+CB_ACTIVATIONS_PAGE = "pg1"
+CB_VIEW_ACTIVATION = "vw1"
+CB_VIEW_PURCHASE = "vb1"
+CB_SEARCH_PAGE = "sr1"
+CB_ACTIVATION_XLSX = "xl1"
+CB_TOGGLE_STATUS = "tg1"
+CB_DELETE_CONFIRM = "dc1"
+CB_DELETE_YES = "dy1"
+CB_DELETE_PURCHASE = "dp1"
+CB_EXIT = "qx1"
+
+# Категории списка заявок (аргумент CB_ACTIVATIONS_PAGE)
+PAGE_PENDING = "p"
+PAGE_PROCESSED = "d"
+
+# Куда ведет кнопка "Назад" из карточки заявки (user_data['admin_view_back_to'])
+BACK_TO_ACTIVATIONS = "activations"
+BACK_TO_SEARCH = "search"
+
 
 def normalize_phone(phone):
     """Валидация и нормализация номера телефона.
@@ -87,11 +134,10 @@ def normalize_phone(phone):
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    print(f"DEBUG: start command received from user {update.effective_user.id}")
+    logger.debug("Команда /start")
     try:
         # Очищаем все состояния ConversationHandler для этого пользователя
         context.user_data.clear()
-        print(f"DEBUG: user_data cleared for user {update.effective_user.id}")
         
         welcome_text = (
             "Приветствуем! Вас приветствует команда RICH - сильнейшая команда на рынке, "
@@ -122,16 +168,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=reply_markup,
             disable_web_page_preview=False
         )
-        print(f"DEBUG: start message sent to user {update.effective_user.id}")
+        logger.debug("Приветствие отправлено")
         
         # Останавливаем дальнейшую обработку
         raise ApplicationHandlerStop()
     except ApplicationHandlerStop:
         raise
-    except Exception as e:
-        print(f"Ошибка в start: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Ошибка в start")
         raise ApplicationHandlerStop()
 
 
@@ -189,8 +233,10 @@ async def handle_name_purchase(update: Update, context: ContextTypes.DEFAULT_TYP
     phone = context.user_data['phone']
     username = update.effective_user.username  # Получаем username, если доступен
     
-    purchase_id = add_purchase(user_id, phone, name, username)
+    purchase_id = await add_purchase(user_id, phone, name, username)
     request_number = f"BUY-{purchase_id:06d}"  # Номер заявки в формате BUY-000001
+    logging_setup.bind(request=request_number)
+    logger.info("Создана заявка на покупку")
     
     await update.message.reply_text(
         f"✅ Заявка создана!\n\n"
@@ -232,20 +278,19 @@ async def handle_name_activate(update: Update, context: ContextTypes.DEFAULT_TYP
     phone = context.user_data['phone']
     username = update.effective_user.username  # Получаем username, если доступен
     
-    activation_id = add_activation(user_id, phone, name, username)
+    # Сообщение с номером заявки ставится в outbox в одной транзакции с заявкой
+    activation_id = await add_activation(user_id, phone, name, username, notify=True)
     request_number = f"ST-{activation_id:06d}"  # Номер заявки в формате ST-000001
+    logging_setup.bind(request=request_number)
+    logger.info("Создана заявка на активацию")
     context.user_data['activation_id'] = activation_id
     context.user_data['name'] = name
     context.user_data['phone'] = phone
     context.user_data['request_number'] = request_number
     
-    # Отправляем номер заявки пользователю
-    await update.message.reply_text(
-        f"✅ Заявка создана!\n\n"
-        f"Номер вашей заявки: <b>{request_number}</b>\n\n"
-        f"Сохраните этот номер для отслеживания статуса.",
-        parse_mode='HTML'
-    )
+    # Номер заявки должен прийти раньше следующих шагов, поэтому отправляем сразу;
+    # если отправка не удалась, сообщение повторит фоновая доставка outbox
+    await outbox.deliver_now(context.bot, notifications.activation_created_key(activation_id))
     
     message_text = (
         "Спасибо за доверие! Для активации от Вас нужен серийный номер "
@@ -253,33 +298,8 @@ async def handle_name_activate(update: Update, context: ContextTypes.DEFAULT_TYP
         "(чтобы исключить риск активации чужого устройства), прилагаем пример:"
     )
     
-    photo_path_jpg = os.path.join(os.path.dirname(__file__), "images", "serial_number_example.jpg")
-    photo_path_png = os.path.join(os.path.dirname(__file__), "images", "serial_number_example.png")
-    
-    photo_sent = False
-    if os.path.exists(photo_path_jpg):
-        try:
-            with open(photo_path_jpg, 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото JPG: {e}")
-    
-    if not photo_sent and os.path.exists(photo_path_png):
-        try:
-            with open(photo_path_png, 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото PNG: {e}")
-    
-    if not photo_sent:
+    # Пример отправляется по сохраненному file_id, файл загружается только один раз
+    if not await media_cache.reply_photo(update.message, "serial_number_example", caption=message_text):
         await update.message.reply_text(message_text)
     
     await update.message.reply_text(
@@ -315,7 +335,7 @@ async def handle_serial_number(update: Update, context: ContextTypes.DEFAULT_TYP
         return WAITING_SERIAL
     
     user_id = update.effective_user.id
-    update_activation_serial_number(user_id, serial_number)
+    await update_activation_serial_number(user_id, serial_number)
     
     keyboard = [
         [InlineKeyboardButton("⏭️ Пропустить фото", callback_data="skip_serial_photo")]
@@ -343,40 +363,15 @@ async def handle_serial_photo(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return WAITING_SERIAL_PHOTO
     
-    update_activation_serial_photo(user_id, file_id)
+    await update_activation_serial_photo(user_id, file_id)
     
     message_text = (
         "А также серийный номер с коробки терминала (написан после букв SN) + его фото, "
         "прилагаем пример:"
     )
     
-    photo_path_jpg = os.path.join(os.path.dirname(__file__), "images", "serial_number_box_example.jpg")
-    photo_path_png = os.path.join(os.path.dirname(__file__), "images", "serial_number_box_example.png")
-    
-    photo_sent = False
-    if os.path.exists(photo_path_jpg):
-        try:
-            with open(photo_path_jpg, 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото JPG: {e}")
-    
-    if not photo_sent and os.path.exists(photo_path_png):
-        try:
-            with open(photo_path_png, 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото PNG: {e}")
-    
-    if not photo_sent:
+    # Пример отправляется по сохраненному file_id, файл загружается только один раз
+    if not await media_cache.reply_photo(update.message, "serial_number_box_example", caption=message_text):
         await update.message.reply_text(message_text)
     
     await update.message.reply_text(
@@ -405,33 +400,8 @@ async def skip_serial_photo_callback(update: Update, context: ContextTypes.DEFAU
         "прилагаем пример:"
     )
     
-    photo_path_jpg = os.path.join(os.path.dirname(__file__), "images", "serial_number_box_example.jpg")
-    photo_path_png = os.path.join(os.path.dirname(__file__), "images", "serial_number_box_example.png")
-    
-    photo_sent = False
-    if os.path.exists(photo_path_jpg):
-        try:
-            with open(photo_path_jpg, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото JPG: {e}")
-    
-    if not photo_sent and os.path.exists(photo_path_png):
-        try:
-            with open(photo_path_png, 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=message_text
-                )
-            photo_sent = True
-        except Exception as e:
-            print(f"Ошибка отправки фото PNG: {e}")
-    
-    if not photo_sent:
+    # Пример отправляется по сохраненному file_id, файл загружается только один раз
+    if not await media_cache.reply_photo(query.message, "serial_number_box_example", caption=message_text):
         await query.message.reply_text(message_text)
     
     await query.message.reply_text(
@@ -460,7 +430,7 @@ async def handle_box_serial_number(update: Update, context: ContextTypes.DEFAULT
         return WAITING_BOX_SERIAL
     
     user_id = update.effective_user.id
-    update_activation_box_serial_number(user_id, box_serial_number)
+    await update_activation_box_serial_number(user_id, box_serial_number)
     
     keyboard = [
         [InlineKeyboardButton("⏭️ Пропустить фото", callback_data="skip_box_photo")]
@@ -507,7 +477,7 @@ async def handle_box_serial_photo(update: Update, context: ContextTypes.DEFAULT_
         )
         return WAITING_BOX_SERIAL_PHOTO
     
-    update_activation_box_serial_photo(user_id, file_id)
+    await update_activation_box_serial_photo(user_id, file_id)
     
     # После получения фото коробки завершаем и просим ожидать
     await update.message.reply_text(
@@ -531,7 +501,7 @@ async def handle_kit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kit_number = update.message.text.strip()
     user_id = update.effective_user.id
     
-    update_activation_kit(user_id, kit_number)
+    await update_activation_kit(user_id, kit_number)
     
     await update.message.reply_text(
         "KIT номер сохранен. Пожалуйста, ожидайте. ⏳"
@@ -548,13 +518,12 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
     payment = update.message.successful_payment
     user_id = update.effective_user.id
     
-    update_activation_receipt(user_id, payment.telegram_payment_charge_id)
-    
-    await update.message.reply_text(
-        "✅ Платеж успешно получен!\n\n"
-        "Пожалуйста, ожидайте. ⏳\n\n"
-        "Мы свяжемся с вами в ближайшее время."
-    )
+    # Подтверждение платежа ставится в outbox вместе с отметкой об оплате
+    updated = await update_activation_receipt(user_id, payment.telegram_payment_charge_id, notify=True)
+    if updated:
+        outbox.kick()
+    else:
+        logger.warning("Оплата без ожидающей заявки на активацию")
     context.user_data.clear()
     return ConversationHandler.END
 
@@ -618,6 +587,52 @@ def is_admin(user_id):
     return user_id in ADMIN_IDS
 
 
+def activation_categories_markup():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏳ Ожидают", callback_data=admin_router.data(CB_ACTIVATIONS_PAGE, PAGE_PENDING, 0))],
+        [InlineKeyboardButton("✅ Обработанные", callback_data=admin_router.data(CB_ACTIVATIONS_PAGE, PAGE_PROCESSED, 0))]
+    ])
+
+
+def activation_list_buttons(items, route, show_email=False):
+    """Кнопки выбора заявки из списка ActivationListItem"""
+    return [
+        [InlineKeyboardButton(
+            f"{item.request_number}: {item.name} ({item.phone})" + (" ✉️" if show_email and item.email else ""),
+            callback_data=admin_router.data(route, item.id)
+        )]
+        for item in items
+    ]
+
+
+def page_nav_buttons(route, args, page, first_cursor, last_cursor, has_next):
+    """Кнопки "Назад"/"Вперед" keyset-пагинации: маршрут route с аргументами
+    (*args, страница, n|p, курсор крайней строки текущей страницы)
+    """
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=admin_router.data(route, *args, page - 1, "p", first_cursor)))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton("▶️ Вперед", callback_data=admin_router.data(route, *args, page + 1, "n", last_cursor)))
+    return nav_buttons
+
+
+def credentials_info(activation):
+    """Текущие email/пароль заявки для подсказки при вводе новых"""
+    if not (activation.email or activation.password):
+        return ""
+    password = '*' * len(activation.password) if activation.password else 'не указан'
+    return f"\nТекущий email: {activation.email if activation.email else 'не указан'}\nТекущий пароль: {password}"
+
+
+def back_button(back_to):
+    """Кнопка "Назад" из карточки заявки: к поиску или к категориям активаций"""
+    if back_to == BACK_TO_SEARCH:
+        # Поиск - entry point ConversationHandler, а не маршрут admin_router
+        return InlineKeyboardButton("🔙 Назад", callback_data="admin_search")
+    return InlineKeyboardButton("🔙 Назад", callback_data=admin_router.data(CB_ACTIVATIONS))
+
+
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -713,7 +728,7 @@ async def admin_password_field_handler(update: Update, context: ContextTypes.DEF
         context.user_data.pop('admin_cred_state', None)
         return ConversationHandler.END
     
-    if update_activation_email_password(activation_id, email, password):
+    if await update_activation_email_password(activation_id, email, password):
         request_number = f"ST-{activation_id:06d}"
         await update.message.reply_text(
             f"✅ Email и пароль успешно привязаны к заявке {request_number}!"
@@ -726,7 +741,7 @@ async def admin_password_field_handler(update: Update, context: ContextTypes.DEF
         context.user_data.pop('admin_cred_state', None)
         
         # Показываем обновленную заявку
-        activation = get_activation_by_id(activation_id)
+        activation = await get_activation_by_id(activation_id)
         if activation:
             await show_activation_details(update, context, activation)
         
@@ -751,184 +766,53 @@ async def admin_password_field_handler(update: Update, context: ContextTypes.DEF
 
 async def show_activation_details(update: Update, context: ContextTypes.DEFAULT_TYPE, activation):
     """Универсальная функция для показа детальной информации о заявке активации с кнопками редактирования"""
-    act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = activation[:18]
-    request_number = f"ST-{act_id:06d}"
-    
-    text = f"📋 Детальная информация по заявке {request_number}\n\n"
-    text += f"🔹 ID заявки: {act_id}\n"
-    text += f"User ID: {uid}\n"
-    text += f"Username: @{username}\n" if username else "Username: не указан\n"
-    text += f"Имя: {name}\n"
-    text += f"Телефон: {phone}\n"
-    text += f"Дата создания: {created_at[:19]}\n"
-    text += f"Статус: {status}\n"
-    text += f"Оплата получена: {'✅ Да' if payment else '❌ Нет'}\n"
-    text += f"Услуга оказана: {'✅ Да' if service_provided else '❌ Нет'}\n"
-    
-    if service_provided_at:
-        start_date = datetime.fromisoformat(service_provided_at)
-        end_date = start_date + timedelta(days=30)
-        text += f"Дата начала активации: {service_provided_at[:19]}\n"
-        text += f"Дата окончания подписки: {end_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
-    
-    text += f"\n📦 Данные устройства:\n"
-    text += f"SN устройство: {serial_num if serial_num else 'не указан'}\n"
-    text += f"SN коробка: {box_serial if box_serial else 'не указан'}\n"
-    if kit:
-        text += f"KIT номер: {kit}\n"
-    
-    if email:
-        text += f"\n📧 Email: {email}\n"
-    if password:
-        text += f"🔑 Пароль: {password}\n"
-    
-    # Кнопки редактирования
-    keyboard = []
-    keyboard.append([InlineKeyboardButton("✏️ Редактировать Email/Пароль", callback_data=f"edit_cred_{act_id}")])
-    
-    if service_provided:
-        keyboard.append([InlineKeyboardButton("❌ Снять отметку об обработке", callback_data=f"toggle_status_{act_id}")])
-    else:
-        keyboard.append([InlineKeyboardButton("✅ Отметить как обработанную", callback_data=f"toggle_status_{act_id}")])
-    
-    keyboard.append([InlineKeyboardButton("🗑️ Удалить заявку", callback_data=f"delete_confirm_{act_id}")])
-    
-    # Определяем, откуда пришли (поиск или список)
-    back_to = context.user_data.get('admin_view_back_to', 'admin_activations')
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=back_to)])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Если это query (callback), используем редактирование сообщения, иначе отправляем новое
-    if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
-    else:
-        await update.message.reply_text(text, reply_markup=reply_markup)
-    
-    # Генерируем и отправляем Excel файл с данными заявки
-    if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.message.reply_text("📄 Генерирую Excel файл...")
-    else:
-        await update.message.reply_text("📄 Генерирую Excel файл...")
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Активация"
-    
-    headers = ["Номер заявки", "User ID", "Username", "Номер телефона", "Имя", "Дата заявки", "Услуга",
-               "SN устройство", "SN коробка", "KIT номер",
-               "Дата начала активации", "Дата окончания подписки", "Email", "Пароль"]
-    ws.append(headers)
-    
-    # Форматирование заголовков
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Добавляем данные заявки
-    start_date_str = ""
-    end_date_str = ""
-    
-    if service_provided_at:
-        start_date = datetime.fromisoformat(service_provided_at)
-        end_date = start_date + timedelta(days=30)
-        start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-        end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
-    
-    ws.append([
-        request_number,
-        uid,
-        f"@{username}" if username else "",
-        phone,
-        name,
-        created_at[:19],
-        "Активация",
-        serial_num if serial_num else "",
-        box_serial if box_serial else "",
-        kit if kit else "",
-        start_date_str,
-        end_date_str,
-        email if email else "",
-        password if password else ""
-    ])
-    
-    # Автоматическая ширина столбцов
-    from openpyxl.utils import get_column_letter
-    for col_idx, header in enumerate(headers, start=1):
-        max_length = len(str(header))
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-            cell = row[0]
-            if cell.value:
-                cell_value = str(cell.value)
-                max_length = max(max_length, len(cell_value))
-        col_letter = get_column_letter(col_idx)
-        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-    
-    filename = f"activation_{request_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    wb.save(filename)
-    
-    if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.message.reply_document(
-            document=open(filename, 'rb'),
-            filename=filename
-        )
-    else:
-        await update.message.reply_document(
-            document=open(filename, 'rb'),
-            filename=filename
-        )
-    
-    os.remove(filename)
-
-
-async def show_activation_details(update: Update, context: ContextTypes.DEFAULT_TYPE, activation):
-    """Универсальная функция для показа детальной информации о заявке активации с кнопками редактирования"""
-    act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = activation[:18]
-    request_number = f"ST-{act_id:06d}"
+    act = activation
+    act_id = act.id
     
-    text = f"📋 Детальная информация по заявке {request_number}\n\n"
+    text = f"📋 Детальная информация по заявке {act.request_number}\n\n"
     text += f"🔹 ID заявки: {act_id}\n"
-    text += f"User ID: {uid}\n"
-    username_str = f"@{username}" if username else "не указан"
+    text += f"User ID: {act.user_id}\n"
+    username_str = f"@{act.username}" if act.username else "не указан"
     text += f"Username: {username_str}\n"
-    text += f"Имя: {name}\n"
-    text += f"Телефон: {phone}\n"
-    text += f"Дата создания: {created_at[:19]}\n"
-    text += f"Статус: {status}\n"
-    text += f"Оплата получена: {'✅ Да' if payment else '❌ Нет'}\n"
-    text += f"Услуга оказана: {'✅ Да' if service_provided else '❌ Нет'}\n"
-    
-    if service_provided_at:
-        start_date = datetime.fromisoformat(service_provided_at)
+    text += f"Имя: {act.name}\n"
+    text += f"Телефон: {act.phone}\n"
+    text += f"Дата создания: {act.created_at[:19]}\n"
+    text += f"Статус: {act.status}\n"
+    text += f"Оплата получена: {'✅ Да' if act.payment_received else '❌ Нет'}\n"
+    text += f"Услуга оказана: {'✅ Да' if act.service_provided else '❌ Нет'}\n"
+    
+    if act.service_provided_at:
+        start_date = datetime.fromisoformat(act.service_provided_at)
         end_date = start_date + timedelta(days=30)
-        text += f"Дата начала активации: {service_provided_at[:19]}\n"
+        text += f"Дата начала активации: {act.service_provided_at[:19]}\n"
         text += f"Дата окончания подписки: {end_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
     
     text += f"\n📦 Данные устройства:\n"
-    text += f"SN устройство: {serial_num if serial_num else 'не указан'}\n"
-    text += f"SN коробка: {box_serial if box_serial else 'не указан'}\n"
-    if kit:
-        text += f"KIT номер: {kit}\n"
+    text += f"SN устройство: {act.serial_number if act.serial_number else 'не указан'}\n"
+    text += f"SN коробка: {act.box_serial_number if act.box_serial_number else 'не указан'}\n"
+    if act.kit_number:
+        text += f"KIT номер: {act.kit_number}\n"
     
-    if email:
-        text += f"\n📧 Email: {email}\n"
-    if password:
-        text += f"🔑 Пароль: {password}\n"
+    if act.email:
+        text += f"\n📧 Email: {act.email}\n"
+    if act.password:
+        text += f"🔑 Пароль: {act.password}\n"
     
     # Кнопки редактирования
     keyboard = []
     keyboard.append([InlineKeyboardButton("✏️ Редактировать Email/Пароль", callback_data=f"edit_cred_{act_id}")])
     
-    if service_provided:
-        keyboard.append([InlineKeyboardButton("❌ Снять отметку об обработке", callback_data=f"toggle_status_{act_id}")])
+    if act.service_provided:
+        keyboard.append([InlineKeyboardButton("❌ Снять отметку об обработке", callback_data=admin_router.data(CB_TOGGLE_STATUS, act_id))])
     else:
-        keyboard.append([InlineKeyboardButton("✅ Отметить как обработанную", callback_data=f"toggle_status_{act_id}")])
+        keyboard.append([InlineKeyboardButton("✅ Отметить как обработанную", callback_data=admin_router.data(CB_TOGGLE_STATUS, act_id))])
     
-    keyboard.append([InlineKeyboardButton("🗑️ Удалить заявку", callback_data=f"delete_confirm_{act_id}")])
+    keyboard.append([InlineKeyboardButton("📄 Excel файл заявки", callback_data=admin_router.data(CB_ACTIVATION_XLSX, act_id))])
+    keyboard.append([InlineKeyboardButton("🗑️ Удалить заявку", callback_data=admin_router.data(CB_DELETE_CONFIRM, act_id))])
     
     # Определяем, откуда пришли (поиск или список)
-    back_to = context.user_data.get('admin_view_back_to', 'admin_activations')
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=back_to)])
+    back_to = context.user_data.get('admin_view_back_to', BACK_TO_ACTIVATIONS)
+    keyboard.append([back_button(back_to)])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -936,133 +820,120 @@ async def show_activation_details(update: Update, context: ContextTypes.DEFAULT_
     if hasattr(update, 'callback_query') and update.callback_query:
         query = update.callback_query
         await query.message.reply_text(text, reply_markup=reply_markup)
-        msg_for_excel = query.message
     else:
         await update.message.reply_text(text, reply_markup=reply_markup)
-        msg_for_excel = update.message
-    
-    # Генерируем и отправляем Excel файл с данными заявки
-    await msg_for_excel.reply_text("📄 Генерирую Excel файл...")
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Активация"
-    
-    headers = ["Номер заявки", "User ID", "Username", "Номер телефона", "Имя", "Дата заявки", "Услуга",
-               "SN устройство", "SN коробка", "KIT номер",
-               "Дата начала активации", "Дата окончания подписки", "Email", "Пароль"]
-    ws.append(headers)
-    
-    # Форматирование заголовков
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Добавляем данные заявки
-    start_date_str = ""
-    end_date_str = ""
-    
-    if service_provided_at:
-        start_date = datetime.fromisoformat(service_provided_at)
-        end_date = start_date + timedelta(days=30)
-        start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-        end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
-    
-    ws.append([
-        request_number,
-        uid,
-        f"@{username}" if username else "",
-        phone,
-        name,
-        created_at[:19],
-        "Активация",
-        serial_num if serial_num else "",
-        box_serial if box_serial else "",
-        kit if kit else "",
-        start_date_str,
-        end_date_str,
-        email if email else "",
-        password if password else ""
-    ])
-    
-    # Автоматическая ширина столбцов
-    from openpyxl.utils import get_column_letter
-    for col_idx, header in enumerate(headers, start=1):
-        max_length = len(str(header))
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-            cell = row[0]
-            if cell.value:
-                cell_value = str(cell.value)
-                max_length = max(max_length, len(cell_value))
-        col_letter = get_column_letter(col_idx)
-        ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-    
-    filename = f"activation_{request_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    wb.save(filename)
-    
-    await msg_for_excel.reply_document(
-        document=open(filename, 'rb'),
-        filename=filename
-    )
-    
-    os.remove(filename)
+
+
+SEARCH_PROMPT = (
+    "🔍 Введите номер заявки, телефон, имя, @username, серийный номер или KIT:\n\n"
+    "Номер заявки: ST-000001 (для активаций) или BUY-000001 (для покупок)\n\n"
+)
+SEARCH_PAGE_SIZE = 10
+REQUEST_NUMBER_RE = re.compile(r'(?:ST-|BUY-)?\d+', re.IGNORECASE)
 
 
 async def admin_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик поиска заявки по номеру"""
+    """Обработчик поиска заявки: точный номер заявки или поиск по данным заявок"""
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
         return ConversationHandler.END
     
-    request_number = update.message.text.strip().upper()
-    
-    # Ищем активацию
-    activation = find_activation_by_request_number(request_number)
-    if activation:
-        context.user_data['admin_view_back_to'] = 'admin_search_back'
-        await show_activation_details(update, context, activation)
-        return ConversationHandler.END
+    query_text = update.message.text.strip()
     
-    # Ищем покупку
-    purchase = find_purchase_by_request_number(request_number)
-    if purchase:
-        pur_id, uid, phone, name, username, created_at = purchase
-        request_number_formatted = f"BUY-{pur_id:06d}"
-        text = f"📋 Детальная информация по заявке {request_number_formatted}\n\n"
-        text += f"🔹 ID заявки: {pur_id}\n"
-        text += f"User ID: {uid}\n"
-        username_str = f"@{username}" if username else "не указан"
-        text += f"Username: {username_str}\n"
-        text += f"Имя: {name}\n"
-        text += f"Телефон: {phone}\n"
-        text += f"Дата создания: {created_at[:19]}\n"
+    if REQUEST_NUMBER_RE.fullmatch(query_text):
+        request_number = query_text.upper()
         
-        keyboard = [
-            [InlineKeyboardButton("🗑️ Удалить заявку", callback_data=f"delete_purchase_{pur_id}")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_search_back")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(text, reply_markup=reply_markup)
+        # Ищем активацию
+        activation = await find_activation_by_request_number(request_number)
+        if activation:
+            context.user_data['admin_view_back_to'] = BACK_TO_SEARCH
+            await show_activation_details(update, context, activation)
+            return ConversationHandler.END
+        
+        # Ищем покупку
+        purchase = await find_purchase_by_request_number(request_number)
+        if purchase:
+            await show_purchase_details(update.message, purchase)
+            return ConversationHandler.END
+    
+    # Поиск по телефону, имени, username, серийным номерам
+    if await send_search_results(update.message, context, 0, query_text):
         return ConversationHandler.END
     
     # Не найдено
     await update.message.reply_text(
-        f"❌ Заявка с номером {request_number} не найдена.\n\n"
+        f"❌ По запросу {query_text} ничего не найдено.\n\n"
         f"Попробуйте еще раз или отправьте /cancel для отмены."
     )
     return WAITING_ADMIN_SEARCH
 
 
+async def send_search_results(message, context, page, query_text=None):
+    """Страница результатов поиска. Без query_text - по последнему успешному запросу
+    (user_data['admin_search_query'], для кнопок листания). Возвращает False, если
+    на странице ничего нет.
+    """
+    query_text = query_text or context.user_data.get('admin_search_query')
+    if not query_text:
+        return False
+    results, has_more = await search_requests(query_text, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+    if not results:
+        return False
+    context.user_data['admin_search_query'] = query_text
+    
+    routes = {'ST': CB_VIEW_ACTIVATION, 'BUY': CB_VIEW_PURCHASE}
+    buttons = [
+        [InlineKeyboardButton(
+            f"{result.request_number}: {result.name} ({result.phone})",
+            callback_data=admin_router.data(routes[result.kind], result.id)
+        )]
+        for result in results
+    ]
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=admin_router.data(CB_SEARCH_PAGE, page - 1)))
+    if has_more:
+        nav_buttons.append(InlineKeyboardButton("▶️ Вперед", callback_data=admin_router.data(CB_SEARCH_PAGE, page + 1)))
+    if nav_buttons:
+        buttons.append(nav_buttons)
+    
+    # Из карточки найденной заявки "Назад" возвращает к поиску
+    context.user_data['admin_view_back_to'] = BACK_TO_SEARCH
+    await message.reply_text(
+        f"🔍 Результаты поиска: {query_text} (страница {page + 1})",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+    return True
+
+
+async def show_purchase_details(message, purchase):
+    pur_id = purchase.id
+    text = f"📋 Детальная информация по заявке {purchase.request_number}\n\n"
+    text += f"🔹 ID заявки: {pur_id}\n"
+    text += f"User ID: {purchase.user_id}\n"
+    username_str = f"@{purchase.username}" if purchase.username else "не указан"
+    text += f"Username: {username_str}\n"
+    text += f"Имя: {purchase.name}\n"
+    text += f"Телефон: {purchase.phone}\n"
+    text += f"Дата создания: {purchase.created_at[:19]}\n"
+    
+    keyboard = [
+        [InlineKeyboardButton("🗑️ Удалить заявку", callback_data=admin_router.data(CB_DELETE_PURCHASE, pur_id))],
+        [back_button(BACK_TO_SEARCH)]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await message.reply_text(text, reply_markup=reply_markup)
+
+
 async def admin_search_callback_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Entry point для поиска из CallbackQuery"""
-    if update.callback_query and update.callback_query.data == "admin_search":
+    if update.callback_query and update.callback_query.data in ("admin_search", "admin_search_back"):
         user_id = update.effective_user.id
         if is_admin(user_id):
             await update.callback_query.answer()
             await update.callback_query.message.reply_text(
-                "🔍 Введите номер заявки для поиска:\n\n"
-                "Формат: ST-000001 (для активаций) или BUY-000001 (для покупок)\n\n"
+                SEARCH_PROMPT +
                 "Или отправьте /cancel для отмены."
             )
             return WAITING_ADMIN_SEARCH
@@ -1078,13 +949,10 @@ async def admin_edit_callback_entry(update: Update, context: ContextTypes.DEFAUL
             activation_id = int(update.callback_query.data.split("_")[2])
             context.user_data['cred_activation_id'] = activation_id
             context.user_data['admin_cred_state'] = WAITING_ADMIN_EMAIL
-            activation = get_activation_by_id(activation_id)
+            activation = await get_activation_by_id(activation_id)
             if activation:
-                act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = activation[:18]
-                request_number = f"ST-{act_id:06d}"
-                current_info = f"\nТекущий email: {email if email else 'не указан'}\nТекущий пароль: {'*' * len(password) if password else 'не указан'}" if email or password else ""
                 await update.callback_query.message.reply_text(
-                    f"📝 Введите email для заявки {request_number} ({name}):{current_info}\n\n"
+                    f"📝 Введите email для заявки {activation.request_number} ({activation.name}):{credentials_info(activation)}\n\n"
                     f"Или отправьте /cancel для отмены."
                 )
                 return WAITING_ADMIN_EMAIL
@@ -1146,183 +1014,41 @@ async def admin_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if text == "🔍 Поиск заявки":
         context.user_data['admin_search_mode'] = True
         await update.message.reply_text(
-            "🔍 Введите номер заявки для поиска:\n\n"
-            "Формат: ST-000001 (для активаций) или BUY-000001 (для покупок)\n\n"
+            SEARCH_PROMPT +
             "Или отправьте /cancel для отмены.",
             reply_markup=reply_markup
         )
         return WAITING_ADMIN_SEARCH
     
     elif text == "📊 Статистика":
-        stats = get_statistics()
-        text_msg = (
-            f"📊 Статистика\n\n"
-            f"🛒 Всего покупок: {stats['total_purchases']}\n"
-            f"⚙️ Всего активаций: {stats['total_activations']}\n\n"
-            f"⏳ Ожидают оплаты: {stats['pending_activations']}\n"
-            f"💳 Оплата подтверждена: {stats['payment_confirmed']}\n"
-            f"✅ Завершено: {stats['completed_activations']}"
-        )
+        text_msg = format_dashboard(await get_dashboard())
         await update.message.reply_text(text_msg, reply_markup=reply_markup)
         return ADMIN_PANEL_ACTIVE
     
     elif text == "🛒 Покупки":
-        purchases = get_all_purchases()
-        if not purchases:
-            await update.message.reply_text("📭 Покупок пока нет.", reply_markup=reply_markup)
-            return ADMIN_PANEL_ACTIVE
-        
-        text_msg = "🛒 Все покупки:\n\n"
-        for purchase in purchases[:20]:
-            purchase_id, uid, phone, name, username, created_at = purchase[:6]
-            username_str = f"@{username}" if username else "не указан"
-            text_msg += (
-                f"ID: {purchase_id}\n"
-                f"User ID: {uid}\n"
-                f"Username: {username_str}\n"
-                f"Имя: {name}\n"
-                f"Телефон: {phone}\n"
-                f"Дата: {created_at[:19]}\n"
-                f"{'─' * 30}\n"
-            )
-        
-        if len(purchases) > 20:
-            text_msg += f"\n... и еще {len(purchases) - 20} записей"
-        
-        await update.message.reply_text(text_msg, reply_markup=reply_markup)
+        text_msg = await recent_purchases_text()
+        await update.message.reply_text(text_msg or "📭 Покупок пока нет.", reply_markup=reply_markup)
         return ADMIN_PANEL_ACTIVE
     
     elif text == "⚙️ Активации":
         # Показываем две кнопки: Ожидают и Обработанные
-        keyboard_inline = [
-            [InlineKeyboardButton("⏳ Ожидают", callback_data="admin_activations_pending_page_0")],
-            [InlineKeyboardButton("✅ Обработанные", callback_data="admin_activations_processed_page_0")]
-        ]
-        reply_markup_inline = InlineKeyboardMarkup(keyboard_inline)
         await update.message.reply_text(
             "⚙️ Выберите категорию активаций:",
-            reply_markup=reply_markup_inline
+            reply_markup=activation_categories_markup()
         )
         return ADMIN_PANEL_ACTIVE
     
     elif text == "📄 Экспорт в Excel":
-        await update.message.reply_text("📄 Генерирую Excel файл...", reply_markup=reply_markup)
-        activations = get_all_activations()
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Активации"
-        
-        headers = ["Номер заявки", "User ID", "Username", "Номер телефона", "Имя", "Дата заявки", "Услуга",
-                   "SN устройство", "SN коробка", "KIT номер",
-                   "Дата начала активации", "Дата окончания подписки", "Email", "Пароль"]
-        ws.append(headers)
-        
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for act in activations:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            
-            request_number = f"ST-{act_id:06d}"
-            start_date_str = ""
-            end_date_str = ""
-            
-            if service_provided_at:
-                start_date = datetime.fromisoformat(service_provided_at)
-                end_date = start_date + timedelta(days=30)
-                start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-                end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
-            
-            ws.append([
-                request_number,
-                uid,
-                f"@{username}" if username else "",
-                phone,
-                name,
-                created_at[:19],
-                "Активация",
-                serial_num if serial_num else "",
-                box_serial if box_serial else "",
-                kit if kit else "",
-                start_date_str,
-                end_date_str,
-                email if email else "",
-                password if password else ""
-            ])
-        
-        # Автоматическая ширина столбцов
-        from openpyxl.utils import get_column_letter
-        for col_idx, header in enumerate(headers, start=1):
-            max_length = len(str(header))
-            for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-                cell = row[0]
-                if cell.value:
-                    cell_value = str(cell.value)
-                    max_length = max(max_length, len(cell_value))
-            col_letter = get_column_letter(col_idx)
-            ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-        
-        filename = f"activations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(filename)
-        
-        await update.message.reply_document(
-            document=open(filename, 'rb'),
-            filename=filename,
-            reply_markup=reply_markup
-        )
-        
-        os.remove(filename)
+        # Файл формируется в фоне, админ-панель остается доступной
+        await export_service.export_all(context.bot, update.effective_chat.id, reply_markup=reply_markup)
         return ADMIN_PANEL_ACTIVE
     
     elif text == "✅ Отметить как обработанную":
-        activations = get_all_activations()
-        if not activations:
-            await update.message.reply_text("📭 Активаций пока нет.", reply_markup=reply_markup)
-            return ADMIN_PANEL_ACTIVE
-        
-        buttons = []
-        for act in activations[:50]:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            if not service_provided:
-                request_number = f"ST-{act_id:06d}"
-                buttons.append([InlineKeyboardButton(
-                    f"{request_number}: {name} ({phone})",
-                    callback_data=f"mark_{act_id}"
-                )])
-        
-        if not buttons:
-            await update.message.reply_text("✅ Все заявки уже обработаны.", reply_markup=reply_markup)
-            return ADMIN_PANEL_ACTIVE
-        
-        reply_markup_inline = InlineKeyboardMarkup(buttons)
-        await update.message.reply_text(
-            "Выберите заявку для отметки как обработанную:",
-            reply_markup=reply_markup_inline
-        )
+        await send_activation_menu(update.message, CB_MARK_LIST, empty_markup=reply_markup)
         return ADMIN_PANEL_ACTIVE
     
     elif text == "✉️ Привязать Email/Пароль":
-        activations = get_all_activations()
-        if not activations:
-            await update.message.reply_text("📭 Активаций пока нет.", reply_markup=reply_markup)
-            return ADMIN_PANEL_ACTIVE
-        
-        buttons = []
-        for act in activations[:50]:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            request_number = f"ST-{act_id:06d}"
-            buttons.append([InlineKeyboardButton(
-                f"{request_number}: {name} ({phone})" + (" ✉️" if email else ""),
-                callback_data=f"add_cred_{act_id}"
-            )])
-        
-        reply_markup_inline = InlineKeyboardMarkup(buttons)
-        await update.message.reply_text(
-            "Выберите заявку для привязки email и пароля:",
-            reply_markup=reply_markup_inline
-        )
+        await send_activation_menu(update.message, CB_CREDENTIALS_LIST, empty_markup=reply_markup)
         return ADMIN_PANEL_ACTIVE
     
     elif text == "🚪 Выход из админ-панели":
@@ -1354,407 +1080,388 @@ async def admin_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
 
 
-async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+ACTIVATIONS_PAGE_SIZE = 10
+
+
+async def show_activations_page(query, pending, page, direction=None, cursor=None):
+    """Страница списка ожидающих или обработанных заявок.
+    direction: "n" - листаем вперед после курсора, "p" - назад перед курсором.
+    """
+    after = before = None
+    if cursor:
+        if direction == "n":
+            after = cursor
+        else:
+            before = cursor
     
-    user_id = update.effective_user.id
-    if not is_admin(user_id):
-        await query.message.reply_text("❌ У вас нет доступа.")
+    get_page = get_pending_activations_page if pending else get_processed_activations_page
+    activations, has_more = await get_page(after=after, before=before, limit=ACTIVATIONS_PAGE_SIZE)
+    total = await count_activations_by_service(0 if pending else 1)
+    
+    if not activations:
+        if pending:
+            await query.message.reply_text("📭 Ожидающих заявок пока нет.")
+        else:
+            await query.message.reply_text("📭 Обработанных заявок пока нет.")
         return
     
-    if query.data == "admin_stats":
-        stats = get_statistics()
-        text = (
-            f"📊 Статистика\n\n"
-            f"🛒 Всего покупок: {stats['total_purchases']}\n"
-            f"⚙️ Всего активаций: {stats['total_activations']}\n\n"
-            f"⏳ Ожидают оплаты: {stats['pending_activations']}\n"
-            f"💳 Оплата подтверждена: {stats['payment_confirmed']}\n"
-            f"✅ Завершено: {stats['completed_activations']}"
-        )
-        await query.message.reply_text(text)
+    buttons = []
+    for act in activations:
+        buttons.append([InlineKeyboardButton(
+            f"{act.request_number}: {act.name} ({act.phone})",
+            callback_data=admin_router.data(CB_VIEW_ACTIVATION, act.id)
+        )])
+    
+    # Кнопки пагинации несут курсор крайней строки страницы
+    first, last = activations[0], activations[-1]
+    has_next = has_more if before is None else True
+    kind = PAGE_PENDING if pending else PAGE_PROCESSED
+    nav_buttons = page_nav_buttons(
+        CB_ACTIVATIONS_PAGE, (kind,), page,
+        encode_page_cursor(first.sort_key, first.id), encode_page_cursor(last.sort_key, last.id), has_next
+    )
     
-    elif query.data == "admin_purchases":
-        purchases = get_all_purchases()
-        if not purchases:
-            await query.message.reply_text("📭 Покупок пока нет.")
-            return
-        
-        text = "🛒 Все покупки:\n\n"
-        for purchase in purchases[:20]:
-            purchase_id, uid, phone, name, username, created_at = purchase[:6]
-            username_str = f"@{username}" if username else "не указан"
-            text += (
-                f"ID: {purchase_id}\n"
-                f"User ID: {uid}\n"
-                f"Username: {username_str}\n"
-                f"Имя: {name}\n"
-                f"Телефон: {phone}\n"
-                f"Дата: {created_at[:19]}\n"
-                f"{'─' * 30}\n"
-            )
-        
-        if len(purchases) > 20:
-            text += f"\n... и еще {len(purchases) - 20} записей"
-        
-        await query.message.reply_text(text)
+    if nav_buttons:
+        buttons.append(nav_buttons)
     
-    elif query.data == "admin_activations":
-        # Показываем две кнопки: Ожидают и Обработанные
-        keyboard = [
-            [InlineKeyboardButton("⏳ Ожидают", callback_data="admin_activations_pending_page_0")],
-            [InlineKeyboardButton("✅ Обработанные", callback_data="admin_activations_processed_page_0")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text(
-            "⚙️ Выберите категорию активаций:",
-            reply_markup=reply_markup
-        )
+    buttons.append([InlineKeyboardButton("🔙 Назад к категориям", callback_data=admin_router.data(CB_ACTIVATIONS))])
     
-    elif query.data == "admin_export_excel":
-        await query.message.reply_text("📄 Генерирую Excel файл...")
-        activations = get_all_activations()
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Активации"
-        
-        headers = ["Номер заявки", "User ID", "Username", "Номер телефона", "Имя", "Дата заявки", "Услуга",
-                   "SN устройство", "SN коробка", "KIT номер",
-                   "Дата начала активации", "Дата окончания подписки", "Email", "Пароль"]
-        ws.append(headers)
-        
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for act in activations:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            
-            request_number = f"ST-{act_id:06d}"
-            start_date_str = ""
-            end_date_str = ""
-            
-            if service_provided_at:
-                start_date = datetime.fromisoformat(service_provided_at)
-                end_date = start_date + timedelta(days=30)
-                start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-                end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
-            
-            ws.append([
-                request_number,
-                uid,
-                f"@{username}" if username else "",
-                phone,
-                name,
-                created_at[:19],
-                "Активация",
-                serial_num if serial_num else "",
-                box_serial if box_serial else "",
-                kit if kit else "",
-                start_date_str,
-                end_date_str,
-                email if email else "",
-                password if password else ""
-            ])
-        
-        # Автоматическая ширина столбцов
-        from openpyxl.utils import get_column_letter
-        for col_idx, header in enumerate(headers, start=1):
-            max_length = len(str(header))
-            for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=col_idx, max_col=col_idx):
-                cell = row[0]
-                if cell.value:
-                    cell_value = str(cell.value)
-                    max_length = max(max_length, len(cell_value))
-            # Устанавливаем ширину: длина контента + небольшой отступ, но не более 50 символов
-            col_letter = get_column_letter(col_idx)
-            ws.column_dimensions[col_letter].width = min(max_length + 2, 50)
-        
-        filename = f"activations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(filename)
-        
-        await query.message.reply_document(
-            document=open(filename, 'rb'),
-            filename=filename
-        )
-        
-        os.remove(filename)
+    reply_markup = InlineKeyboardMarkup(buttons)
+    start_idx = page * ACTIVATIONS_PAGE_SIZE
+    title = "⏳ Ожидающие заявки" if pending else "✅ Обработанные заявки"
+    text = f"{title} (страница {page + 1})\n\n"
+    text += f"Всего: {total} заявок\n"
+    text += f"Показано: {start_idx + 1}-{min(start_idx + len(activations), total)} из {total}\n\n"
+    text += "Выберите заявку для просмотра деталей:"
     
-    elif query.data == "admin_mark_processed":
-        activations = get_all_activations()
-        if not activations:
-            await query.message.reply_text("📭 Активаций пока нет.")
-            return
-        
-        buttons = []
-        for act in activations[:50]:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            if not service_provided:
-                request_number = f"ST-{act_id:06d}"
-                buttons.append([InlineKeyboardButton(
-                    f"{request_number}: {name} ({phone})",
-                    callback_data=f"mark_{act_id}"
-                )])
-        
-        if not buttons:
-            await query.message.reply_text("✅ Все заявки уже обработаны.")
-            return
-        
-        reply_markup = InlineKeyboardMarkup(buttons)
-        await query.message.reply_text(
-            "Выберите заявку для отметки как обработанную:",
-            reply_markup=reply_markup
-        )
-    
-    elif query.data.startswith("mark_"):
-        activation_id = int(query.data.split("_")[1])
-        if mark_service_provided(activation_id):
-            request_number = f"ST-{activation_id:06d}"
-            await query.message.reply_text(f"✅ Заявка {request_number} отмечена как обработанная.")
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+
+MENU_PAGE_SIZE = 20
+
+# Меню выбора заявки: маршрут меню -> (запрос страницы, маршрут кнопки заявки, заголовок, текст пустого списка, показывать email)
+ACTIVATION_MENUS = {
+    CB_MARK_LIST: (get_pending_activation_list, CB_MARK,
+                   "Выберите заявку для отметки как обработанную:", "✅ Все заявки уже обработаны.", False),
+    CB_CREDENTIALS_LIST: (get_activation_list, CB_ADD_CREDENTIALS,
+                          "Выберите заявку для привязки email и пароля:", "📭 Активаций пока нет.", True),
+}
+
+
+async def send_activation_menu(message, menu, page=0, direction=None, cursor=None, empty_markup=None):
+    """Страница меню выбора заявки (MENU_PAGE_SIZE строк, keyset-пагинация как в show_activations_page)"""
+    get_list, route, title, empty_text, show_email = ACTIVATION_MENUS[menu]
+    after = before = None
+    if cursor:
+        if direction == "n":
+            after = cursor
         else:
-            await query.message.reply_text(f"❌ Ошибка при обработке заявки #{activation_id}.")
+            before = cursor
     
-    elif query.data == "admin_add_credentials":
-        activations = get_all_activations()
-        if not activations:
-            await query.message.reply_text("📭 Активаций пока нет.")
-            return
-        
-        buttons = []
-        for act in activations[:50]:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = act[:18]
-            request_number = f"ST-{act_id:06d}"
-            buttons.append([InlineKeyboardButton(
-                f"{request_number}: {name} ({phone})" + (" ✉️" if email else ""),
-                callback_data=f"add_cred_{act_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(buttons)
-        await query.message.reply_text(
-            "Выберите заявку для привязки email и пароля:",
-            reply_markup=reply_markup
-        )
+    items, has_more = await get_list(after=after, before=before, limit=MENU_PAGE_SIZE)
+    if not items:
+        await message.reply_text(empty_text, reply_markup=empty_markup)
+        return
     
-    elif query.data.startswith("add_cred_"):
-        activation_id = int(query.data.split("_")[2])
-        context.user_data['cred_activation_id'] = activation_id
-        context.user_data['admin_cred_state'] = WAITING_ADMIN_EMAIL
-        activation = get_activation_by_id(activation_id)
-        if activation:
-            act_id, uid, phone, name, username, created_at, payment, receipt, serial_num, serial_photo, box_serial, box_photo, kit, status, service_provided, service_provided_at, email, password = activation[:18]
-            request_number = f"ST-{act_id:06d}"
-            current_info = f"\nТекущий email: {email if email else 'не указан'}\nТекущий пароль: {'*' * len(password) if password else 'не указан'}" if email or password else ""
-            await query.message.reply_text(
-                f"📝 Введите email для заявки {request_number} ({name}):{current_info}\n\n"
-                f"Или отправьте /cancel для отмены."
-            )
+    buttons = activation_list_buttons(items, route, show_email)
+    first, last = items[0], items[-1]
+    nav_buttons = page_nav_buttons(
+        menu, (), page,
+        encode_page_cursor(first.created_at, first.id), encode_page_cursor(last.created_at, last.id),
+        has_more if before is None else True
+    )
+    if nav_buttons:
+        buttons.append(nav_buttons)
     
-    elif query.data.startswith("admin_activations_pending_page_"):
-        # Показываем список ожидающих заявок с пагинацией
-        page = int(query.data.split("_")[-1])
-        activations = get_pending_activations()
-        
-        if not activations:
-            await query.message.reply_text("📭 Ожидающих заявок пока нет.")
-            return
-        
-        buttons = []
-        start_idx = page * 10
-        end_idx = start_idx + 10
-        
-        for act in activations[start_idx:end_idx]:
-            act_id, uid, phone, name = act[0], act[1], act[2], act[3]
-            request_number = f"ST-{act_id:06d}"
-            buttons.append([InlineKeyboardButton(
-                f"{request_number}: {name} ({phone})",
-                callback_data=f"view_activation_{act_id}"
-            )])
-        
-        # Кнопки пагинации
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"admin_activations_pending_page_{page-1}"))
-        if end_idx < len(activations):
-            nav_buttons.append(InlineKeyboardButton("▶️ Вперед", callback_data=f"admin_activations_pending_page_{page+1}"))
-        
-        if nav_buttons:
-            buttons.append(nav_buttons)
-        
-        buttons.append([InlineKeyboardButton("🔙 Назад к категориям", callback_data="admin_activations")])
-        
-        reply_markup = InlineKeyboardMarkup(buttons)
-        total = len(activations)
-        text = f"⏳ Ожидающие заявки (страница {page + 1})\n\n"
-        text += f"Всего: {total} заявок\n"
-        text += f"Показано: {start_idx + 1}-{min(end_idx, total)} из {total}\n\n"
-        text += "Выберите заявку для просмотра деталей:"
-        
-        await query.message.reply_text(text, reply_markup=reply_markup)
+    text = title if page == 0 and not nav_buttons else f"{title} (страница {page + 1})"
+    await message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+
+
+async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
     
-    elif query.data.startswith("admin_activations_processed_page_"):
-        # Показываем список обработанных заявок с пагинацией
-        page = int(query.data.split("_")[-1])
-        activations = get_processed_activations()
-        
-        if not activations:
-            await query.message.reply_text("📭 Обработанных заявок пока нет.")
-            return
-        
-        buttons = []
-        start_idx = page * 10
-        end_idx = start_idx + 10
-        
-        for act in activations[start_idx:end_idx]:
-            act_id, uid, phone, name = act[0], act[1], act[2], act[3]
-            request_number = f"ST-{act_id:06d}"
-            buttons.append([InlineKeyboardButton(
-                f"{request_number}: {name} ({phone})",
-                callback_data=f"view_activation_{act_id}"
-            )])
-        
-        # Кнопки пагинации
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"admin_activations_processed_page_{page-1}"))
-        if end_idx < len(activations):
-            nav_buttons.append(InlineKeyboardButton("▶️ Вперед", callback_data=f"admin_activations_processed_page_{page+1}"))
-        
-        if nav_buttons:
-            buttons.append(nav_buttons)
-        
-        buttons.append([InlineKeyboardButton("🔙 Назад к категориям", callback_data="admin_activations")])
-        
-        reply_markup = InlineKeyboardMarkup(buttons)
-        total = len(activations)
-        text = f"✅ Обработанные заявки (страница {page + 1})\n\n"
-        text += f"Всего: {total} заявок\n"
-        text += f"Показано: {start_idx + 1}-{min(end_idx, total)} из {total}\n\n"
-        text += "Выберите заявку для просмотра деталей:"
-        
-        await query.message.reply_text(text, reply_markup=reply_markup)
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await query.message.reply_text("❌ У вас нет доступа.")
+        return
     
-    elif query.data.startswith("view_activation_"):
-        # Показываем детальную информацию о заявке
-        activation_id = int(query.data.split("_")[2])
-        activation = get_activation_by_id(activation_id)
-        
-        if not activation:
-            await query.message.reply_text("❌ Заявка не найдена.")
-            return
-        
-        # Сохраняем откуда пришли для кнопки "Назад" (если не установлено)
-        if 'admin_view_back_to' not in context.user_data:
-            context.user_data['admin_view_back_to'] = "admin_activations"
-        await show_activation_details(update, context, activation)
-    
-    elif query.data.startswith("edit_cred_"):
-        # Это теперь обрабатывается через entry point ConversationHandler
-        pass
-    
-    elif query.data.startswith("toggle_status_"):
-        activation_id = int(query.data.split("_")[2])
-        if toggle_service_provided(activation_id):
-            # Обновляем вид заявки
-            activation = get_activation_by_id(activation_id)
-            if activation:
-                status_text = "отмечена как обработанная" if activation[14] else "отметка снята"
-                request_number = f"ST-{activation[0]:06d}"
-                await query.message.reply_text(f"✅ Заявка {request_number} {status_text}.")
-                # Показываем обновленную заявку
-                context.user_data['admin_view_back_to'] = context.user_data.get('admin_view_back_to', 'admin_activations')
-                await show_activation_details(update, context, activation)
-        else:
-            await query.message.reply_text(f"❌ Ошибка при изменении статуса заявки.")
+    await admin_router.dispatch(update, context)
+
+
+@admin_router.route(CB_STATS)
+async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = format_dashboard(await get_dashboard())
+    await update.callback_query.message.reply_text(text)
+
+
+PURCHASES_PAGE_SIZE = 20
+
+
+async def recent_purchases_text():
+    """Последние PURCHASES_PAGE_SIZE покупок одним сообщением или None, если покупок нет"""
+    purchases, has_more = await get_purchases_page(limit=PURCHASES_PAGE_SIZE)
+    if not purchases:
+        return None
     
-    elif query.data.startswith("delete_confirm_"):
-        activation_id = int(query.data.split("_")[2])
-        activation = get_activation_by_id(activation_id)
-        if activation:
-            act_id = activation[0]
-            request_number = f"ST-{act_id:06d}"
-            keyboard = [
-                [InlineKeyboardButton("✅ Да, удалить", callback_data=f"delete_yes_{act_id}")],
-                [InlineKeyboardButton("❌ Отмена", callback_data=f"view_activation_{act_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                f"⚠️ Вы уверены, что хотите удалить заявку {request_number}?\n\n"
-                f"Это действие нельзя отменить!",
-                reply_markup=reply_markup
-            )
+    text = "🛒 Все покупки:\n\n"
+    for purchase in purchases:
+        username_str = f"@{purchase.username}" if purchase.username else "не указан"
+        text += (
+            f"ID: {purchase.id}\n"
+            f"User ID: {purchase.user_id}\n"
+            f"Username: {username_str}\n"
+            f"Имя: {purchase.name}\n"
+            f"Телефон: {purchase.phone}\n"
+            f"Дата: {purchase.created_at[:19]}\n"
+            f"{'─' * 30}\n"
+        )
     
-    elif query.data.startswith("delete_yes_"):
-        activation_id = int(query.data.split("_")[2])
+    if has_more:
+        text += f"\n... и еще {await count_purchases() - len(purchases)} записей"
+    return text
+
+
+@admin_router.route(CB_PURCHASES)
+async def admin_purchases_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = await recent_purchases_text()
+    await update.callback_query.message.reply_text(text or "📭 Покупок пока нет.")
+
+
+@admin_router.route(CB_ACTIVATIONS)
+async def admin_activations_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Показываем две кнопки: Ожидают и Обработанные
+    await update.callback_query.message.reply_text(
+        "⚙️ Выберите категорию активаций:",
+        reply_markup=activation_categories_markup()
+    )
+
+
+@admin_router.route(CB_EXPORT_EXCEL)
+async def admin_export_excel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await export_service.export_all(context.bot, update.callback_query.message.chat_id)
+
+
+@admin_router.route(CB_MARK_LIST, int, str, str)
+async def admin_mark_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, page, direction, cursor):
+    await send_activation_menu(update.callback_query.message, CB_MARK_LIST, page or 0, direction, cursor)
+
+
+@admin_router.route(CB_MARK, int)
+async def admin_mark_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    query = update.callback_query
+    if await mark_service_provided(activation_id):
+        invalidate_dashboard()
+        await reminder_scheduler.reschedule(activation_id)
         request_number = f"ST-{activation_id:06d}"
-        if delete_activation(activation_id):
-            await query.message.reply_text(f"✅ Заявка {request_number} успешно удалена.")
-        else:
-            await query.message.reply_text(f"❌ Ошибка при удалении заявки {request_number}.")
+        await query.message.reply_text(f"✅ Заявка {request_number} отмечена как обработанная.")
+    else:
+        await query.message.reply_text(f"❌ Ошибка при обработке заявки #{activation_id}.")
+
+
+@admin_router.route(CB_CREDENTIALS_LIST, int, str, str)
+async def admin_credentials_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, page, direction, cursor):
+    await send_activation_menu(update.callback_query.message, CB_CREDENTIALS_LIST, page or 0, direction, cursor)
+
+
+@admin_router.route(CB_ADD_CREDENTIALS, int)
+async def admin_add_credentials_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    query = update.callback_query
+    context.user_data['cred_activation_id'] = activation_id
+    context.user_data['admin_cred_state'] = WAITING_ADMIN_EMAIL
+    activation = await get_activation_by_id(activation_id)
+    if activation:
+        await query.message.reply_text(
+            f"📝 Введите email для заявки {activation.request_number} ({activation.name}):{credentials_info(activation)}\n\n"
+            f"Или отправьте /cancel для отмены."
+        )
+
+
+@admin_router.route(CB_ACTIVATIONS_PAGE, str, int, str, str)
+async def admin_activations_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, kind, page, direction, cursor):
+    # Показываем список заявок с пагинацией по курсору
+    await show_activations_page(update.callback_query, kind == PAGE_PENDING, page, direction, cursor)
+
+
+@admin_router.route(CB_VIEW_ACTIVATION, int)
+async def admin_view_activation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    # Показываем детальную информацию о заявке
+    activation = await get_activation_by_id(activation_id)
     
-    elif query.data.startswith("delete_purchase_"):
-        purchase_id = int(query.data.split("_")[2])
-        request_number = f"BUY-{purchase_id:06d}"
-        if delete_purchase(purchase_id):
-            await query.message.reply_text(f"✅ Заявка {request_number} успешно удалена.")
-        else:
-            await query.message.reply_text(f"❌ Ошибка при удалении заявки {request_number}.")
+    if not activation:
+        await update.callback_query.message.reply_text("❌ Заявка не найдена.")
+        return
     
-    elif query.data == "admin_exit":
-        welcome_text = (
-            "👋 Вы вышли из админ-панели.\n\n"
-            "Приветствуем! Вас приветствует команда RICH - сильнейшая команда на рынке, "
-            "специализирующаяся на подключении, обслуживании и полном сопровождении оборудования Starlink.\n\n"
-            "Мы занимаемся:\n\n"
-            "• Продажей и поставками Starlink и другого оборудования, необходимого для стабильной связи в сложных условиях СВО\n\n"
-            "• Профессиональной активацией и ведением аккаунтов Starlink\n\n"
-            "• Настройкой, прошивкой и привязкой оборудования\n\n"
-            "• Технической поддержкой 24/7\n\n"
-            "• Мониторингом и сохранением работоспособности оборудования\n\n"
-            "• Решением вопросов блокировок, отключений и восстановлением доступа\n\n"
-            "С января 2024 команда RICH не имеет ни одного случая необратимой блокировки - "
-            "все вопросы решаются в рабочем порядке.\n\n"
-            "Каждый день на связи опытные специалисты, готовые реагировать мгновенно.\n\n"
-            "Выберите нужное действие:"
-        )
-        
+    # Сохраняем откуда пришли для кнопки "Назад" (если не установлено)
+    if 'admin_view_back_to' not in context.user_data:
+        context.user_data['admin_view_back_to'] = BACK_TO_ACTIVATIONS
+    await show_activation_details(update, context, activation)
+
+
+@admin_router.route(CB_VIEW_PURCHASE, int)
+async def admin_view_purchase_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, purchase_id):
+    purchase = await find_purchase_by_request_number(str(purchase_id))
+    if not purchase:
+        await update.callback_query.message.reply_text("❌ Заявка не найдена.")
+        return
+    await show_purchase_details(update.callback_query.message, purchase)
+
+
+@admin_router.route(CB_SEARCH_PAGE, int)
+async def admin_search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, page):
+    if not await send_search_results(update.callback_query.message, context, page):
+        await update.callback_query.message.reply_text("❌ Результаты поиска устарели, выполните поиск заново.")
+
+
+@admin_router.route(CB_ACTIVATION_XLSX, int)
+async def admin_activation_xlsx_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    # Excel файл заявки по запросу: повторно отправляется по file_id, пока данные не изменятся
+    await export_service.export_activation(context.bot, update.callback_query.message.chat_id, activation_id)
+
+
+@admin_router.route(CB_TOGGLE_STATUS, int)
+async def admin_toggle_status_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    query = update.callback_query
+    if await toggle_service_provided(activation_id):
+        invalidate_dashboard()
+        await reminder_scheduler.reschedule(activation_id)
+        # Обновляем вид заявки
+        activation = await get_activation_by_id(activation_id)
+        if activation:
+            status_text = "отмечена как обработанная" if activation.service_provided else "отметка снята"
+            await query.message.reply_text(f"✅ Заявка {activation.request_number} {status_text}.")
+            # Показываем обновленную заявку
+            context.user_data['admin_view_back_to'] = context.user_data.get('admin_view_back_to', BACK_TO_ACTIVATIONS)
+            await show_activation_details(update, context, activation)
+    else:
+        await query.message.reply_text(f"❌ Ошибка при изменении статуса заявки.")
+
+
+@admin_router.route(CB_DELETE_CONFIRM, int)
+async def admin_delete_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    activation = await get_activation_by_id(activation_id)
+    if activation:
+        act_id = activation.id
         keyboard = [
-            [InlineKeyboardButton("🛒 Купить терминал", callback_data="buy")],
-            [InlineKeyboardButton("⚙️ Активировать", callback_data="activate")]
+            [InlineKeyboardButton("✅ Да, удалить", callback_data=admin_router.data(CB_DELETE_YES, act_id))],
+            [InlineKeyboardButton("❌ Отмена", callback_data=admin_router.data(CB_VIEW_ACTIVATION, act_id))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.message.reply_text(welcome_text, reply_markup=reply_markup)
-        return
+        await update.callback_query.message.reply_text(
+            f"⚠️ Вы уверены, что хотите удалить заявку {activation.request_number}?\n\n"
+            f"Это действие нельзя отменить!",
+            reply_markup=reply_markup
+        )
 
 
-def main():
-    import sys
-    sys.stdout.write("MAIN: Функция main() вызвана\n")
-    sys.stdout.flush()
-    sys.stderr.write("MAIN: Функция main() вызвана (stderr)\n")
-    sys.stderr.flush()
+@admin_router.route(CB_DELETE_YES, int)
+async def admin_delete_yes_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, activation_id):
+    request_number = f"ST-{activation_id:06d}"
+    if await delete_activation(activation_id):
+        invalidate_dashboard()
+        await update.callback_query.message.reply_text(f"✅ Заявка {request_number} успешно удалена.")
+    else:
+        await update.callback_query.message.reply_text(f"❌ Ошибка при удалении заявки {request_number}.")
+
+
+@admin_router.route(CB_DELETE_PURCHASE, int)
+async def admin_delete_purchase_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, purchase_id):
+    request_number = f"BUY-{purchase_id:06d}"
+    if await delete_purchase(purchase_id):
+        invalidate_dashboard()
+        await update.callback_query.message.reply_text(f"✅ Заявка {request_number} успешно удалена.")
+    else:
+        await update.callback_query.message.reply_text(f"❌ Ошибка при удалении заявки {request_number}.")
+
+
+@admin_router.route(CB_EXIT)
+async def admin_exit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    welcome_text = (
+        "👋 Вы вышли из админ-панели.\n\n"
+        "Приветствуем! Вас приветствует команда RICH - сильнейшая команда на рынке, "
+        "специализирующаяся на подключении, обслуживании и полном сопровождении оборудования Starlink.\n\n"
+        "Мы занимаемся:\n\n"
+        "• Продажей и поставками Starlink и другого оборудования, необходимого для стабильной связи в сложных условиях СВО\n\n"
+        "• Профессиональной активацией и ведением аккаунтов Starlink\n\n"
+        "• Настройкой, прошивкой и привязкой оборудования\n\n"
+        "• Технической поддержкой 24/7\n\n"
+        "• Мониторингом и сохранением работоспособности оборудования\n\n"
+        "• Решением вопросов блокировок, отключений и восстановлением доступа\n\n"
+        "С января 2024 команда RICH не имеет ни одного случая необратимой блокировки - "
+        "все вопросы решаются в рабочем порядке.\n\n"
+        "Каждый день на связи опытные специалисты, готовые реагировать мгновенно.\n\n"
+        "Выберите нужное действие:"
+    )
     
-    print("Инициализация базы данных...")
-    try:
-        init_database()
-        print("База данных инициализирована")
-    except Exception as e:
-        print(f"Ошибка при инициализации базы данных: {e}")
-        import traceback
-        traceback.print_exc()
-        raise
+    keyboard = [
+        [InlineKeyboardButton("🛒 Купить терминал", callback_data="buy")],
+        [InlineKeyboardButton("⚙️ Активировать", callback_data="activate")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
     
-    print("Создание Application...")
-    try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        print("Application создан")
-    except Exception as e:
-        print(f"Ошибка при создании Application: {e}")
-        import traceback
-        traceback.print_exc()
-        raise
+    await update.callback_query.message.reply_text(welcome_text, reply_markup=reply_markup)
+
+
+# Кнопки, отправленные до перехода на маршрутизатор (остаются в истории чатов)
+admin_router.legacy(r"admin_stats", CB_STATS)
+admin_router.legacy(r"admin_purchases", CB_PURCHASES)
+admin_router.legacy(r"admin_activations", CB_ACTIVATIONS)
+admin_router.legacy(r"admin_export_excel", CB_EXPORT_EXCEL)
+admin_router.legacy(r"admin_mark_processed", CB_MARK_LIST)
+admin_router.legacy(r"mark_(\d+)", CB_MARK)
+admin_router.legacy(r"admin_add_credentials", CB_CREDENTIALS_LIST)
+admin_router.legacy(r"add_cred_(\d+)", CB_ADD_CREDENTIALS)
+admin_router.legacy(r"admin_activations_pending_page_\d+", CB_ACTIVATIONS_PAGE, PAGE_PENDING, 0)
+admin_router.legacy(r"admin_activations_processed_page_\d+", CB_ACTIVATIONS_PAGE, PAGE_PROCESSED, 0)
+admin_router.legacy(r"view_activation_(\d+)", CB_VIEW_ACTIVATION)
+admin_router.legacy(r"toggle_status_(\d+)", CB_TOGGLE_STATUS)
+admin_router.legacy(r"delete_confirm_(\d+)", CB_DELETE_CONFIRM)
+admin_router.legacy(r"delete_yes_(\d+)", CB_DELETE_YES)
+admin_router.legacy(r"delete_purchase_(\d+)", CB_DELETE_PURCHASE)
+admin_router.legacy(r"admin_exit", CB_EXIT)
+
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/metrics - задержки обработчиков и запросов к БД (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    await update.message.reply_text(metrics.format_summary())
+
+
+async def post_init(application):
+    # Фоновая доставка уведомлений из outbox
+    outbox.start(application.bot)
+    # Пул процессов экспорта запускается заранее, а не при первой выгрузке
+    await export_service.start()
+    if not WEBHOOK_URL:
+        # В режиме webhook метрики отдает сервер webhook
+        await metrics.start_server()
+
+
+async def post_shutdown(application):
+    await outbox.stop()
+    await metrics.stop_server()
+    # Останавливаем процессы экспорта, чтобы они не пережили бота
+    await export_service.stop()
+
+
+def build_application(token=BOT_TOKEN, request=None):
+    """Application со всеми обработчиками, без запуска.
+    request - транспорт Bot API (telegram.request.BaseRequest), по умолчанию HTTPX;
+    loadtest.py передает сюда транспорт без сети.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .persistence(SQLitePersistence())
+        # Разные пользователи обрабатываются параллельно, обновления одного - по очереди
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
     
     async def end_purchase_and_start_activate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Завершает процесс покупки и начинает процесс активации"""
@@ -1781,6 +1488,8 @@ def main():
             CommandHandler("start", start_fallback)
         ],
         allow_reentry=True,
+        name="purchase",
+        persistent=True,
     )
     
     async def end_activate_and_start_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1826,12 +1535,14 @@ def main():
             CommandHandler("start", start_fallback)
         ],
         allow_reentry=True,
+        name="activation",
+        persistent=True,
     )
     
     admin_password_handler_conv = ConversationHandler(
         entry_points=[
             CommandHandler("admin", admin_command),
-            CallbackQueryHandler(admin_search_callback_entry, pattern="^admin_search$"),
+            CallbackQueryHandler(admin_search_callback_entry, pattern="^admin_search(_back)?$"),
             CallbackQueryHandler(admin_edit_callback_entry, pattern="^edit_cred_")
         ],
         states={
@@ -1858,85 +1569,79 @@ def main():
         allow_reentry=True,
     )
     
-    async def check_subscriptions(context: ContextTypes.DEFAULT_TYPE):
-        activations = get_activations_for_subscription_reminders()
-        now = datetime.now()
-        
-        for act in activations:
-            act_id, user_id, phone, name, service_provided_at, last_reminder_day = act
-            
-            if not service_provided_at:
-                continue
-            
-            try:
-                start_date = datetime.fromisoformat(service_provided_at)
-                end_date = start_date + timedelta(days=30)
-                days_left = (end_date - now).days
-                
-                if 1 <= days_left <= 5:
-                    if last_reminder_day != days_left:
-                        reminder_text = (
-                            f"⏰ Напоминание о подписке\n\n"
-                            f"Ваша подписка Starlink заканчивается через {days_left} день(дня/дней).\n"
-                            f"Дата окончания: {end_date.strftime('%d.%m.%Y')}\n\n"
-                            f"Пожалуйста, продлите подписку."
-                        )
-                        try:
-                            await context.bot.send_message(chat_id=user_id, text=reminder_text)
-                            update_last_reminder_day(act_id, days_left)
-                        except Exception as e:
-                            print(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
-            except Exception as e:
-                print(f"Ошибка обработки активации {act_id}: {e}")
+    job_queue = application.job_queue
+    if job_queue:
+        # Напоминания о подписке: задача будится к сроку ближайшего напоминания
+        reminder_scheduler.start(job_queue)
+    
+    # Группа -1 для команд (высший приоритет)
+    application.add_handler(CommandHandler("start", start), group=-1)
+    application.add_handler(CommandHandler("metrics", metrics_command), group=-1)
+    
+    # Группа 0 для остальных обработчиков
+    application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
+    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
+    application.add_handler(CallbackQueryHandler(admin_callback, pattern=admin_router.pattern()))
+    application.add_handler(admin_password_handler_conv)
+    application.add_handler(purchase_handler)
+    application.add_handler(activation_handler)
+    
+    # Задержки, вызовы и ошибки каждого обработчика (/metrics и METRICS_PATH)
+    state_names = {value: name for name, value in globals().items()
+                   if name.startswith('WAITING_') or name == 'ADMIN_PANEL_ACTIVE'}
+    metrics.instrument_handlers(application, state_names)
+    metrics.instrument_router(admin_router, 'admin_callback')
+    metrics.registry.register_gauges('bot_update_processor', update_processor.metrics)
+    metrics.registry.register_gauges('bot_db_executor', get_db_executor_metrics)
+    metrics.registry.register_gauges('bot_logging', logging_setup.stats)
+    
+    # Поля handler, state, user_id и номер заявки в записях логов каждого обработчика
+    metrics.wrap_handlers(
+        application,
+        lambda callback, state: logging_setup.with_log_context(callback.__name__, state)(callback),
+        state_names,
+    )
+    admin_router.wrap_handlers(
+        lambda prefix, handler: logging_setup.with_log_context(handler.__name__, 'admin_callback')(handler)
+    )
+    logger.info("Обработчики зарегистрированы")
+    return application
+
+
+def main():
+    logging_setup.setup_logging()
+    logger.info("Запуск бота")
     
     try:
-        print("Настройка job_queue...")
-        job_queue = application.job_queue
-        if job_queue:
-            job_queue.run_repeating(check_subscriptions, interval=3600, first=10)
-        print("job_queue настроен")
-        
-        print("Регистрация обработчиков...")
-        # Группа -1 для команд (высший приоритет)
-        application.add_handler(CommandHandler("start", start), group=-1)
-        print("Обработчик /start зарегистрирован")
-        
-        # Группа 0 для остальных обработчиков
-        application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
-        application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
-        application.add_handler(CallbackQueryHandler(admin_callback, pattern="^(admin_(?!search)|mark_|add_cred_|view_activation_|toggle_status_|delete_confirm_|delete_yes_|delete_purchase_|admin_search_back)"))
-        application.add_handler(admin_password_handler_conv)
-        application.add_handler(purchase_handler)
-        application.add_handler(activation_handler)
-        print("Все обработчики зарегистрированы")
-        
-        print("Бот запущен...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
-    except Exception as e:
-        print(f"Ошибка при настройке обработчиков: {e}")
-        import traceback
-        traceback.print_exc()
+        init_database()
+    except Exception:
+        logger.exception("Ошибка при инициализации базы данных")
         raise
-
-
-if __name__ == "__main__":
-    import sys
-    sys.stdout.write("START: Скрипт запущен\n")
-    sys.stdout.flush()
-    sys.stderr.write("START: Скрипт запущен (stderr)\n")
-    sys.stderr.flush()
+    logger.info("База данных инициализирована")
     
-    print("START: __name__ == '__main__'")
+    try:
+        application = build_application()
+    except Exception:
+        logger.exception("Ошибка при создании Application")
+        raise
     
     try:
-        main()
-    except Exception as e:
-        error_msg = f"КРИТИЧЕСКАЯ ОШИБКА при запуске бота: {e}"
-        print(error_msg)
-        sys.stderr.write(error_msg + "\n")
-        sys.stderr.flush()
-        import traceback
-        traceback.print_exc()
-        traceback.print_exc(file=sys.stderr)
+        if WEBHOOK_URL:
+            logger.info("Бот запущен (webhook)")
+            asyncio.run(serve_webhook(
+                application, ALLOWED_UPDATES,
+                routes=[('GET', METRICS_PATH, metrics.prometheus_handler)]
+            ))
+        else:
+            logger.info("Бот запущен (polling)")
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    except Exception:
+        logger.exception("Ошибка при работе бота")
         raise
+    finally:
+        # Дописываем записи, оставшиеся в очереди логов
+        logging_setup.stop_logging()
 
+
+if __name__ == "__main__":
+    main()
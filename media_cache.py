@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from telegram.error import TelegramError
+
+from database_async import get_cached_file_id, save_cached_file_id
+
+
+logger = logging.getLogger(__name__)
+
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+
+class MediaAsset:
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.file_id = None
+
+
+class MediaCache:
+    """Картинки-примеры загружаются в Telegram один раз, дальше отправляются по file_id.
+
+    file_id хранится в telegram_file_cache вместе с хэшем содержимого файла:
+    если картинку заменили, хэш не совпадет и она будет загружена заново.
+    Файл читается с диска только при первом обращении и при загрузке.
+    """
+
+    def __init__(self, images_dir=IMAGES_DIR):
+        self.images_dir = images_dir
+        self._assets = {}
+
+    def _load_asset(self, name):
+        for ext in IMAGE_EXTENSIONS:
+            path = os.path.join(self.images_dir, name + ext)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    version = hashlib.sha256(f.read()).hexdigest()
+                return MediaAsset(path, version)
+        return None
+
+    async def _get_asset(self, name):
+        if name not in self._assets:
+            asset = await asyncio.to_thread(self._load_asset, name)
+            if asset:
+                asset.file_id = await get_cached_file_id(f'media:{name}', asset.version)
+            self._assets[name] = asset
+        return self._assets[name]
+
+    async def reply_photo(self, message, name, caption=None):
+        """Отправляет картинку images/<name>.jpg|png ответом на message.
+        Возвращает False, если картинки нет или отправить ее не удалось.
+        """
+        asset = await self._get_asset(name)
+        if asset is None:
+            return False
+
+        if asset.file_id:
+            try:
+                await message.reply_photo(photo=asset.file_id, caption=caption)
+                return True
+            except TelegramError as e:
+                logger.warning("Не удалось отправить %s по file_id, загружаю заново: %s", name, e)
+                asset.file_id = None
+
+        try:
+            with open(asset.path, 'rb') as f:
+                content = await asyncio.to_thread(f.read)
+            sent = await message.reply_photo(photo=content, caption=caption)
+        except Exception as e:
+            logger.warning("Ошибка отправки фото %s: %s", asset.path, e)
+            return False
+
+        if sent.photo:
+            # Самый большой размер - тот, что загружали
+            asset.file_id = sent.photo[-1].file_id
+            await save_cached_file_id(f'media:{name}', asset.version, asset.file_id)
+        return True
+
+
+media_cache = MediaCache()
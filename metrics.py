@@ -0,0 +1,296 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from config import METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT, METRICS_PATH
+from http_server import HTTPServer, Response
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (в секундах)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HANDLER_METRIC = 'bot_handler_duration_seconds'
+DB_METRIC = 'bot_db_query_duration_seconds'
+
+# Метрика -> (описание, имя счетчика ошибок)
+FAMILIES = {
+    HANDLER_METRIC: ('Время обработки обновления обработчиком', 'bot_handler_errors_total'),
+    DB_METRIC: ('Время выполнения функции database.py', 'bot_db_query_errors_total'),
+}
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами.
+    Запись - bisect и несколько сложений под блокировкой (функции database.py
+    выполняются в потоках пула БД).
+    """
+    __slots__ = ('counts', 'sum', 'errors', '_lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            if error:
+                self.errors += 1
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейно внутри корзины, как histogram_quantile в Prometheus)"""
+        total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[index - 1] if index else 0.0
+                return lower + (BUCKETS[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def histogram(self, metric, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def histograms(self, metric=None):
+        """[(метрика, ((метка, значение), ...), Histogram)]"""
+        return [
+            (name, labels, histogram)
+            for (name, labels), histogram in list(self._histograms.items())
+            if metric is None or name == metric
+        ]
+
+    def register_gauges(self, prefix, provider):
+        """provider() -> {имя: число}; экспортируются как prefix_<имя>"""
+        self._gauges.append((prefix, provider))
+
+    def gauges(self):
+        return [(prefix, provider()) for prefix, provider in self._gauges]
+
+
+registry = Registry()
+
+
+def instrument(metric, **labels):
+    """Декоратор: время выполнения, число вызовов и ошибок функции в гистограмме metric{labels}.
+    Поддерживает обычные функции, корутины и генераторы (время - до конца итерации).
+    При METRICS_ENABLED = False функция возвращается без обертки.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        histogram = registry.histogram(metric, **labels)
+        perf_counter = time.perf_counter
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    histogram.observe(perf_counter() - started, error=True)
+                    raise
+                histogram.observe(perf_counter() - started)
+                return result
+        elif inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                error = False
+                try:
+                    yield from func(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    histogram.observe(perf_counter() - started, error=error)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    histogram.observe(perf_counter() - started, error=True)
+                    raise
+                histogram.observe(perf_counter() - started)
+                return result
+        return wrapper
+    return decorator
+
+
+def instrument_module(namespace, metric, label):
+    """Оборачивает все публичные функции модуля (вызывается в конце модуля с globals())"""
+    for name, obj in list(namespace.items()):
+        if inspect.isfunction(obj) and obj.__module__ == namespace['__name__'] and not name.startswith('_'):
+            namespace[name] = instrument(metric, **{label: name})(obj)
+
+
+def wrap_handlers(application, wrapper, state_names=None):
+    """Заменяет callback каждого обработчика приложения на wrapper(callback, state),
+    включая точки входа, состояния и fallbacks ConversationHandler.
+    state - "<диалог>:<состояние>" (state_names - имена числовых состояний), вне диалогов пусто.
+    """
+    from telegram.ext import ConversationHandler
+
+    state_names = state_names or {}
+
+    def wrap(handler, state):
+        if isinstance(handler, ConversationHandler):
+            name = handler.name or 'conversation'
+            for child in handler.entry_points:
+                wrap(child, f'{name}:entry')
+            for key, children in handler.states.items():
+                for child in children:
+                    wrap(child, f'{name}:{state_names.get(key, key)}')
+            for child in handler.fallbacks:
+                wrap(child, f'{name}:fallback')
+            return
+        handler.callback = wrapper(handler.callback, state)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler, '')
+
+
+def instrument_handlers(application, state_names=None):
+    """Метрики для всех обработчиков приложения. Метки: handler - имя функции, state - см. wrap_handlers"""
+    wrap_handlers(
+        application,
+        lambda callback, state: instrument(HANDLER_METRIC, handler=callback.__name__, state=state)(callback),
+        state_names,
+    )
+
+
+def instrument_router(router, state):
+    """Оборачивает обработчики маршрутов CallbackRouter (метка state - общий вход, например admin_callback)"""
+    router.wrap_handlers(
+        lambda prefix, handler: instrument(HANDLER_METRIC, handler=handler.__name__, state=state)(handler)
+    )
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs, extra=()):
+    pairs = [*pairs, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric, (help_text, errors_metric) in FAMILIES.items():
+        histograms = registry.histograms(metric)
+        if not histograms:
+            continue
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for _, labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, '+Inf'), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels(labels, (("le", bound),))} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {histogram.sum:.6f}')
+            lines.append(f'{metric}_count{_labels(labels)} {cumulative}')
+        lines.append(f'# TYPE {errors_metric} counter')
+        for _, labels, histogram in histograms:
+            lines.append(f'{errors_metric}{_labels(labels)} {histogram.errors}')
+
+    for prefix, values in registry.gauges():
+        for name, value in values.items():
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name} {float(value):g}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_summary(limit=10):
+    """Текст для админа: самые нагруженные обработчики и запросы (по суммарному времени)"""
+    if not METRICS_ENABLED:
+        return "📈 Метрики отключены (METRICS_ENABLED = False)."
+
+    text = "📈 Метрики с момента запуска\n"
+    for title, metric in (("Обработчики", HANDLER_METRIC), ("Запросы к БД", DB_METRIC)):
+        histograms = sorted(registry.histograms(metric), key=lambda item: item[2].sum, reverse=True)
+        histograms = [item for item in histograms if item[2].count][:limit]
+        text += f"\n{title} (p50 / p95 / p99, мс):\n"
+        if not histograms:
+            text += "нет данных\n"
+        for _, labels, histogram in histograms:
+            labels = dict(labels)
+            name = labels.get('handler') or labels.get('query')
+            if labels.get('state'):
+                name += f" [{labels['state']}]"
+            text += (
+                f"{name}: {histogram.count} выз., ошибок {histogram.errors} - "
+                f"{histogram.quantile(0.5) * 1000:.1f} / {histogram.quantile(0.95) * 1000:.1f} / "
+                f"{histogram.quantile(0.99) * 1000:.1f}\n"
+            )
+
+    for prefix, values in registry.gauges():
+        text += f"\n{prefix}:\n"
+        text += ", ".join(
+            f"{name} {value:.4f}" if isinstance(value, float) else f"{name} {value}"
+            for name, value in values.items()
+        ) + "\n"
+    return text
+
+
+async def prometheus_handler(request):
+    """Обработчик HTTPServer для METRICS_PATH"""
+    return Response(200, render_prometheus(), PROMETHEUS_CONTENT_TYPE)
+
+
+_server = None
+
+
+async def start_server(host=METRICS_LISTEN, port=METRICS_PORT):
+    """Отдельный HTTP сервер метрик (режим polling; в режиме webhook маршрут на сервере webhook)"""
+    global _server
+    if not METRICS_ENABLED or not port or _server is not None:
+        return
+    _server = HTTPServer(host, port)
+    _server.route('GET', METRICS_PATH, prometheus_handler)
+    await _server.start()
+    logger.info("Метрики Prometheus: http://%s:%s%s", host, port, METRICS_PATH)
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
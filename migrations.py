@@ -0,0 +1,463 @@
+import logging
+import time
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+# Добавленные со временем колонки: (таблица, колонка, определение)
+LEGACY_COLUMNS = [
+    ('activations', 'serial_number', 'TEXT'),
+    ('activations', 'serial_photo_file_id', 'TEXT'),
+    ('activations', 'box_serial_number', 'TEXT'),
+    ('activations', 'box_serial_photo_file_id', 'TEXT'),
+    ('activations', 'last_reminder_day', 'INTEGER'),
+    ('activations', 'service_provided', 'INTEGER DEFAULT 0'),
+    ('activations', 'service_provided_at', 'TEXT'),
+    ('activations', 'email', 'TEXT'),
+    ('activations', 'password', 'TEXT'),
+    ('purchases', 'username', 'TEXT'),
+    ('activations', 'username', 'TEXT'),
+]
+
+
+def _migration_001_base_schema(cursor):
+    """Исходные таблицы. На БД, созданных до миграций, добавляет недостающие колонки."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            payment_received INTEGER DEFAULT 0,
+            receipt_file_id TEXT,
+            serial_number TEXT,
+            serial_photo_file_id TEXT,
+            box_serial_number TEXT,
+            box_serial_photo_file_id TEXT,
+            kit_number TEXT,
+            status TEXT DEFAULT 'pending',
+            service_provided INTEGER DEFAULT 0,
+            service_provided_at TEXT,
+            last_reminder_day INTEGER
+        )
+    ''')
+    
+    existing = {}
+    for table in ('purchases', 'activations'):
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing[table] = {row[1] for row in cursor.fetchall()}
+    
+    for table, column, definition in LEGACY_COLUMNS:
+        if column not in existing[table]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _migration_002_indexes(cursor):
+    """Индексы под запросы database.py (проверяются скриптом check_query_plans.py)"""
+    # update_activation_receipt / update_activation_kit и обновления серийных номеров по user_id
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_activations_user_status
+        ON activations (user_id, status)
+    ''')
+    # Списки ожидающих заявок (ORDER BY created_at DESC, id DESC)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_activations_pending
+        ON activations (service_provided, created_at, id)
+    ''')
+    # Списки обработанных заявок: у заявок, обработанных до появления колонки
+    # service_provided_at, она пустая - вместо нее дата заявки
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_activations_processed_sort
+        ON activations (service_provided, COALESCE(service_provided_at, created_at), id)
+    ''')
+    # Полные списки в порядке создания
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_activations_created
+        ON activations (created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchases_created
+        ON purchases (created_at)
+    ''')
+
+
+def _bump(table, key_columns, key_values, delta):
+    """SQL для инкремента счетчика (используется внутри триггеров)"""
+    return f'''
+            INSERT INTO {table} ({key_columns}, value) VALUES ({key_values}, {delta})
+            ON CONFLICT ({key_columns}) DO UPDATE SET value = value + excluded.value;'''
+
+
+def _counter(name_sql, delta):
+    return _bump('stats_counters', 'name', name_sql, delta)
+
+
+def _daily(day_sql, name, delta):
+    return _bump('stats_daily', 'day, name', f"date({day_sql}), '{name}'", delta)
+
+
+def _migration_003_statistics(cursor):
+    """Таблицы счетчиков для статистики и триггеры, поддерживающие их при каждом изменении"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, name)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_purchases_insert AFTER INSERT ON purchases
+        BEGIN{_counter("'purchases'", 1)}{_daily('NEW.created_at', 'purchases', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_purchases_delete AFTER DELETE ON purchases
+        BEGIN{_counter("'purchases'", -1)}{_daily('OLD.created_at', 'purchases', -1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_activations_insert AFTER INSERT ON activations
+        BEGIN{_counter("'activations'", 1)}{_counter("'status:' || NEW.status", 1)}{_counter("'service_provided:' || NEW.service_provided", 1)}{_daily('NEW.created_at', 'activations', 1)}
+            INSERT INTO stats_daily (day, name, value)
+            SELECT date(NEW.service_provided_at), 'processed', 1
+            WHERE NEW.service_provided = 1 AND NEW.service_provided_at IS NOT NULL
+            ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_activations_delete AFTER DELETE ON activations
+        BEGIN{_counter("'activations'", -1)}{_counter("'status:' || OLD.status", -1)}{_counter("'service_provided:' || OLD.service_provided", -1)}{_daily('OLD.created_at', 'activations', -1)}
+            INSERT INTO stats_daily (day, name, value)
+            SELECT date(OLD.service_provided_at), 'processed', -1
+            WHERE OLD.service_provided = 1 AND OLD.service_provided_at IS NOT NULL
+            ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stats_activations_update
+        AFTER UPDATE OF status, service_provided, service_provided_at ON activations
+        WHEN OLD.status IS NOT NEW.status
+          OR OLD.service_provided IS NOT NEW.service_provided
+          OR OLD.service_provided_at IS NOT NEW.service_provided_at
+        BEGIN{_counter("'status:' || OLD.status", -1)}{_counter("'status:' || NEW.status", 1)}{_counter("'service_provided:' || OLD.service_provided", -1)}{_counter("'service_provided:' || NEW.service_provided", 1)}
+            INSERT INTO stats_daily (day, name, value)
+            SELECT date(OLD.service_provided_at), 'processed', -1
+            WHERE OLD.service_provided = 1 AND OLD.service_provided_at IS NOT NULL
+            ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_daily (day, name, value)
+            SELECT date(NEW.service_provided_at), 'processed', 1
+            WHERE NEW.service_provided = 1 AND NEW.service_provided_at IS NOT NULL
+            ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+    ''')
+    
+    # Первый запуск на существующей БД - заполняем счетчики по текущим данным
+    cursor.execute('SELECT COUNT(*) FROM stats_counters')
+    if cursor.fetchone()[0] == 0:
+        _rebuild_statistics(cursor)
+
+
+def _rebuild_statistics(cursor):
+    """Пересчитывает таблицы счетчиков по данным (по одному групповому запросу на таблицу)"""
+    cursor.execute('DELETE FROM stats_counters')
+    cursor.execute('DELETE FROM stats_daily')
+    
+    cursor.execute('''
+        INSERT INTO stats_counters (name, value)
+        SELECT 'purchases', COUNT(*) FROM purchases
+    ''')
+    counters = {'activations': 0}
+    cursor.execute('''
+        SELECT status, service_provided, COUNT(*)
+        FROM activations
+        GROUP BY status, service_provided
+    ''')
+    for status, service_provided, count in cursor.fetchall():
+        counters['activations'] += count
+        counters[f'status:{status}'] = counters.get(f'status:{status}', 0) + count
+        key = f'service_provided:{service_provided}'
+        counters[key] = counters.get(key, 0) + count
+    cursor.executemany(
+        'INSERT INTO stats_counters (name, value) VALUES (?, ?)', counters.items()
+    )
+    
+    cursor.execute('''
+        INSERT INTO stats_daily (day, name, value)
+        SELECT date(created_at), 'purchases', COUNT(*) FROM purchases GROUP BY 1
+        UNION ALL
+        SELECT date(created_at), 'activations', COUNT(*) FROM activations GROUP BY 1
+        UNION ALL
+        SELECT date(service_provided_at), 'processed', COUNT(*) FROM activations
+        WHERE service_provided = 1 AND service_provided_at IS NOT NULL GROUP BY 1
+    ''')
+
+
+def _migration_004_telegram_file_cache(cursor):
+    """file_id уже загруженных в Telegram файлов: повторная отправка без загрузки"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_file_cache (
+            key TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _schedule_reminders(ref):
+    """SQL для триггеров: строки напоминаний за 5..1 дней до окончания 30-дневной подписки.
+    Напоминание "осталось d дней" становится актуальным, когда до окончания
+    остается меньше d+1 суток, и теряет смысл, когда остается меньше d суток.
+    """
+    return f'''
+            INSERT OR REPLACE INTO reminder_schedule (activation_id, days_left, due_at, expires_at)
+            SELECT {ref}.id, d.column1,
+                   strftime('%Y-%m-%dT%H:%M:%S', {ref}.service_provided_at, (29 - d.column1) || ' days', '+1 second'),
+                   strftime('%Y-%m-%dT%H:%M:%S', {ref}.service_provided_at, (30 - d.column1) || ' days')
+            FROM (VALUES (1), (2), (3), (4), (5)) AS d
+            WHERE {ref}.service_provided = 1 AND {ref}.service_provided_at IS NOT NULL;'''
+
+
+def _migration_005_reminder_schedule(cursor):
+    """Заранее рассчитанные сроки напоминаний о подписке, поддерживаемые триггерами"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_schedule (
+            activation_id INTEGER NOT NULL,
+            days_left INTEGER NOT NULL,
+            due_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            PRIMARY KEY (activation_id, days_left)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reminder_schedule_due
+        ON reminder_schedule (due_at)
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reminders_activations_insert AFTER INSERT ON activations
+        BEGIN{_schedule_reminders('NEW')}
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reminders_activations_delete AFTER DELETE ON activations
+        BEGIN
+            DELETE FROM reminder_schedule WHERE activation_id = OLD.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reminders_activations_update
+        AFTER UPDATE OF service_provided, service_provided_at ON activations
+        WHEN OLD.service_provided IS NOT NEW.service_provided
+          OR OLD.service_provided_at IS NOT NEW.service_provided_at
+        BEGIN
+            DELETE FROM reminder_schedule WHERE activation_id = OLD.id;{_schedule_reminders('NEW')}
+        END
+    ''')
+    
+    # Существующие подписки: только еще не отправленные и не устаревшие напоминания
+    # (напоминания уходят по убыванию days_left, last_reminder_day - последнее отправленное)
+    cursor.execute('''
+        INSERT OR IGNORE INTO reminder_schedule (activation_id, days_left, due_at, expires_at)
+        SELECT a.id, d.column1,
+               strftime('%Y-%m-%dT%H:%M:%S', a.service_provided_at, (29 - d.column1) || ' days', '+1 second'),
+               strftime('%Y-%m-%dT%H:%M:%S', a.service_provided_at, (30 - d.column1) || ' days')
+        FROM activations a, (VALUES (1), (2), (3), (4), (5)) AS d
+        WHERE a.service_provided = 1 AND a.service_provided_at IS NOT NULL
+          AND (a.last_reminder_day IS NULL OR d.column1 < a.last_reminder_day)
+          AND strftime('%Y-%m-%dT%H:%M:%S', a.service_provided_at, (30 - d.column1) || ' days')
+              > strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')
+    ''')
+
+
+def _migration_006_outbox(cursor):
+    """Очередь исходящих уведомлений: пишется в той же транзакции, что и изменение данных"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            dedupe_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            sent_at TEXT,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (next_attempt_at) WHERE status = 'pending'
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_created
+        ON outbox (created_at)
+    ''')
+
+
+def _migration_007_persistence(cursor):
+    """Состояние диалогов ConversationHandler и user_data (переживают перезапуск бота)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persistence_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persistence_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+
+
+# Колонки полнотекстового поиска (см. database.search_requests)
+ACTIVATIONS_FTS_COLUMNS = ('name', 'username', 'phone', 'serial_number', 'box_serial_number', 'kit_number', 'email')
+PURCHASES_FTS_COLUMNS = ('name', 'username', 'phone')
+
+
+def _fts_sync_triggers(cursor, table, columns):
+    """Триггеры, поддерживающие external content FTS5 таблицу {table}_fts в актуальном состоянии"""
+    fts = f'{table}_fts'
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{column}' for column in columns)
+    old_values = ', '.join(f'OLD.{column}' for column in columns)
+    insert = f"INSERT INTO {fts} (rowid, {column_list}) VALUES (NEW.id, {new_values});"
+    delete = f"INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table}
+        BEGIN {insert} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table}
+        BEGIN {delete} END
+    ''')
+    # Только при изменении индексируемых колонок: смена статуса или чека индекс не трогает
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} ON {table}
+        BEGIN {delete} {insert} END
+    ''')
+
+
+def _migration_008_search(cursor):
+    """Поиск заявок: FTS5 по имени, username, телефону, серийным номерам и email,
+    индексы для поиска по началу телефона и серийных номеров"""
+    for table, columns in (('activations', ACTIVATIONS_FTS_COLUMNS), ('purchases', PURCHASES_FTS_COLUMNS)):
+        # prefix - отдельные индексы префиксов для запросов "токен*"
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5 (
+                {', '.join(columns)},
+                content='{table}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            )
+        ''')
+        _fts_sync_triggers(cursor, table, columns)
+        # Заполнение по уже существующим строкам
+        cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+    
+    # Телефон хранится нормализованным (+7XXXXXXXXXX), поиск - по диапазону начала номера
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_activations_phone
+        ON activations (phone)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchases_phone
+        ON purchases (phone)
+    ''')
+    # Серийные номера вводятся в произвольном регистре - индексы по upper()
+    for column in ('serial_number', 'box_serial_number', 'kit_number'):
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_activations_{column}_upper
+            ON activations (upper({column}))
+        ''')
+
+
+# (версия, название, функция). Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'base_schema', _migration_001_base_schema),
+    (2, 'indexes', _migration_002_indexes),
+    (3, 'statistics', _migration_003_statistics),
+    (4, 'telegram_file_cache', _migration_004_telegram_file_cache),
+    (5, 'reminder_schedule', _migration_005_reminder_schedule),
+    (6, 'outbox', _migration_006_outbox),
+    (7, 'persistence', _migration_007_persistence),
+    (8, 'search', _migration_008_search),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции в одной транзакции.
+    На актуальной схеме стоит одного чтения PRAGMA user_version.
+    Возвращает список примененных миграций [(версия, название, длительность_мс)].
+    """
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    
+    # IMMEDIATE сразу берет блокировку записи: параллельно стартующий экземпляр
+    # дождется ее (busy_timeout) и увидит уже обновленную версию
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = get_schema_version(conn)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL,
+                duration_ms REAL NOT NULL
+            )
+        ''')
+        
+        applied = []
+        for version, name, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.perf_counter()
+            migration(cursor)
+            duration_ms = (time.perf_counter() - started) * 1000
+            cursor.execute(
+                'INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)',
+                (version, name, datetime.now().isoformat(), duration_ms)
+            )
+            cursor.execute(f'PRAGMA user_version = {version}')
+            applied.append((version, name, duration_ms))
+        
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    
+    for version, name, duration_ms in applied:
+        logger.info("Миграция %03d (%s) применена за %.1f мс", version, name, duration_ms)
+    return applied
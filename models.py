@@ -0,0 +1,92 @@
+from typing import NamedTuple, Optional
+
+
+# Записи БД - кортежи с именованными полями: без __dict__ на каждую строку,
+# по-прежнему распаковываются и индексируются как обычные кортежи.
+# Порядок полей совпадает с колонками SELECT в database.py.
+
+class Activation(NamedTuple):
+    id: int
+    user_id: int
+    phone: str
+    name: str
+    username: Optional[str]
+    created_at: str
+    payment_received: int
+    receipt_file_id: Optional[str]
+    serial_number: Optional[str]
+    serial_photo_file_id: Optional[str]
+    box_serial_number: Optional[str]
+    box_serial_photo_file_id: Optional[str]
+    kit_number: Optional[str]
+    status: str
+    service_provided: int
+    service_provided_at: Optional[str]
+    email: Optional[str]
+    password: Optional[str]
+
+    @property
+    def request_number(self):
+        return f"ST-{self.id:06d}"
+
+
+class ActivationListItem(NamedTuple):
+    """Строка списка заявок в меню админа - колонки для кнопки и курсор страницы"""
+    id: int
+    phone: str
+    name: str
+    email: Optional[str]
+    created_at: str
+
+    @property
+    def request_number(self):
+        return f"ST-{self.id:06d}"
+
+
+class ActivationPageItem(NamedTuple):
+    """Строка страницы ожидающих/обработанных заявок: sort_key - значение сортировки для курсора"""
+    id: int
+    phone: str
+    name: str
+    sort_key: str
+
+    @property
+    def request_number(self):
+        return f"ST-{self.id:06d}"
+
+
+class Purchase(NamedTuple):
+    id: int
+    user_id: int
+    phone: str
+    name: str
+    username: Optional[str]
+    created_at: str
+
+    @property
+    def request_number(self):
+        return f"BUY-{self.id:06d}"
+
+
+class SearchResult(NamedTuple):
+    """Найденная заявка: kind - префикс номера заявки (ST - активация, BUY - покупка)"""
+    kind: str
+    id: int
+    name: str
+    phone: str
+
+    @property
+    def request_number(self):
+        return f"{self.kind}-{self.id:06d}"
+
+
+def row_factory(model):
+    """row_factory для sqlite3: строка результата сразу создается как model"""
+    make = model._make
+    return lambda cursor, row: make(row)
+
+
+# Колонки запросов в порядке полей моделей
+ACTIVATION_COLUMNS = ', '.join(Activation._fields)
+ACTIVATION_LIST_COLUMNS = ', '.join(ActivationListItem._fields)
+PURCHASE_COLUMNS = ', '.join(Purchase._fields)
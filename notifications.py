@@ -0,0 +1,31 @@
+# Тексты уведомлений, которые отправляются через outbox.
+# Каждая функция возвращает (dedupe_key, chat_id, text, parse_mode):
+# повторная постановка сообщения с тем же ключом игнорируется.
+
+
+def activation_created_key(activation_id):
+    return f"activation_created:{activation_id}"
+
+
+def activation_created(activation_id, user_id):
+    request_number = f"ST-{activation_id:06d}"
+    text = (
+        f"✅ Заявка создана!\n\n"
+        f"Номер вашей заявки: <b>{request_number}</b>\n\n"
+        f"Сохраните этот номер для отслеживания статуса."
+    )
+    return activation_created_key(activation_id), user_id, text, 'HTML'
+
+
+def payment_received(user_id, charge_id):
+    text = (
+        "✅ Платеж успешно получен!\n\n"
+        "Пожалуйста, ожидайте. ⏳\n\n"
+        "Мы свяжемся с вами в ближайшее время."
+    )
+    return f"payment:{charge_id}", user_id, text, None
+
+
+def subscription_reminder(activation_id, days_left, user_id, service_provided_at, text):
+    # Ключ включает дату обработки: после повторной отметки это уже другая подписка
+    return f"reminder:{activation_id}:{days_left}:{service_provided_at}", user_id, text, None
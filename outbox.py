@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden, BadRequest
+
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_DELAY,
+    OUTBOX_RETENTION_DAYS,
+)
+from database_async import (
+    get_pending_outbox,
+    get_outbox_message,
+    filter_pending_outbox,
+    mark_outbox_sent,
+    mark_outbox_failed,
+    purge_outbox,
+)
+from delivery import pipeline
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_RETRY_DELAY = 3600
+PURGE_INTERVAL = 3600
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class OutboxWorker:
+    """Доставляет сообщения из таблицы outbox (доставка "хотя бы один раз").
+
+    Сообщения ставятся в outbox в одной транзакции с изменением данных,
+    фоновая задача отправляет их пачками через общий конвейер доставки.
+    Неудачные отправки повторяются с экспоненциальной задержкой, после
+    OUTBOX_MAX_ATTEMPTS попыток (или сразу, если чат недоступен) сообщение
+    помечается как failed.
+    """
+
+    def __init__(self, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, base_delay=OUTBOX_RETRY_BASE_DELAY):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._wakeup = None
+        self._task = None
+        # Сообщения, отправляемые прямо сейчас (deliver_now или фоновая задача)
+        self._in_flight = set()
+        self._last_purge = None
+
+    def start(self, bot):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def kick(self):
+        """Разбудить фоновую задачу: в outbox появились новые сообщения"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def deliver_now(self, bot, dedupe_key):
+        """Отправить сообщение сразу, не дожидаясь фоновой задачи (например, ответ в диалоге,
+        порядок которого важен). При ошибке сообщение останется в outbox для повтора.
+        """
+        row = await get_outbox_message(dedupe_key)
+        if row is None or row[0] in self._in_flight:
+            return
+        await self._deliver(bot, [row])
+
+    async def _run(self, bot):
+        while True:
+            try:
+                count = await self.drain(bot)
+                await self._purge()
+            except Exception:
+                logger.exception("Ошибка обработки outbox")
+                count = 0
+            if count >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain(self, bot):
+        """Отправляет одну пачку сообщений, которым подошел срок. Возвращает размер пачки."""
+        rows = await get_pending_outbox(_now(), self.batch_size)
+        if not rows:
+            return 0
+        return await self._deliver(bot, rows)
+
+    async def _deliver(self, bot, rows):
+        """Отправляет rows, кроме уже отправляемых или отправленных. Возвращает число отправляемых."""
+        rows = [row for row in rows if row[0] not in self._in_flight]
+        ids = {row[0] for row in rows}
+        if not ids:
+            return 0
+        self._in_flight |= ids
+        try:
+            # Строки прочитаны до захвата: пока шло чтение, их мог отправить и отметить
+            # deliver_now. После захвата статус перечитывается, чтобы не отправить дважды.
+            pending = set(await filter_pending_outbox(ids))
+            rows = [row for row in rows if row[0] in pending]
+            by_parse_mode = {}
+            for message_id, chat_id, text, parse_mode, attempts in rows:
+                by_parse_mode.setdefault(parse_mode, []).append((message_id, chat_id, text))
+            attempts = {row[0]: row[4] for row in rows}
+
+            sent, failures = [], []
+            for parse_mode, messages in by_parse_mode.items():
+                report = await pipeline.deliver(bot, messages, name="Outbox", parse_mode=parse_mode)
+                if len(messages) > 1 or report.failed:
+                    logger.info(report.summary())
+                sent.extend(report.sent)
+                for message_id, error in report.failed:
+                    failures.append((message_id, self._next_attempt(attempts[message_id], error), str(error)))
+
+            if sent:
+                await mark_outbox_sent(sent)
+            if failures:
+                await mark_outbox_failed(failures)
+            return len(rows)
+        finally:
+            self._in_flight -= ids
+
+    def _next_attempt(self, attempts, error):
+        """Срок следующей попытки или None, если повторять бессмысленно"""
+        if isinstance(error, (Forbidden, BadRequest)) or attempts + 1 >= self.max_attempts:
+            return None
+        delay = min(self.base_delay * 2 ** attempts, MAX_RETRY_DELAY)
+        return (datetime.now() + timedelta(seconds=delay)).isoformat(timespec='seconds')
+
+    async def _purge(self):
+        now = datetime.now()
+        if self._last_purge and (now - self._last_purge).total_seconds() < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        before = (now - timedelta(days=OUTBOX_RETENTION_DAYS)).isoformat(timespec='seconds')
+        removed = await purge_outbox(before)
+        if removed:
+            logger.info("Outbox: удалено %s старых сообщений", removed)
+
+
+outbox = OutboxWorker()
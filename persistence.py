@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import PERSISTENCE_UPDATE_INTERVAL
+from database_async import load_persisted_user_data, load_persisted_conversations, save_persisted_state
+
+
+logger = logging.getLogger(__name__)
+
+
+# Ключи админ-панели (авторизация, вводимые email/пароль) не сохраняются в БД:
+# после перезапуска админ заново вводит пароль
+NOT_PERSISTED_PREFIXES = ('admin_', 'cred_')
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _persisted_fields(data):
+    return {key: value for key, value in data.items() if not str(key).startswith(NOT_PERSISTED_PREFIXES)}
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит состояния ConversationHandler и user_data в БД бота.
+
+    Application сам передает изменения раз в update_interval секунд и только
+    по затронутым ключам. Вызовы update_* одного прохода лишь запоминают данные
+    в памяти, а запись в БД идет одной транзакцией в потоке БД, не задерживая
+    обработку обновлений. Данные хранятся компактным JSON.
+    """
+
+    def __init__(self, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._user_data = {}
+        self._dropped_users = set()
+        self._conversations = {}
+        self._flush_task = None
+
+    async def get_user_data(self):
+        return {user_id: _persisted_fields(json.loads(data)) for user_id, data in await load_persisted_user_data()}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): json.loads(state) for key, state in await load_persisted_conversations(name)}
+
+    async def update_user_data(self, user_id, data):
+        self._dropped_users.discard(user_id)
+        self._user_data[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._user_data.pop(user_id, None)
+        self._dropped_users.add(user_id)
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversations[(name, _encode(list(key)))] = new_state
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_flush(self):
+        # Один проход Application.update_persistence вызывает update_* параллельно -
+        # все они попадут в одну запись
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    def _has_pending(self):
+        return bool(self._user_data or self._dropped_users or self._conversations)
+
+    async def _flush_pending(self):
+        try:
+            await asyncio.sleep(0)
+            await self._write()
+        except Exception:
+            # Несохраненное будет записано вместе со следующим проходом update_persistence
+            logger.exception("Ошибка сохранения состояния диалогов")
+            self._flush_task = None
+            return
+        self._flush_task = None
+        # Изменения, пришедшие во время записи, уходят следующей записью
+        if self._has_pending():
+            self._schedule_flush()
+
+    async def _write(self):
+        if not self._has_pending():
+            return
+        user_data, self._user_data = self._user_data, {}
+        dropped_users, self._dropped_users = self._dropped_users, set()
+        conversations, self._conversations = self._conversations, {}
+        encoded_user_data = []
+        for user_id, data in user_data.items():
+            try:
+                encoded_user_data.append((user_id, _encode(_persisted_fields(data))))
+            except (TypeError, ValueError):
+                # Одно несериализуемое значение не должно останавливать сохранение остальных
+                logger.exception("user_data пользователя %s не сохранено: значение не сериализуется в JSON", user_id)
+        try:
+            await save_persisted_state(
+                encoded_user_data,
+                list(dropped_users),
+                [(name, key, _encode(state)) for (name, key), state in conversations.items() if state is not None],
+                [(name, key) for (name, key), state in conversations.items() if state is None],
+            )
+        except Exception:
+            # Возвращаем несохраненное, не затирая более новые изменения
+            for user_id, data in user_data.items():
+                if user_id not in self._dropped_users:
+                    self._user_data.setdefault(user_id, data)
+            for user_id in dropped_users:
+                if user_id not in self._user_data:
+                    self._dropped_users.add(user_id)
+            for key, state in conversations.items():
+                self._conversations.setdefault(key, state)
+            raise
+
+    async def flush(self):
+        """Вызывается при остановке бота: дописывает все, что еще не сохранено"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
@@ -0,0 +1,128 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from config import REMINDER_PREFETCH, REMINDER_MAX_SLEEP
+from database_async import (
+    get_upcoming_reminders,
+    get_activation_reminders,
+    get_due_reminders,
+    complete_reminders,
+    queue_reminders,
+)
+from outbox import outbox
+
+
+logger = logging.getLogger(__name__)
+
+
+SUBSCRIPTION_DAYS = 30
+JOB_NAME = "subscription_reminders"
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def reminder_text(days_left, service_provided_at):
+    end_date = datetime.fromisoformat(service_provided_at) + timedelta(days=SUBSCRIPTION_DAYS)
+    return (
+        f"⏰ Напоминание о подписке\n\n"
+        f"Ваша подписка Starlink заканчивается через {days_left} день(дня/дней).\n"
+        f"Дата окончания: {end_date.strftime('%d.%m.%Y')}\n\n"
+        f"Пожалуйста, продлите подписку."
+    )
+
+
+class ReminderScheduler:
+    """Напоминания о подписке по расписанию из таблицы reminder_schedule.
+
+    Сроки рассчитываются триггерами при отметке заявки, в памяти держится
+    min-куча ближайших сроков (due_at, activation_id, days_left), и задача
+    job_queue будится ровно к сроку первого из них. Работа пропорциональна
+    числу наступивших напоминаний, а не числу клиентов.
+
+    Элементы кучи не удаляются при снятии отметки: источник истины - БД,
+    устаревший элемент приводит лишь к пустому пробуждению.
+    """
+
+    def __init__(self, prefetch=REMINDER_PREFETCH, max_sleep=REMINDER_MAX_SLEEP):
+        self.prefetch = prefetch
+        self.max_sleep = max_sleep
+        self._heap = []
+        self._job_queue = None
+        self._job = None
+        self._armed_for = None
+
+    def start(self, job_queue, first=10):
+        self._job_queue = job_queue
+        self._arm(first)
+
+    async def reschedule(self, activation_id):
+        """Вызывается после изменения отметки заявки: добавляет ее новые сроки в кучу"""
+        for item in await get_activation_reminders(activation_id):
+            heapq.heappush(self._heap, tuple(item))
+        if self._job_queue and self._heap and self._heap[0][0] < self._armed_for:
+            self._arm_next()
+
+    def _arm(self, delay):
+        if self._job is not None:
+            self._job.schedule_removal()
+        # Время пробуждения в формате due_at - для сравнения со сроками новых напоминаний
+        self._armed_for = (datetime.now() + timedelta(seconds=delay)).isoformat(timespec='seconds')
+        self._job = self._job_queue.run_once(self._on_timer, when=delay, name=JOB_NAME)
+
+    def _arm_next(self):
+        if not self._heap:
+            self._arm(self.max_sleep)
+            return
+        due_at = self._heap[0][0]
+        delay = (datetime.fromisoformat(due_at) - datetime.now()).total_seconds()
+        self._arm(min(max(delay, 0), self.max_sleep))
+
+    async def _refill(self):
+        self._heap = [tuple(item) for item in await get_upcoming_reminders(self.prefetch)]
+        heapq.heapify(self._heap)
+
+    async def _on_timer(self, context):
+        self._job = None
+        try:
+            await self.run_due()
+        except Exception:
+            logger.exception("Ошибка обработки напоминаний")
+        try:
+            # Заново читаем ближайшие сроки: так подхватываются и изменения, сделанные в обход планировщика
+            await self._refill()
+        except Exception:
+            logger.exception("Ошибка загрузки расписания напоминаний")
+        self._arm_next()
+
+    async def run_due(self):
+        """Переносит все наступившие напоминания в outbox (отправка и повторы - там).
+        Возвращает количество поставленных в очередь.
+        """
+        now = _now()
+        while self._heap and self._heap[0][0] <= now:
+            heapq.heappop(self._heap)
+
+        queued = 0
+        while True:
+            due = await get_due_reminders(now, self.prefetch)
+            expired = [(act_id, days_left) for act_id, days_left, expires_at, _, _ in due if expires_at <= now]
+            if expired:
+                # Бот был остановлен и срок напоминания прошел - следующее напоминание актуальнее
+                await complete_reminders(expired)
+            reminders = [
+                (act_id, days_left, user_id, service_provided_at, reminder_text(days_left, service_provided_at))
+                for act_id, days_left, expires_at, user_id, service_provided_at in due
+                if expires_at > now
+            ]
+            if reminders:
+                await queue_reminders(reminders)
+                outbox.kick()
+                queued += len(reminders)
+            if len(due) < self.prefetch:
+                return queued
+
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Отправка записанных обновлений Telegram на локальный webhook (проверка режима webhook).
+# Запуск: python replay_updates.py updates.jsonl [--url http://127.0.0.1:8080/telegram] [--secret ...]
+# Файл - JSON массив обновлений или по одному обновлению в строке (JSON Lines).
+# Без файла отправляется одно синтетическое обновление с командой /start.
+
+import argparse
+import http.client
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+
+def sample_update(update_id=1, user_id=1001):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def replay(updates, url, secret):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    timings = []
+    failed = 0
+    for update in updates:
+        body = json.dumps(update).encode()
+        started = time.perf_counter()
+        conn.request('POST', parts.path or '/', body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status != 200:
+            failed += 1
+            print(f"✗ update_id={update.get('update_id')}: HTTP {response.status}")
+    conn.close()
+    return timings, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на локальный webhook")
+    parser.add_argument('file', nargs='?', help="JSON / JSON Lines файл с обновлениями")
+    parser.add_argument('--url', default=f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else [sample_update()]
+    timings, failed = replay(updates, args.url, args.secret)
+
+    timings.sort()
+    print(f"\nОтправлено: {len(timings)}, ошибок: {failed}")
+    if timings:
+        print(f"Время ответа: среднее {sum(timings) / len(timings):.1f} мс, "
+              f"p50 {timings[len(timings) // 2]:.1f} мс, максимум {timings[-1]:.1f} мс")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import time
+from datetime import date, timedelta
+
+from config import STATS_CACHE_TTL
+from database_async import get_statistics, get_daily_statistics, get_weekly_statistics
+
+
+DAILY_DAYS = 7
+WEEKLY_WEEKS = 4
+
+_cache = {'expires_at': 0.0, 'value': None}
+
+
+def invalidate_dashboard():
+    """Сбрасывает кэш: после действий админа (отметка, смена статуса, удаление)
+    панель сразу показывает новые счетчики"""
+    _cache['expires_at'] = 0.0
+
+
+async def get_dashboard():
+    """Сводные счетчики + разбивка по дням и неделям. Отдается из кэша не дольше STATS_CACHE_TTL секунд."""
+    now = time.monotonic()
+    if _cache['value'] is not None and now < _cache['expires_at']:
+        return _cache['value']
+    
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday())
+    dashboard = {
+        'totals': await get_statistics(),
+        'daily': await get_daily_statistics((today - timedelta(days=DAILY_DAYS - 1)).isoformat()),
+        'weekly': await get_weekly_statistics((week_start - timedelta(weeks=WEEKLY_WEEKS - 1)).isoformat()),
+    }
+    _cache['value'] = dashboard
+    _cache['expires_at'] = now + STATS_CACHE_TTL
+    return dashboard
+
+
+def _period_line(label, counters):
+    return (
+        f"{label}: 🛒 {counters.get('purchases', 0)} / "
+        f"⚙️ {counters.get('activations', 0)} / "
+        f"✅ {counters.get('processed', 0)}\n"
+    )
+
+
+def format_dashboard(dashboard):
+    """Текст для кнопки «📊 Статистика»"""
+    stats = dashboard['totals']
+    text = (
+        f"📊 Статистика\n\n"
+        f"🛒 Всего покупок: {stats['total_purchases']}\n"
+        f"⚙️ Всего активаций: {stats['total_activations']}\n\n"
+        f"⏳ Ожидают оплаты: {stats['pending_activations']}\n"
+        f"💳 Оплата подтверждена: {stats['payment_confirmed']}\n"
+        f"✅ Завершено: {stats['completed_activations']}\n"
+    )
+    
+    today = date.today()
+    text += "\n📅 По дням (🛒 покупки / ⚙️ активации / ✅ обработано):\n"
+    for offset in range(DAILY_DAYS - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        text += _period_line(day, dashboard['daily'].get(day, {}))
+    
+    week_start = today - timedelta(days=today.weekday())
+    text += "\n🗓 По неделям (с понедельника):\n"
+    for offset in range(WEEKLY_WEEKS - 1, -1, -1):
+        week = (week_start - timedelta(weeks=offset)).isoformat()
+        text += _period_line(week, dashboard['weekly'].get(week, {}))
+    
+    return text
@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY, UPDATE_QUEUE_LIMIT
+
+
+class _KeyState:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя (или чата, если пользователя нет)
+    обрабатываются строго по очереди - состояние ConversationHandler и
+    user_data не гонятся. Одновременно выполняется не больше `concurrency`
+    обработчиков; ожидающие своей очереди обновления слот не занимают,
+    поэтому пользователь с потоком сообщений не блокирует остальных.
+    Всего в работе и в очереди - не больше `queue_limit` обновлений
+    (ограничение BaseUpdateProcessor).
+    """
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, queue_limit=UPDATE_QUEUE_LIMIT):
+        super().__init__(max_concurrent_updates=max(queue_limit, concurrency))
+        self.concurrency = concurrency
+        self._slots = None
+        self._keys = {}
+        self.active = 0
+        self.max_active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.total_wait_time = 0.0
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        state = None
+        if key is not None:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState()
+            state.pending += 1
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        waiting = True
+        locked = False
+        wait_started = time.perf_counter()
+        try:
+            if state is not None:
+                await state.lock.acquire()
+                locked = True
+            async with self._slots:
+                waiting = False
+                self.queued -= 1
+                self.total_wait_time += time.perf_counter() - wait_started
+                await self._run(coroutine)
+        finally:
+            if locked:
+                state.lock.release()
+            if waiting:
+                # Отмена во время ожидания очереди (остановка бота)
+                self.queued -= 1
+                coroutine.close()
+            if state is not None:
+                state.pending -= 1
+                if state.pending == 0:
+                    del self._keys[key]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        started = time.perf_counter()
+        try:
+            await coroutine
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self.processed += 1
+            self.total_time += time.perf_counter() - started
+
+    def metrics(self):
+        return {
+            'concurrency': self.concurrency,
+            'queue_limit': self.max_concurrent_updates,
+            'active': self.active,
+            'max_active': self.max_active,
+            'queue_depth': self.queued,
+            'max_queue_depth': self.max_queued,
+            'users_in_flight': len(self._keys),
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_time': self.total_time / self.processed if self.processed else 0.0,
+            'avg_wait_time': self.total_wait_time / self.processed if self.processed else 0.0,
+        }
+
+
+update_processor = PerUserUpdateProcessor()
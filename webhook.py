@@ -0,0 +1,81 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from http import HTTPStatus
+
+from telegram import Update
+
+from config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from http_server import HTTPServer, Response
+
+
+logger = logging.getLogger(__name__)
+
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+def webhook_handler(application, secret_token):
+    """Обработчик POST запросов Telegram: проверяет секрет и кладет Update в очередь приложения"""
+    async def handle(request):
+        if secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, '').encode(), secret_token.encode()
+        ):
+            return Response(HTTPStatus.FORBIDDEN)
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Некорректное обновление в webhook: %s", e)
+            return Response(HTTPStatus.BAD_REQUEST)
+        if update is None:
+            return Response(HTTPStatus.BAD_REQUEST)
+        # Ответ Telegram не ждет обработки: обновление обрабатывается из очереди
+        await application.update_queue.put(update)
+        return Response(HTTPStatus.OK)
+    return handle
+
+
+async def serve_webhook(application, allowed_updates, routes=()):
+    """Запуск бота в режиме webhook на встроенном HTTP сервере.
+    Повторяет жизненный цикл Application.run_polling: post_init, обработка до
+    SIGINT/SIGTERM, затем stop, post_stop, shutdown и post_shutdown.
+    routes - дополнительные маршруты (метод, путь, обработчик) того же сервера.
+    """
+    server = HTTPServer(WEBHOOK_LISTEN, WEBHOOK_PORT)
+    server.route('POST', WEBHOOK_PATH, webhook_handler(application, WEBHOOK_SECRET))
+    for method, path, handler in routes:
+        server.route(method, path, handler)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+        )
+        await application.start()
+        logger.info("Webhook сервер слушает %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)